@@ -13,12 +13,62 @@ class Config:
             """Инициализация настроек с параметрами по умолчанию"""
             self.filepath = filepath
             self.CAMERA_RESOLUTION = (1920, 1080)  # Разрешение видеопотока
+            self.CAMERA_PROFILES = {"720p": [1280, 720], "360p": [640, 360]}  # Дополнительные профили разрешения
             self.JPEG_QUALITY = 50  # Качество сжатия JPEG
             self.DATABASE_URL = "sqlite:///./app.db"  # URL для подключения к базе данных SQLite
             self.SECRET_KEY = "your_secret_key"  # Секретный ключ для JWT
             self.ALGORITHM = "HS256"  # Алгоритм шифрования JWT
             self.ACCESS_TOKEN_EXPIRE_MINUTES = 30  # Время жизни токена доступа
             self.FACE_RECOGNITION = False  # По умолчанию лицо не распознается
+            self.CAPTURE_MODE = "thread"  # Режим захвата: "thread" (поток на камеру) или "process" (пул процессов)
+            self.CAPTURE_PROCESSES = 0  # Число процессов захвата, 0 — по числу ядер
+            self.FRAME_RING_SIZE = 4  # Число кадров в кольце разделяемой памяти на камеру
+            self.WEBRTC_SHARED_ENCODER = True  # Кодировать кадр один раз на камеру для всех WebRTC-зрителей (H.264)
+            self.ENCODER_BITRATE = 2000000  # Битрейт общего кодировщика, бит/с
+            self.ENCODER_PRESET = "ultrafast"  # Пресет x264 общего кодировщика
+            self.ENCODER_KEYFRAME_INTERVAL = 2.0  # Максимальный интервал между ключевыми кадрами, с
+            self.PACKET_QUEUE_SIZE = 120  # Размер очереди пакетов одного зрителя
+            self.CHANGE_DETECTION = "pixels"  # Проверка изменений кадра: "pixels", "pts" или "off"
+            self.CHANGE_DETECTION_WIDTH = 160  # Ширина уменьшенного кадра для сравнения пикселей
+            self.CHANGE_PIXEL_DELTA = 12  # Разница яркости, с которой пиксель считается изменившимся
+            self.CHANGE_THRESHOLD = 0.002  # Доля изменившихся пикселей, с которой кадр считается новым
+            self.OVERLAY_OPACITY = 1.0  # Непрозрачность фона надписи на кадре (0..1)
+            self.MODULE_WORKERS = 4  # Потоков для локальных модулей, 0 — по умолчанию Python
+            self.MODULE_QUEUE_SIZE = 8  # Размер очереди кадров каждого локального модуля
+            self.MODULE_QUEUE_POLICY = "drop_oldest"  # Что отбрасывать при переполнении: "drop_oldest" или "drop_newest"
+            self.MODULE_LOG_SIZE = 1000  # Записей в журнале каждого модуля; старые записи вытесняются
+            self.DISPATCH_CAMERA_LIMIT = 1  # Кадров одной камеры одновременно в обработке модулями
+            self.DISPATCH_GLOBAL_LIMIT = 20  # Кадров всех камер одновременно в обработке модулями
+            self.MODULE_HTTP_POOL_SIZE = 4  # Соединений в пуле HTTP-клиента сетевого модуля
+            self.MODULE_HTTP_KEEPALIVE = 30  # Время жизни неиспользуемого соединения, с
+            self.MODULE_HTTP_TIMEOUT = 30  # Общий таймаут запроса к сетевому модулю, с
+            self.MODULE_HTTP_CONNECT_TIMEOUT = 10  # Таймаут установления соединения, с
+            self.NETWORK_MODULE_EVERY_N = 10  # Каждый N-й кадр камеры для сетевых модулей без своей частоты
+            self.MODULE_STREAM_WINDOW = 16  # Кадров без ответа в потоковом канале сетевого модуля (ws://)
+            self.MODULE_STREAM_PENDING_TIMEOUT = 0.5  # Через сколько секунд кадр без ответа освобождает место в окне потокового канала
+            self.MODULE_REQUEST_LIMIT = 2  # Одновременных запросов к одному сетевому модулю; кадры сверх лимита ему не отправляются
+            self.RESULT_BUFFER_SIZE = 500  # Последних результатов модулей в памяти на каждую камеру
+            self.RESULT_BATCH_SIZE = 500  # Результатов в одной пакетной записи в базу данных
+            self.RESULT_FLUSH_INTERVAL = 1.0  # Как часто записывать накопленные результаты в базу, с
+            self.RECORDING_SEGMENT_DURATION = 300  # Длительность сегмента записи, с (сегмент закрывается на ключевом кадре)
+            self.RECORDING_CONTAINER = "mp4"  # Контейнер сегментов записи: "mp4" (фрагментированный) или "mkv"
+            self.RECORDING_BITRATE = 4000000  # Битрейт кодировщика записи, бит/с (кроме режима "event": там ENCODER_BITRATE)
+            self.RECORDING_PRESET = "veryfast"  # Пресет x264 кодировщика записи (кроме режима "event": там ENCODER_PRESET)
+            self.RECORDING_MODE = "continuous"  # "continuous" — запись всегда, "event" — только при событиях
+            self.RECORDING_PRE_EVENT = 5  # Секунд записи до события (буфер сжатых пакетов в памяти)
+            self.RECORDING_POST_EVENT = 10  # Запись продолжается, пока события не прекратятся на столько секунд
+            self.RECORDING_TRIGGERS = ["motion", "results"]  # Что запускает запись: изменения в кадре и/или результаты модулей
+            self.RECORDING_TRIGGER_MODULES = []  # Результаты каких модулей запускают запись, пусто — любых
+            self.RETENTION_MAX_BYTES = 0  # Наибольший объём всех записей, байт; 0 — без ограничения
+            self.RETENTION_CAMERA_MAX_BYTES = 0  # Наибольший объём записей одной камеры, байт; 0 — без ограничения
+            self.RETENTION_CAMERA_LIMITS = {}  # Объём записей отдельных камер по идентификатору, байт; заменяет RETENTION_CAMERA_MAX_BYTES
+            self.RETENTION_MAX_AGE = 0  # Наибольший возраст записей, с; 0 — без ограничения
+            self.RETENTION_MIN_FREE_BYTES = 0  # Свободное место на диске записей, ниже которого удаляются самые старые записи, байт; 0 — без ограничения
+            self.RETENTION_INTERVAL = 60  # Как часто проверять квоты записей, с
+            self.HLS_SEGMENT_DURATION = 2.0  # Наименьшая длительность сегмента HLS, с; сегмент начинается с ключевого кадра
+            self.HLS_PART_DURATION = 0.5  # Наибольшая длительность части сегмента для LL-HLS, с
+            self.HLS_SEGMENT_COUNT = 6  # Сегментов в плейлисте HLS
+            self.HLS_IDLE_TIMEOUT = 30  # HLS камеры останавливается, если к нему не обращаются столько секунд
             self._load_settings()  # Попытка загрузить настройки из файла
 
         def _load_settings(self):
@@ -28,12 +78,62 @@ class Config:
                     with open(self.filepath, "r") as file:
                         data = json.load(file)
                         self.CAMERA_RESOLUTION = tuple(data.get("CAMERA_RESOLUTION", self.CAMERA_RESOLUTION))
+                        self.CAMERA_PROFILES = data.get("CAMERA_PROFILES", self.CAMERA_PROFILES)
                         self.JPEG_QUALITY = data.get("JPEG_QUALITY", self.JPEG_QUALITY)
                         self.DATABASE_URL = data.get("DATABASE_URL", self.DATABASE_URL)
                         self.SECRET_KEY = data.get("SECRET_KEY", self.SECRET_KEY)
                         self.ALGORITHM = data.get("ALGORITHM", self.ALGORITHM)
                         self.ACCESS_TOKEN_EXPIRE_MINUTES = data.get("ACCESS_TOKEN_EXPIRE_MINUTES", self.ACCESS_TOKEN_EXPIRE_MINUTES)
                         self.FACE_RECOGNITION = data.get("FACE_RECOGNITION", self.FACE_RECOGNITION)
+                        self.CAPTURE_MODE = data.get("CAPTURE_MODE", self.CAPTURE_MODE)
+                        self.CAPTURE_PROCESSES = data.get("CAPTURE_PROCESSES", self.CAPTURE_PROCESSES)
+                        self.FRAME_RING_SIZE = data.get("FRAME_RING_SIZE", self.FRAME_RING_SIZE)
+                        self.WEBRTC_SHARED_ENCODER = data.get("WEBRTC_SHARED_ENCODER", self.WEBRTC_SHARED_ENCODER)
+                        self.ENCODER_BITRATE = data.get("ENCODER_BITRATE", self.ENCODER_BITRATE)
+                        self.ENCODER_PRESET = data.get("ENCODER_PRESET", self.ENCODER_PRESET)
+                        self.ENCODER_KEYFRAME_INTERVAL = data.get("ENCODER_KEYFRAME_INTERVAL", self.ENCODER_KEYFRAME_INTERVAL)
+                        self.PACKET_QUEUE_SIZE = data.get("PACKET_QUEUE_SIZE", self.PACKET_QUEUE_SIZE)
+                        self.CHANGE_DETECTION = data.get("CHANGE_DETECTION", self.CHANGE_DETECTION)
+                        self.CHANGE_DETECTION_WIDTH = data.get("CHANGE_DETECTION_WIDTH", self.CHANGE_DETECTION_WIDTH)
+                        self.CHANGE_PIXEL_DELTA = data.get("CHANGE_PIXEL_DELTA", self.CHANGE_PIXEL_DELTA)
+                        self.CHANGE_THRESHOLD = data.get("CHANGE_THRESHOLD", self.CHANGE_THRESHOLD)
+                        self.OVERLAY_OPACITY = data.get("OVERLAY_OPACITY", self.OVERLAY_OPACITY)
+                        self.MODULE_WORKERS = data.get("MODULE_WORKERS", self.MODULE_WORKERS)
+                        self.MODULE_QUEUE_SIZE = data.get("MODULE_QUEUE_SIZE", self.MODULE_QUEUE_SIZE)
+                        self.MODULE_QUEUE_POLICY = data.get("MODULE_QUEUE_POLICY", self.MODULE_QUEUE_POLICY)
+                        self.MODULE_LOG_SIZE = data.get("MODULE_LOG_SIZE", self.MODULE_LOG_SIZE)
+                        self.DISPATCH_CAMERA_LIMIT = data.get("DISPATCH_CAMERA_LIMIT", self.DISPATCH_CAMERA_LIMIT)
+                        self.DISPATCH_GLOBAL_LIMIT = data.get("DISPATCH_GLOBAL_LIMIT", self.DISPATCH_GLOBAL_LIMIT)
+                        self.MODULE_HTTP_POOL_SIZE = data.get("MODULE_HTTP_POOL_SIZE", self.MODULE_HTTP_POOL_SIZE)
+                        self.MODULE_HTTP_KEEPALIVE = data.get("MODULE_HTTP_KEEPALIVE", self.MODULE_HTTP_KEEPALIVE)
+                        self.MODULE_HTTP_TIMEOUT = data.get("MODULE_HTTP_TIMEOUT", self.MODULE_HTTP_TIMEOUT)
+                        self.MODULE_HTTP_CONNECT_TIMEOUT = data.get("MODULE_HTTP_CONNECT_TIMEOUT", self.MODULE_HTTP_CONNECT_TIMEOUT)
+                        self.NETWORK_MODULE_EVERY_N = data.get("NETWORK_MODULE_EVERY_N", self.NETWORK_MODULE_EVERY_N)
+                        self.MODULE_STREAM_WINDOW = data.get("MODULE_STREAM_WINDOW", self.MODULE_STREAM_WINDOW)
+                        self.MODULE_STREAM_PENDING_TIMEOUT = data.get("MODULE_STREAM_PENDING_TIMEOUT", self.MODULE_STREAM_PENDING_TIMEOUT)
+                        self.MODULE_REQUEST_LIMIT = data.get("MODULE_REQUEST_LIMIT", self.MODULE_REQUEST_LIMIT)
+                        self.RESULT_BUFFER_SIZE = data.get("RESULT_BUFFER_SIZE", self.RESULT_BUFFER_SIZE)
+                        self.RESULT_BATCH_SIZE = data.get("RESULT_BATCH_SIZE", self.RESULT_BATCH_SIZE)
+                        self.RESULT_FLUSH_INTERVAL = data.get("RESULT_FLUSH_INTERVAL", self.RESULT_FLUSH_INTERVAL)
+                        self.RECORDING_SEGMENT_DURATION = data.get("RECORDING_SEGMENT_DURATION", self.RECORDING_SEGMENT_DURATION)
+                        self.RECORDING_CONTAINER = data.get("RECORDING_CONTAINER", self.RECORDING_CONTAINER)
+                        self.RECORDING_BITRATE = data.get("RECORDING_BITRATE", self.RECORDING_BITRATE)
+                        self.RECORDING_PRESET = data.get("RECORDING_PRESET", self.RECORDING_PRESET)
+                        self.RECORDING_MODE = data.get("RECORDING_MODE", self.RECORDING_MODE)
+                        self.RECORDING_PRE_EVENT = data.get("RECORDING_PRE_EVENT", self.RECORDING_PRE_EVENT)
+                        self.RECORDING_POST_EVENT = data.get("RECORDING_POST_EVENT", self.RECORDING_POST_EVENT)
+                        self.RECORDING_TRIGGERS = data.get("RECORDING_TRIGGERS", self.RECORDING_TRIGGERS)
+                        self.RECORDING_TRIGGER_MODULES = data.get("RECORDING_TRIGGER_MODULES", self.RECORDING_TRIGGER_MODULES)
+                        self.RETENTION_MAX_BYTES = data.get("RETENTION_MAX_BYTES", self.RETENTION_MAX_BYTES)
+                        self.RETENTION_CAMERA_MAX_BYTES = data.get("RETENTION_CAMERA_MAX_BYTES", self.RETENTION_CAMERA_MAX_BYTES)
+                        self.RETENTION_CAMERA_LIMITS = data.get("RETENTION_CAMERA_LIMITS", self.RETENTION_CAMERA_LIMITS)
+                        self.RETENTION_MAX_AGE = data.get("RETENTION_MAX_AGE", self.RETENTION_MAX_AGE)
+                        self.RETENTION_MIN_FREE_BYTES = data.get("RETENTION_MIN_FREE_BYTES", self.RETENTION_MIN_FREE_BYTES)
+                        self.RETENTION_INTERVAL = data.get("RETENTION_INTERVAL", self.RETENTION_INTERVAL)
+                        self.HLS_SEGMENT_DURATION = data.get("HLS_SEGMENT_DURATION", self.HLS_SEGMENT_DURATION)
+                        self.HLS_PART_DURATION = data.get("HLS_PART_DURATION", self.HLS_PART_DURATION)
+                        self.HLS_SEGMENT_COUNT = data.get("HLS_SEGMENT_COUNT", self.HLS_SEGMENT_COUNT)
+                        self.HLS_IDLE_TIMEOUT = data.get("HLS_IDLE_TIMEOUT", self.HLS_IDLE_TIMEOUT)
                     logger.info(f"Настройки загружены из файла {self.filepath}")
                 else:
                     logger.warning(f"Файл настроек {self.filepath} не найден. Создаю настройки по умолчанию.")
@@ -56,12 +156,62 @@ class Config:
             """Преобразование настроек в словарь для сохранения в JSON"""
             return {
                 "CAMERA_RESOLUTION": self.CAMERA_RESOLUTION,
+                "CAMERA_PROFILES": self.CAMERA_PROFILES,
                 "JPEG_QUALITY": self.JPEG_QUALITY,
                 "DATABASE_URL": self.DATABASE_URL,
                 "SECRET_KEY": self.SECRET_KEY,
                 "ALGORITHM": self.ALGORITHM,
                 "ACCESS_TOKEN_EXPIRE_MINUTES": self.ACCESS_TOKEN_EXPIRE_MINUTES,
-                "FACE_RECOGNITION": self.FACE_RECOGNITION
+                "FACE_RECOGNITION": self.FACE_RECOGNITION,
+                "CAPTURE_MODE": self.CAPTURE_MODE,
+                "CAPTURE_PROCESSES": self.CAPTURE_PROCESSES,
+                "FRAME_RING_SIZE": self.FRAME_RING_SIZE,
+                "WEBRTC_SHARED_ENCODER": self.WEBRTC_SHARED_ENCODER,
+                "ENCODER_BITRATE": self.ENCODER_BITRATE,
+                "ENCODER_PRESET": self.ENCODER_PRESET,
+                "ENCODER_KEYFRAME_INTERVAL": self.ENCODER_KEYFRAME_INTERVAL,
+                "PACKET_QUEUE_SIZE": self.PACKET_QUEUE_SIZE,
+                "CHANGE_DETECTION": self.CHANGE_DETECTION,
+                "CHANGE_DETECTION_WIDTH": self.CHANGE_DETECTION_WIDTH,
+                "CHANGE_PIXEL_DELTA": self.CHANGE_PIXEL_DELTA,
+                "CHANGE_THRESHOLD": self.CHANGE_THRESHOLD,
+                "OVERLAY_OPACITY": self.OVERLAY_OPACITY,
+                "MODULE_WORKERS": self.MODULE_WORKERS,
+                "MODULE_QUEUE_SIZE": self.MODULE_QUEUE_SIZE,
+                "MODULE_QUEUE_POLICY": self.MODULE_QUEUE_POLICY,
+                "MODULE_LOG_SIZE": self.MODULE_LOG_SIZE,
+                "DISPATCH_CAMERA_LIMIT": self.DISPATCH_CAMERA_LIMIT,
+                "DISPATCH_GLOBAL_LIMIT": self.DISPATCH_GLOBAL_LIMIT,
+                "MODULE_HTTP_POOL_SIZE": self.MODULE_HTTP_POOL_SIZE,
+                "MODULE_HTTP_KEEPALIVE": self.MODULE_HTTP_KEEPALIVE,
+                "MODULE_HTTP_TIMEOUT": self.MODULE_HTTP_TIMEOUT,
+                "MODULE_HTTP_CONNECT_TIMEOUT": self.MODULE_HTTP_CONNECT_TIMEOUT,
+                "NETWORK_MODULE_EVERY_N": self.NETWORK_MODULE_EVERY_N,
+                "MODULE_STREAM_WINDOW": self.MODULE_STREAM_WINDOW,
+                "MODULE_STREAM_PENDING_TIMEOUT": self.MODULE_STREAM_PENDING_TIMEOUT,
+                "MODULE_REQUEST_LIMIT": self.MODULE_REQUEST_LIMIT,
+                "RESULT_BUFFER_SIZE": self.RESULT_BUFFER_SIZE,
+                "RESULT_BATCH_SIZE": self.RESULT_BATCH_SIZE,
+                "RESULT_FLUSH_INTERVAL": self.RESULT_FLUSH_INTERVAL,
+                "RECORDING_SEGMENT_DURATION": self.RECORDING_SEGMENT_DURATION,
+                "RECORDING_CONTAINER": self.RECORDING_CONTAINER,
+                "RECORDING_BITRATE": self.RECORDING_BITRATE,
+                "RECORDING_PRESET": self.RECORDING_PRESET,
+                "RECORDING_MODE": self.RECORDING_MODE,
+                "RECORDING_PRE_EVENT": self.RECORDING_PRE_EVENT,
+                "RECORDING_POST_EVENT": self.RECORDING_POST_EVENT,
+                "RECORDING_TRIGGERS": self.RECORDING_TRIGGERS,
+                "RECORDING_TRIGGER_MODULES": self.RECORDING_TRIGGER_MODULES,
+                "RETENTION_MAX_BYTES": self.RETENTION_MAX_BYTES,
+                "RETENTION_CAMERA_MAX_BYTES": self.RETENTION_CAMERA_MAX_BYTES,
+                "RETENTION_CAMERA_LIMITS": self.RETENTION_CAMERA_LIMITS,
+                "RETENTION_MAX_AGE": self.RETENTION_MAX_AGE,
+                "RETENTION_MIN_FREE_BYTES": self.RETENTION_MIN_FREE_BYTES,
+                "RETENTION_INTERVAL": self.RETENTION_INTERVAL,
+                "HLS_SEGMENT_DURATION": self.HLS_SEGMENT_DURATION,
+                "HLS_PART_DURATION": self.HLS_PART_DURATION,
+                "HLS_SEGMENT_COUNT": self.HLS_SEGMENT_COUNT,
+                "HLS_IDLE_TIMEOUT": self.HLS_IDLE_TIMEOUT
             }
 
         def update(self, **kwargs):
@@ -1,7 +1,19 @@
-﻿from pydantic import BaseModel
+﻿from typing import Optional
+
+from pydantic import BaseModel, field_validator
+
+from app.services.overlay_service import DEFAULT_OVERLAY_POSITION, validate_overlay_position
 
 
 class CameraModel(BaseModel):
     name: str
     url: str
-    active: bool
\ No newline at end of file
+    active: bool
+    passthrough: bool = False
+    overlay_position: str = DEFAULT_OVERLAY_POSITION
+    overlay_text: Optional[str] = None
+
+    @field_validator("overlay_position")
+    @classmethod
+    def check_overlay_position(cls, value: str) -> str:
+        return validate_overlay_position(value)
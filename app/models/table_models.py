@@ -1,6 +1,6 @@
 ﻿import uuid
 
-from sqlalchemy import Column, String, UUID, Boolean, Text
+from sqlalchemy import Column, String, UUID, Boolean, Text, Float, Integer, Index
 from sqlalchemy.ext.declarative import declarative_base
 # Определение базового класса для моделей
 Base = declarative_base()
@@ -20,6 +20,9 @@ class Camera(Base):
     name = Column(String, index=True)  # Название камеры
     url = Column(String, unique=True, index=True)  # Уникальный URL камеры
     active = Column(Boolean, default=True)  # Статус активности камеры
+    passthrough = Column(Boolean, default=False)  # Сквозная передача H.264 без декодирования и перекодирования
+    overlay_position = Column(String, default="bottom-right")  # Положение надписи на кадре или "off"
+    overlay_text = Column(String, nullable=True)  # Шаблон надписи с {time} и {camera}, по умолчанию время и камера
 
 # Модель модуля
 class Module(Base):
@@ -30,3 +33,39 @@ class Module(Base):
     enabled = Column(Boolean, default=False)  # Включен ли модуль
     address = Column(String(255), nullable=True)  # Локальный путь или URL эндпоинта для модуля
     description = Column(Text, nullable=True)  # Описание модуля
+    sample_fps = Column(Float, nullable=True)  # Кадров в секунду с каждой камеры, None — без ограничения
+    sample_every_n = Column(Integer, nullable=True)  # Каждый N-й кадр каждой камеры, None — каждый кадр
+
+# Результат обработки кадра модулем (детекции, события, метаданные)
+class ModuleResult(Base):
+    __tablename__ = "module_results"
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    camera_id = Column(String(36), nullable=True)  # Камера, с которой получен кадр
+    module = Column(String(255), nullable=False)  # Название модуля
+    seq = Column(Integer, nullable=True)  # Номер кадра камеры
+    frame_timestamp = Column(Float, nullable=True)  # Время захвата кадра (time.time())
+    created_at = Column(Float, nullable=False)  # Время получения результата (time.time())
+    data = Column(Text, nullable=False)  # Результат модуля в JSON
+
+    __table_args__ = (Index("ix_module_results_camera_time", "camera_id", "frame_timestamp"),)
+
+# Записанный сегмент видео камеры (каталог записей)
+class RecordingSegment(Base):
+    __tablename__ = "recording_segments"
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    camera_id = Column(String(36), nullable=False)  # Камера, с которой записан сегмент
+    camera_name = Column(String, nullable=True)  # Название камеры на момент записи
+    path = Column(String, unique=True, nullable=False)  # Путь к файлу сегмента
+    container = Column(String(16), nullable=False)  # Контейнер: "mp4" или "mkv"
+    width = Column(Integer, nullable=True)  # Ширина кадра
+    height = Column(Integer, nullable=True)  # Высота кадра
+    start = Column(Float, nullable=False)  # Время захвата первого кадра (time.time())
+    end = Column(Float, nullable=False)  # Время захвата последнего кадра (time.time())
+    duration = Column(Float, default=0.0)  # Длительность, с
+    frames = Column(Integer, default=0)  # Число кадров
+    size = Column(Integer, default=0)  # Размер файла, байт
+    keyframes = Column(Text, nullable=True)  # Смещения ключевых кадров от начала сегмента в JSON, с
+    trigger = Column(String, nullable=True)  # Причина записи (событие) или None при непрерывной записи
+    complete = Column(Boolean, default=False)  # Сегмент завершён; незавершённый ещё записывается
+
+    __table_args__ = (Index("ix_recording_segments_camera_start", "camera_id", "start"),)
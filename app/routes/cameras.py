@@ -1,13 +1,19 @@
-﻿import uuid
-from fastapi import APIRouter, Depends, HTTPException
+﻿import asyncio
+import uuid
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.orm import Session
 from app.models.camera import CameraModel
 from app.models.table_models import Camera
 from app.services.camera_service import get_camera_list, add_camera_internal, remove_camera_internal, get_camera_by_id, \
     deactivate_camera_internal
 from app.services.database_service import get_db
-from app.services.security_service import get_current_user
-from app.services.video_service import start_camera, camera_tasks
+from app.services.frame_service import CameraFrame
+from app.services.security_service import get_current_user, get_media_user
+from app.services.video_service import start_camera, camera_tasks, get_frame_jpeg, get_frame_source, \
+    get_latest_frame
 
 router = APIRouter()
 
@@ -81,3 +87,87 @@ async def deactivate_camera(id: uuid.UUID, user: dict = Depends(get_current_user
     await deactivate_camera_internal(camera)
 
     return {"detail": "Camera deactivated successfully"}
+
+
+MJPEG_BOUNDARY = "frame"
+
+
+def _frame_stream(id: uuid.UUID, profile: Optional[str]):
+    try:
+        stream = get_frame_source(id, profile)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if stream is None:
+        raise HTTPException(status_code=404, detail="Camera is not running")
+    return stream
+
+
+def _frame_etag(frame: CameraFrame) -> str:
+    # Номер кадра начинается заново при перезапуске камеры, время захвата делает метку уникальной
+    return f'"{frame.seq}-{int(frame.timestamp * 1000)}"'
+
+
+# Снимок камеры
+@router.get("/{id}/snapshot.jpg")
+async def get_snapshot(
+        id: uuid.UUID,
+        request: Request,
+        profile: Optional[str] = None,
+        user: dict = Depends(get_media_user)
+):
+    """Последний кадр камеры в JPEG; ETag по номеру кадра, при совпадении If-None-Match — 304"""
+    stream = _frame_stream(id, profile)
+    frame = await get_latest_frame(stream)
+    if frame is None:
+        raise HTTPException(status_code=503, detail="No frames from camera")
+
+    etag = _frame_etag(frame)
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "X-Frame-Timestamp": str(frame.timestamp)}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(await get_frame_jpeg(frame), media_type="image/jpeg", headers=headers)
+
+
+# Поток MJPEG камеры
+@router.get("/{id}/mjpeg")
+async def get_mjpeg(
+        id: uuid.UUID,
+        profile: Optional[str] = None,
+        fps: Optional[float] = Query(None, gt=0, le=60),
+        user: dict = Depends(get_media_user)
+):
+    """Кадры камеры в multipart/x-mixed-replace; fps ограничивает частоту кадров.
+
+    Медленный клиент получает последний кадр камеры, промежуточные кадры пропускаются.
+    """
+    stream = _frame_stream(id, profile)
+    broadcaster = stream["broadcaster"]
+    interval = 1.0 / fps if fps else 0.0
+
+    async def frames():
+        last_seq = 0
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            frame = await broadcaster.next_frame(last_seq, timeout=5.0)
+            if frame is None:
+                if broadcaster.closed:
+                    break
+                continue
+            last_seq = frame.seq
+            jpeg = await get_frame_jpeg(frame)
+            yield (
+                f"--{MJPEG_BOUNDARY}\r\n"
+                f"Content-Type: image/jpeg\r\n"
+                f"Content-Length: {len(jpeg)}\r\n"
+                f"X-Frame-Timestamp: {frame.timestamp}\r\n\r\n"
+            ).encode("ascii") + jpeg + b"\r\n"
+            if interval:
+                await asyncio.sleep(max(0.0, interval - (loop.time() - started)))
+
+    return StreamingResponse(
+        frames(),
+        media_type=f"multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}",
+        headers={"Cache-Control": "no-cache"}
+    )
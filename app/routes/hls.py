@@ -0,0 +1,100 @@
+﻿import re
+import uuid
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import Response
+
+from app.services.hls_service import PLAYLIST_MEDIA_TYPE, SEGMENT_MEDIA_TYPE, HlsManager
+from app.services.security_service import get_media_user
+
+router = APIRouter()
+
+MEDIA_NAME = re.compile(r"^(?:init(?P<init>\d+)\.mp4|(?P<sequence>\d+)(?:\.(?P<part>\d+))?\.m4s)$")
+MEDIA_CACHE_CONTROL = "public, max-age=86400, immutable"  # Содержимое по адресу в сессии упаковщика не меняется
+
+
+# Многовариантный плейлист HLS камеры
+@router.get("/{camera_id}/index.m3u8")
+async def get_playlist(
+        camera_id: uuid.UUID,
+        profile: Optional[str] = None,
+        user: dict = Depends(get_media_user)
+):
+    """Точка входа с токеном: ссылка на медиаплейлист сессии упаковщика.
+
+    Медиаплейлист (в том числе блокирующие запросы _HLS_msn/_HLS_part), части, сегменты
+    и сегменты инициализации отдаются по адресам внутри сессии без токена: адрес сессии
+    случайный, а одинаковые ответы CDN отдаёт всем зрителям.
+    """
+    try:
+        packager = HlsManager.get(camera_id, profile)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if packager is None:
+        raise HTTPException(status_code=404, detail="Camera is not running")
+
+    if packager.master_playlist() is None:
+        # Упаковщик только что запущен: ждём первую часть
+        await packager.wait_ready(max(packager.next_sequence - 1, 0), 0, 3 * packager.target_duration)
+    playlist = packager.master_playlist()
+    if playlist is None:
+        raise HTTPException(status_code=503, detail="No video from camera", headers={"Retry-After": "1"})
+    return Response(playlist, media_type=PLAYLIST_MEDIA_TYPE, headers={"Cache-Control": "private, no-cache"})
+
+
+# Медиаплейлист LL-HLS сессии упаковщика
+@router.get("/{camera_id}/{session}/index.m3u8")
+async def get_media_playlist(
+        camera_id: uuid.UUID,
+        session: str,
+        hls_msn: Optional[int] = Query(None, alias="_HLS_msn", ge=0),
+        hls_part: Optional[int] = Query(None, alias="_HLS_part", ge=0)
+):
+    """Плейлист с частями сегментов; с _HLS_msn (и _HLS_part) ответ ждёт появления этого сегмента (части).
+
+    Ответ на блокирующий запрос одинаков для всех зрителей и кэшируется публично,
+    поэтому CDN передаёт на сервер один запрос на каждую новую часть.
+    """
+    packager = HlsManager.get_session(session)
+    if packager is None or packager.camera_id != camera_id:
+        raise HTTPException(status_code=404, detail="Not found")
+    packager.touch()
+
+    timeout = 3 * packager.target_duration
+    if hls_msn is not None:
+        if hls_msn > packager.next_sequence + 1:
+            raise HTTPException(status_code=400, detail="_HLS_msn is too far ahead of the live edge")
+        await packager.wait_ready(hls_msn, hls_part, timeout)
+        cache_control = f"public, max-age={6 * packager.target_duration}"
+    elif hls_part is not None:
+        raise HTTPException(status_code=400, detail="_HLS_part requires _HLS_msn")
+    else:
+        cache_control = "public, no-cache"
+
+    playlist = packager.playlist()
+    if playlist is None:
+        raise HTTPException(status_code=503, detail="No video from camera", headers={"Retry-After": "1"})
+    return Response(playlist, media_type=PLAYLIST_MEDIA_TYPE, headers={"Cache-Control": cache_control})
+
+
+# Сегмент инициализации, сегмент или часть сегмента HLS
+@router.get("/{camera_id}/{session}/{name}")
+async def get_media(camera_id: uuid.UUID, session: str, name: str):
+    """Медиаданные сессии упаковщика; ещё не готовая следующая часть отдаётся, как только появится"""
+    packager = HlsManager.get_session(session)
+    match = MEDIA_NAME.match(name)
+    if packager is None or packager.camera_id != camera_id or match is None:
+        raise HTTPException(status_code=404, detail="Not found")
+
+    if match["init"] is not None:
+        data = packager.inits.get(int(match["init"]))
+    else:
+        sequence = int(match["sequence"])
+        part = int(match["part"]) if match["part"] is not None else None
+        if sequence <= packager.next_sequence:
+            await packager.wait_ready(sequence, part, 3 * packager.target_duration)
+        data = packager.get_segment(sequence) if part is None else packager.get_part(sequence, part)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return Response(data, media_type=SEGMENT_MEDIA_TYPE, headers={"Cache-Control": MEDIA_CACHE_CONTROL})
@@ -2,6 +2,12 @@
 import time
 from fastapi import APIRouter
 
+from app.services.hls_service import HlsManager
+from app.services.module_service import ModuleManager
+from app.services.recording_service import RecordingCatalog
+from app.services.result_service import ResultStore
+from app.services.retention_service import RetentionManager
+from app.services import video_service
 from app.services.video_service import camera_streams
 
 router = APIRouter()
@@ -40,6 +46,19 @@ def get_metrics():
     except psutil.AccessDenied:
         num_connections = None
 
+    # Доля кадров без изменений по камерам: для них не сжимается JPEG и не вызываются модули
+    cameras = []
+    for stream in list(camera_streams.values()):
+        broadcaster = stream["broadcaster"]
+        frames = broadcaster.seq
+        cameras.append({
+            "id": str(stream["id"]),
+            "name": stream["name"],
+            "frames": frames,
+            "skipped_frames": broadcaster.skipped,
+            "skip_rate": round(broadcaster.skipped / frames, 4) if frames else 0.0,
+        })
+
     return {
         "memory_usage_mb": memory_info.rss / (1024 ** 2),
         "cpu_percent": cpu_percent,
@@ -52,5 +71,12 @@ def get_metrics():
         "num_cameras": len(camera_streams),
         "system_cpu_usage": psutil.cpu_percent(),
         "system_memory_usage": psutil.virtual_memory().percent,
+        "cameras": cameras,
+        "modules": ModuleManager.get_stats(),
+        "dispatch": video_service.dispatcher.get_stats() if video_service.dispatcher else None,
+        "results": ResultStore.get_stats(),
+        "recordings": dict(RecordingCatalog.stats),
+        "retention": RetentionManager.get_stats(),
+        "hls": HlsManager.get_stats(),
 
     }
\ No newline at end of file
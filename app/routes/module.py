@@ -1,9 +1,10 @@
 ﻿from fastapi import HTTPException
 from fastapi.responses import HTMLResponse, JSONResponse
 
+from typing import Optional
 from uuid import UUID
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from sqlalchemy.orm import Session
 from app.models.table_models import Module
 from app.services.database_service import get_db
@@ -23,16 +24,31 @@ def get_modules(user: dict = Depends(get_current_user), db: Session = Depends(ge
 
 # Добавление нового модуля
 @router.get("/add_module")
-def add_module(name: str, module_type: str, address: str, enabled: bool, db: Session = Depends(get_db)):
+def add_module(
+        name: str,
+        module_type: str,
+        address: str,
+        enabled: bool,
+        sample_fps: Optional[float] = None,
+        sample_every_n: Optional[int] = None,
+        db: Session = Depends(get_db)
+):
     """Добавление нового модуля в систему"""
     # Создание нового модуля и сохранение его в базе данных
-    module = Module(name=name, module_type=module_type, address=address, enabled=enabled)
+    module = Module(
+        name=name,
+        module_type=module_type,
+        address=address,
+        enabled=enabled,
+        sample_fps=sample_fps,
+        sample_every_n=sample_every_n
+    )
     db.add(module)
     db.commit()  # Сохранение изменений в базе данных
     db.refresh(module)  # Обновление объекта модуля с актуальными данными из базы
 
     # Добавление модуля в систему менеджера
-    ModuleManager.add_module(name, module_type, address, enabled)
+    ModuleManager.register_module(module)
 
     return module  # Возвращаем добавленный модуль
 
@@ -59,6 +75,64 @@ async def disable_module(module_id: str, db: Session = Depends(get_db)):
     db.commit()
 
 
+@router.get("/set_sampling/{module_id}")
+async def set_sampling(
+        module_id: str,
+        sample_fps: Optional[float] = None,
+        sample_every_n: Optional[int] = None,
+        db: Session = Depends(get_db)
+):
+    """Изменение частоты кадров модуля: sample_fps с каждой камеры и/или каждый sample_every_n-й кадр"""
+    module_id = UUID(module_id)
+    module = db.query(Module).filter(Module.id == module_id).first()
+    if not module:
+        raise HTTPException(status_code=404, detail="Module not found")
+    if (sample_fps is not None and sample_fps <= 0) or (sample_every_n is not None and sample_every_n < 1):
+        raise HTTPException(status_code=400, detail="Invalid sampling rate")
+    ModuleManager.set_sampling(module.name, sample_fps, sample_every_n)
+    db.query(Module).filter(Module.id == module_id).update({
+        "sample_fps": sample_fps,
+        "sample_every_n": sample_every_n
+    })
+    db.commit()
+
+
+# Журнал модуля постранично
+@router.get("/get_module_logs/{module_id}")
+def get_module_logs(
+        module_id: str,
+        level: Optional[str] = Query(None, pattern="^(debug|info|warning|error)$"),
+        camera: Optional[str] = None,
+        search: Optional[str] = None,
+        since: Optional[float] = None,
+        before_id: Optional[int] = None,
+        after_id: Optional[int] = None,
+        limit: int = Query(100, ge=1, le=1000),
+        user: dict = Depends(get_current_user),
+        db: Session = Depends(get_db)
+):
+    """Записи журнала модуля, новые первыми: level — не ниже уровня, search — подстрока сообщения.
+
+    Следующая страница — с before_id из next_before_id, новые записи — с after_id из last_id.
+    """
+    module = db.query(Module).filter(Module.id == UUID(module_id)).first()
+    if not module:
+        raise HTTPException(status_code=404, detail="Module not found")
+    logs = ModuleManager.get_module_logs(
+        module.name,
+        level=level,
+        camera=camera,
+        search=search,
+        since=since,
+        before_id=before_id,
+        after_id=after_id,
+        limit=limit
+    )
+    if logs is None:
+        raise HTTPException(status_code=404, detail="Module has no local log")
+    return logs
+
+
 @router.get("/get_module/{module_id}", response_class=HTMLResponse)
 async def serve_module_html(module_id: str, db: Session = Depends(get_db)):
     module_id = UUID(module_id)
@@ -0,0 +1,107 @@
+﻿import os
+import uuid
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import FileResponse
+from sqlalchemy.orm import Session
+
+from app.services.database_service import get_db
+from app.services.recording_service import MAX_CLIP_DURATION, SEGMENT_MEDIA_TYPES, ClipCache, RecordingCatalog
+from app.services.security_service import get_current_user
+
+router = APIRouter()
+
+
+# Описание сегмента записи
+@router.get("/segments/{segment_id}")
+def get_segment(segment_id: uuid.UUID, user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Сегмент записи из каталога: время, размер, смещения ключевых кадров"""
+    segment = RecordingCatalog.get(db, segment_id)
+    if segment is None:
+        raise HTTPException(status_code=404, detail="Segment not found")
+    return segment
+
+
+# Файл сегмента записи с поддержкой запросов Range
+@router.get("/segments/{segment_id}/file")
+def get_segment_file(segment_id: uuid.UUID, user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Файл сегмента; плеер перематывает его запросами Range (ответ 206 Partial Content)"""
+    segment = RecordingCatalog.get(db, segment_id)
+    if segment is None or not os.path.exists(segment["path"]):
+        raise HTTPException(status_code=404, detail="Segment not found")
+    return FileResponse(
+        segment["path"],
+        media_type=SEGMENT_MEDIA_TYPES.get(segment["container"], "application/octet-stream"),
+        filename=segment["file"],
+        content_disposition_type="inline"
+    )
+
+
+# Список сегментов записи камеры за период
+@router.get("/{camera_id}")
+def get_recordings(
+        camera_id: str,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: int = Query(100, ge=1, le=10000),
+        user: dict = Depends(get_current_user),
+        db: Session = Depends(get_db)
+):
+    """Сегменты записи камеры, пересекающие период [since, until] (time.time()), по времени начала"""
+    return RecordingCatalog.query(db, camera_id, since, until, limit)
+
+
+# Поиск момента записи
+@router.get("/{camera_id}/seek")
+def seek_recording(
+        camera_id: str,
+        timestamp: float,
+        user: dict = Depends(get_current_user),
+        db: Session = Depends(get_db)
+):
+    """Сегмент с моментом timestamp и смещение (offset, с) последнего ключевого кадра не позже него"""
+    position = RecordingCatalog.seek(db, camera_id, timestamp)
+    if position is None:
+        raise HTTPException(status_code=404, detail="No recordings after this time")
+    position["url"] = f"/recordings/segments/{position['segment']['id']}/file"
+    return position
+
+
+# Клип записи за период
+@router.get("/{camera_id}/clip")
+def get_clip(
+        camera_id: str,
+        start: float,
+        end: float,
+        user: dict = Depends(get_current_user),
+        db: Session = Depends(get_db)
+):
+    """MP4 за период [start, end] без перекодирования, с последнего ключевого кадра не позже start.
+
+    Заголовок X-Clip-Start — время первого кадра клипа, X-Clip-Offset — смещение start от него, с.
+    Клип собирается один раз во временный файл и перематывается запросами Range.
+    """
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be greater than start")
+    if end - start > MAX_CLIP_DURATION:
+        raise HTTPException(status_code=400, detail=f"Clip is longer than {MAX_CLIP_DURATION:.0f} s")
+    # Сегмент с ключевым кадром до start может начинаться раньше периода
+    segments = [
+        segment for segment in RecordingCatalog.query(db, camera_id, start, end, limit=1000)
+        if os.path.exists(segment["path"])
+    ]
+    if not segments:
+        raise HTTPException(status_code=404, detail="No recordings in this period")
+    clip = ClipCache.get(segments, start, end)
+    if clip["start"] is None:
+        raise HTTPException(status_code=404, detail="No recordings in this period")
+    return FileResponse(
+        clip["path"],
+        media_type="video/mp4",
+        content_disposition_type="inline",
+        headers={
+            "X-Clip-Start": str(clip["start"]),
+            "X-Clip-Offset": str(round(max(0.0, start - clip["start"]), 3)),
+        }
+    )
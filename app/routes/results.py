@@ -0,0 +1,84 @@
+﻿import asyncio
+import json
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Query, WebSocket, WebSocketDisconnect
+from sqlalchemy.orm import Session
+
+from app.logger import LoggerSingleton
+from app.services.database_service import get_db
+from app.services.result_service import ResultStore
+from app.services.security_service import get_current_user, get_user_from_token
+
+router = APIRouter()
+logger = LoggerSingleton.get_logger()
+
+
+# Последние результаты модулей по камере из памяти
+@router.get("/results/{camera_id}")
+def get_recent_results(
+        camera_id: str,
+        module: Optional[str] = None,
+        since: Optional[float] = None,
+        limit: int = Query(100, ge=1, le=10000),
+        user: dict = Depends(get_current_user)
+):
+    """Последние результаты модулей по камере; since — время кадра (time.time()), после которого нужны результаты"""
+    return ResultStore.get_recent(camera_id, module, since, limit)
+
+
+# История результатов модулей по камере из базы данных
+@router.get("/results/{camera_id}/history")
+def get_results_history(
+        camera_id: str,
+        module: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: int = Query(100, ge=1, le=10000),
+        user: dict = Depends(get_current_user),
+        db: Session = Depends(get_db)
+):
+    """Результаты модулей по камере за период времени кадров (since, until]"""
+    return ResultStore.query(db, camera_id, module, since, until, limit)
+
+
+# WebSocket для получения результатов модулей по мере их появления
+@router.websocket("/ws/results")
+async def results_stream(websocket: WebSocket, camera_id: Optional[str] = None, module: Optional[str] = None):
+    await websocket.accept()
+    subscription = None
+    try:
+        # Первое сообщение клиента — токен авторизации, как у /ws/video
+        message = json.loads(await websocket.receive_text())
+        user = get_user_from_token(message.get("token"))
+        logger.info(f"Пользователь {user['username']} подписался на результаты модулей")
+
+        subscription = ResultStore.subscribe(camera_id, module)
+        # Отключение клиента замечаем сразу, а не при следующей отправке
+        receiver = asyncio.create_task(websocket.receive_text())
+        try:
+            while True:
+                getter = asyncio.create_task(subscription.get())
+                done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    await websocket.send_text(getter.result())
+                else:
+                    getter.cancel()
+                if receiver in done:
+                    # Клиенту нечего присылать после токена: сообщения игнорируются до отключения
+                    receiver.result()
+                    receiver = asyncio.create_task(websocket.receive_text())
+        finally:
+            receiver.cancel()
+
+    except WebSocketDisconnect:
+        logger.info("Клиент отключился от результатов модулей")
+    except Exception as e:
+        logger.error(f"Error: {str(e)}")
+        try:
+            await websocket.send_text(json.dumps({"ошибка": str(e)}))
+        except Exception:
+            pass
+    finally:
+        if subscription is not None:
+            ResultStore.unsubscribe(subscription)
@@ -1,56 +1,77 @@
 ﻿import asyncio
 import json
-import time
+from typing import Dict, Optional, Tuple
 from uuid import UUID
 from datetime import datetime
 
-import jwt
-
-from aiortc import RTCPeerConnection, RTCSessionDescription, VideoStreamTrack, RTCIceCandidate
+from aiortc import RTCPeerConnection, RTCSessionDescription, VideoStreamTrack, RTCIceCandidate, RTCRtpSender, \
+    MediaStreamTrack
+from aiortc.contrib.media import MediaRelay
 from fastapi import WebSocket, WebSocketDisconnect, APIRouter
 from av import VideoFrame
 from app.config import Config
 from app.logger import LoggerSingleton
 from app.models.table_models import Camera
 from app.services.database_service import get_db
-from app.services.video_service import camera_streams
+from app.services.fragment_service import Mp4Fragmenter
+from app.services.frame_service import profile_size
+from app.services.security_service import get_user_from_token
+from app.services.video_service import get_frame_jpeg, get_frame_source
 
 router = APIRouter()
 logger = LoggerSingleton.get_logger()
 
+# Без общего кодировщика: один трек на камеру и профиль, зрители подписываются через ретранслятор
+relay = MediaRelay()
+camera_tracks: Dict[Tuple[UUID, Optional[str]], VideoStreamTrack] = {}
+
+FRAME_STREAM_FORMATS = ("jpeg", "mp4")  # Форматы /ws/frames: JPEG кадров или фрагменты MP4 для MSE
+FRAME_WAIT_TIMEOUT = 5.0  # Ожидание кадра, после которого проверяется, что камера ещё работает, с
+
+
 class CameraVideoTrack(VideoStreamTrack):
     """Класс для передачи кадров через WebRTC с исправлениями"""
 
-    def __init__(self, camera_id: UUID, camera_name: str):
+    def __init__(self, camera_id: UUID, camera_name: str, profile: Optional[str] = None):
         super().__init__()
         self.camera_id = camera_id
         self.camera_name = camera_name
+        self.profile = profile  # Профиль разрешения, None — полное разрешение
         self.last_frame_time = datetime.now()
+        self.broadcaster = None  # Рассылка кадров камеры, из которой читает трек
+        self.last_seq = 0  # Номер последнего отправленного кадра
 
     async def recv(self) -> VideoFrame:
         while True:
             try:
-                # Получаем последний кадр из потока
-                stream_data = camera_streams.get(self.camera_id)
+                stream_data = get_frame_source(self.camera_id, self.profile)
                 if not stream_data:
-                    await asyncio.sleep(0.1)
+                    # Камера не запущена: ждём её появления
+                    await asyncio.sleep(1)
                     continue
 
-                frame = stream_data.get("frame")
+                broadcaster = stream_data["broadcaster"]
+                if broadcaster is not self.broadcaster:
+                    # Камера (пере)запущена, нумерация кадров начинается заново
+                    self.broadcaster = broadcaster
+                    self.last_seq = 0
+
+                # Ждём следующий новый кадр без опроса и повторной отправки старых
+                frame = await broadcaster.next_frame(self.last_seq)
                 if frame is None:
-                    await asyncio.sleep(0.05)
                     continue
-
+                self.last_seq = frame.seq
 
                 # Конвертация формата для WebRTC
-                video_frame = VideoFrame.from_ndarray(frame, format="bgr24")
+                video_frame = VideoFrame.from_ndarray(frame.image, format="bgr24")
                 video_frame = video_frame.reformat(
                     format="yuv420p",
                     width=video_frame.width,
                     height=video_frame.height
                 )
-                video_frame.pts = int(time.monotonic() * 1000000)
+                video_frame.pts = int(frame.timestamp * 1000000)
                 video_frame.time_base = "1/1000000"
+                self.last_frame_time = datetime.now()
 
                 return video_frame
 
@@ -59,38 +80,102 @@ class CameraVideoTrack(VideoStreamTrack):
                 await asyncio.sleep(0.1)
 
 
+class EncodedVideoTrack(MediaStreamTrack):
+    """Трек WebRTC, отдающий готовые H.264-пакеты камеры.
+
+    Пакеты приходят от общего кодировщика камеры или напрямую с камеры в режиме
+    сквозной передачи. aiortc только упаковывает их в RTP, поэтому кадр кодируется
+    не более одного раза на камеру независимо от числа зрителей.
+    """
+    kind = "video"
+
+    def __init__(self, camera_id: UUID, profile: Optional[str] = None):
+        super().__init__()
+        self.camera_id = camera_id
+        self.profile = profile  # Профиль разрешения, None — полное разрешение
+        self.source = None  # Источник пакетов камеры
+        self.subscription = None  # Очередь пакетов этого зрителя
+
+    def _unsubscribe(self):
+        if self.subscription is not None:
+            self.subscription.close()
+        self.source = None
+        self.subscription = None
+
+    async def recv(self):
+        while True:
+            stream_data = get_frame_source(self.camera_id, self.profile)
+            if not stream_data:
+                # Камера не запущена: ждём её появления
+                self._unsubscribe()
+                await asyncio.sleep(1)
+                continue
+
+            source = stream_data["packets"]
+            if source is not self.source:
+                self._unsubscribe()
+                self.source = source
+                self.subscription = source.subscribe()
+
+            packet = await self.subscription.get()
+            if packet is None:
+                # Источник закрыт (камера или профиль остановлены)
+                self._unsubscribe()
+                continue
+            return packet
+
+    def stop(self):
+        super().stop()
+        self._unsubscribe()
+
+
+def create_video_track(camera_id: UUID, camera_name: str, profile: Optional[str] = None) -> MediaStreamTrack:
+    """Создаёт трек камеры в нужном профиле разрешения для нового зрителя."""
+    if Config.settings().WEBRTC_SHARED_ENCODER:
+        return EncodedVideoTrack(camera_id, profile)
+
+    # Кадры конвертируются одним треком на камеру и профиль, кодирование остаётся на каждого зрителя
+    key = (camera_id, profile)
+    track = camera_tracks.get(key)
+    if track is None or track.readyState == "ended":
+        track = CameraVideoTrack(camera_id, camera_name, profile)
+        camera_tracks[key] = track
+    return relay.subscribe(track)
+
+
+def prefer_h264(pc: RTCPeerConnection, sender: RTCRtpSender):
+    """Ограничивает согласование кодеков H.264, в котором кодирует общий кодировщик."""
+    codecs = [
+        codec for codec in RTCRtpSender.getCapabilities("video").codecs
+        if codec.mimeType in ("video/H264", "video/rtx")
+    ]
+    for transceiver in pc.getTransceivers():
+        if transceiver.sender == sender:
+            transceiver.setCodecPreferences(codecs)
+
+
 # WebSocket endpoint для видеопотока с конкретной камеры
 @router.websocket("/ws/video/{camera_id}")
-async def video_stream(websocket: WebSocket, camera_id: str):
+async def video_stream(websocket: WebSocket, camera_id: str, profile: Optional[str] = None):
     # Принимаем WebSocket соединение
     await websocket.accept()
 
     # Инициализация переменных для WebRTC соединения и БД сессии
     pc = None  # RTCPeerConnection объект
+    video_track = None  # Видеотрек зрителя
     db_session = None  # Сессия подключения к базе данных
+    user = None  # Пользователь из токена первого сообщения
 
     try:
         # Этап 1: Аутентификация пользователя
         # Получаем и парсим сообщение с токеном
         data = await websocket.receive_text()
         message = json.loads(data)
-        token = message.get("token")
-
-        if not token:
-            raise ValueError("Отсуствует токен авторизации")
+        user = get_user_from_token(message.get("token"))
+        logger.info(f"Пользователь {user['username']} подключился")
 
-        # Валидируем JWT токен
-        try:
-            payload = jwt.decode(
-                token,
-                Config.settings().SECRET_KEY,
-                algorithms=[Config.settings().ALGORITHM]
-            )
-            # Формируем объект пользователя из payload токена
-            user = {"username": payload["sub"], "role": payload["role"]}
-            logger.info(f"Пользователь {user['username']} подключился")
-        except Exception as e:
-            raise ValueError(f"Токен недействителен: {str(e)}")
+        # Профиль разрешения из параметра запроса (?profile=360p), по умолчанию полное разрешение
+        profile_size(profile)
 
         db_session = get_db()
         camera_uuid = UUID(camera_id)
@@ -100,8 +185,10 @@ async def video_stream(websocket: WebSocket, camera_id: str):
         pc = RTCPeerConnection()  # Создаем новое WebRTC соединение
 
         # Создаем и добавляем видеотрек для указанной камеры
-        video_track = CameraVideoTrack(camera_uuid, camera.name)
-        pc.addTrack(video_track)  # Добавляем трек в соединение
+        video_track = create_video_track(camera_uuid, camera.name, profile)
+        sender = pc.addTrack(video_track)  # Добавляем трек в соединение
+        if isinstance(video_track, EncodedVideoTrack):
+            prefer_h264(pc, sender)
 
         # Создаем SDP offer для инициализации соединения
         offer = await pc.createOffer()
@@ -166,7 +253,7 @@ async def video_stream(websocket: WebSocket, camera_id: str):
 
     # Обработка разрыва соединения
     except WebSocketDisconnect:
-        logger.info(f"Пользователь {user['username']} отключился от камеры {camera_id}")
+        logger.info(f"Пользователь {user['username'] if user else '-'} отключился от камеры {camera_id}")
 
     # Обработка общих ошибок
     except Exception as e:
@@ -178,9 +265,163 @@ async def video_stream(websocket: WebSocket, camera_id: str):
         try:
             if pc:
                 await pc.close()  # Закрываем WebRTC соединение
+            if video_track:
+                video_track.stop()  # Отписываемся от общего источника кадров
             if db_session:
                 db_session.close()  # Закрываем сессию с БД
         except Exception as e:
             logger.error(f"Ошибка очистки: {str(e)}")
 
-        logger.info(f"Вебсокет закрыт для камеры {camera_id}")
\ No newline at end of file
+        logger.info(f"Вебсокет закрыт для камеры {camera_id}")
+
+
+async def _send_jpeg_frames(websocket: WebSocket, camera_id: UUID, profile: Optional[str], fps: Optional[float]):
+    """Отправляет JPEG последних кадров камеры, не более fps в секунду.
+
+    Следующий кадр берётся только после завершения отправки предыдущего: если
+    буфер сокета заполнен, промежуточные кадры пропускаются, а не копятся в очереди.
+    """
+    loop = asyncio.get_running_loop()
+    interval = 1.0 / fps if fps else 0.0
+    broadcaster = None
+    last_seq = 0
+    sent = skipped = 0
+    try:
+        while True:
+            stream = get_frame_source(camera_id, profile)
+            if stream is None:
+                # Камера остановлена: ждём её перезапуска
+                await asyncio.sleep(1)
+                continue
+            if stream["broadcaster"] is not broadcaster:
+                # Камера (пере)запущена, нумерация кадров начинается заново
+                broadcaster = stream["broadcaster"]
+                last_seq = 0
+
+            started = loop.time()
+            frame = await broadcaster.next_frame(last_seq, FRAME_WAIT_TIMEOUT)
+            if frame is None:
+                continue
+            if last_seq:
+                skipped += frame.seq - last_seq - 1
+            last_seq = frame.seq
+
+            await websocket.send_bytes(await get_frame_jpeg(frame))
+            sent += 1
+            delay = interval - (loop.time() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+    finally:
+        logger.info(f"Поток JPEG камеры {camera_id}: отправлено {sent}, пропущено {skipped} кадров")
+
+
+async def _send_mp4_fragments(websocket: WebSocket, camera_id: UUID, profile: Optional[str]):
+    """Отправляет H.264 камеры фрагментами MP4 для MediaSource без перекодирования.
+
+    Перед первым фрагментом клиент получает текстовое сообщение с MIME-типом для
+    addSourceBuffer и сегмент инициализации. Если клиент не успевает, очередь пакетов
+    переполняется и сбрасывается, а поток продолжается со следующего ключевого кадра.
+    При перезапуске камеры поток начинается заново с новым сегментом инициализации.
+    """
+    source = None
+    subscription = None
+    fragmenter = None
+    try:
+        while True:
+            stream = get_frame_source(camera_id, profile)
+            if stream is None or stream["packets"] is not source:
+                if subscription is not None:
+                    subscription.close()
+                    fragmenter.close()
+                    subscription = fragmenter = None
+                if stream is None:
+                    source = None
+                    await asyncio.sleep(1)
+                    continue
+                source = stream["packets"]
+                subscription = source.subscribe()
+                fragmenter = Mp4Fragmenter()
+
+            packet = await subscription.get()
+            if packet is None:
+                # Источник закрыт (камера, профиль или переход на общий кодировщик)
+                source = None
+                continue
+            batch = [packet]
+            while not subscription.queue.empty():
+                packet = subscription.queue.get_nowait()
+                if packet is None:
+                    source = None
+                    break
+                batch.append(packet)
+
+            initialized = fragmenter.init is not None
+            data = fragmenter.write(batch)
+            if not initialized and fragmenter.init is not None:
+                await websocket.send_text(json.dumps({"format": "mp4", "mime": fragmenter.mime_type}))
+                await websocket.send_bytes(fragmenter.init)
+            if data:
+                await websocket.send_bytes(data)
+    finally:
+        if subscription is not None:
+            subscription.close()
+            fragmenter.close()
+
+
+# WebSocket с кадрами камеры бинарными сообщениями, если WebRTC недоступен (не проходит ICE)
+@router.websocket("/ws/frames/{camera_id}")
+async def frames_stream(
+        websocket: WebSocket,
+        camera_id: str,
+        format: str = "jpeg",
+        profile: Optional[str] = None,
+        fps: Optional[float] = None
+):
+    """Кадры камеры по WebSocket: format=jpeg — JPEG каждого кадра (fps ограничивает частоту),
+    format=mp4 — фрагменты MP4 с H.264 для MediaSource. Первое сообщение клиента — токен, как у /ws/video."""
+    await websocket.accept()
+    sender = None
+    receiver = None
+    try:
+        message = json.loads(await websocket.receive_text())
+        user = get_user_from_token(message.get("token"))
+
+        if format not in FRAME_STREAM_FORMATS:
+            raise ValueError(f"Неизвестный формат потока: {format}")
+        if fps is not None and fps <= 0:
+            raise ValueError("fps должен быть больше нуля")
+        profile_size(profile)
+        camera_uuid = UUID(camera_id)
+        if get_frame_source(camera_uuid, profile) is None:
+            raise ValueError("Камера не запущена")
+        logger.info(f"Пользователь {user['username']} подключился к кадрам камеры {camera_id} ({format})")
+
+        if format == "jpeg":
+            await websocket.send_text(json.dumps({"format": "jpeg", "mime": "image/jpeg"}))
+            sender = asyncio.create_task(_send_jpeg_frames(websocket, camera_uuid, profile, fps))
+        else:
+            sender = asyncio.create_task(_send_mp4_fragments(websocket, camera_uuid, profile))
+
+        # Отключение клиента замечаем сразу, а не при следующей отправке
+        while True:
+            receiver = asyncio.create_task(websocket.receive_text())
+            done, _ = await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if sender in done:
+                receiver.cancel()
+                sender.result()
+                break
+            # Клиенту нечего присылать после токена: сообщения игнорируются до отключения
+            receiver.result()
+
+    except WebSocketDisconnect:
+        logger.info(f"Клиент отключился от кадров камеры {camera_id}")
+    except Exception as e:
+        logger.error(f"Error: {str(e)}")
+        try:
+            await websocket.send_text(json.dumps({"ошибка": str(e)}))
+        except Exception:
+            pass
+    finally:
+        for task in (sender, receiver):
+            if task is not None:
+                task.cancel()
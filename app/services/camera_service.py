@@ -20,7 +20,14 @@ async def get_camera_by_id(camera_id):
 
 async def add_camera_internal(cameraModel: CameraModel):
     db = get_db()
-    camera = Camera(name=cameraModel.name, url=cameraModel.url, active=cameraModel.active)
+    camera = Camera(
+        name=cameraModel.name,
+        url=cameraModel.url,
+        active=cameraModel.active,
+        passthrough=cameraModel.passthrough,
+        overlay_position=cameraModel.overlay_position,
+        overlay_text=cameraModel.overlay_text
+    )
     db.add(camera)
     db.commit()
     db.refresh(camera)
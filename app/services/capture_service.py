@@ -0,0 +1,444 @@
+﻿import multiprocessing
+import os
+import queue
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import av
+import cv2
+from av.bitstream import BitStreamFilterContext
+
+from app.config import Config
+from app.logger import LoggerSingleton
+from app.services.frame_service import SharedFrameRing, encode_jpeg
+from app.services.overlay_service import OverlayCompositor
+
+logger = LoggerSingleton.get_logger()
+
+
+def validate_camera_url(camera_url: str) -> Any:
+    """Проверяет URL камеры и преобразует строку в число, если это возможно."""
+    try:
+        return int(camera_url)
+    except ValueError:
+        return camera_url
+
+
+class ChangeDetector:
+    """Определяет, изменился ли кадр, до наложения текста и сжатия в JPEG.
+
+    Режимы (CHANGE_DETECTION):
+    - "pixels" — сравнение уменьшенного серого кадра (ширина CHANGE_DETECTION_WIDTH) с
+      последним изменившимся: кадр считается изменившимся, если доля пикселей, яркость
+      которых отличается больше чем на CHANGE_PIXEL_DELTA, превышает CHANGE_THRESHOLD;
+    - "pts" — кадр изменился, если у него новая метка времени декодера (повторы кадров
+      камерой отбрасываются); без метки времени используется сравнение пикселей;
+    - "off" — каждый кадр считается изменившимся.
+    """
+
+    def __init__(self):
+        settings = Config.settings()
+        self.mode = settings.CHANGE_DETECTION
+        self.width = settings.CHANGE_DETECTION_WIDTH
+        self.pixel_delta = settings.CHANGE_PIXEL_DELTA
+        self.threshold = settings.CHANGE_THRESHOLD
+        self._reference = None  # Уменьшенный серый кадр, с которым сравниваются новые
+        self._last_pts = None
+
+    def changed(self, frame, pts: Optional[float] = None) -> bool:
+        if self.mode == "off":
+            return True
+        if self.mode == "pts" and pts is not None:
+            if pts == self._last_pts:
+                return False
+            self._last_pts = pts
+            return True
+        return self._pixels_changed(frame)
+
+    def _pixels_changed(self, frame) -> bool:
+        frame_height, frame_width = frame.shape[:2]
+        width = min(self.width, frame_width)
+        height = max(1, frame_height * width // frame_width)
+        # Прореживание перед усреднением: в несколько раз дешевле масштабирования полного кадра
+        step = max(1, frame_width // (width * 4))
+        small = cv2.resize(frame[::step, ::step], (width, height), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+        if self._reference is None or self._reference.shape != gray.shape:
+            self._reference = gray
+            return True
+
+        diff = cv2.absdiff(gray, self._reference)
+        _, mask = cv2.threshold(diff, self.pixel_delta, 255, cv2.THRESH_BINARY)
+        if cv2.countNonZero(mask) / mask.size <= self.threshold:
+            return False
+
+        # Сравниваем с последним изменившимся кадром, чтобы медленные изменения накапливались
+        self._reference = gray
+        return True
+
+
+class FrameProcessor:
+    """Обработка кадров камеры: проверка изменений, масштабирование, наложение времени и JPEG.
+
+    Хранит состояние между кадрами одной камеры, используется всеми способами захвата.
+    """
+
+    def __init__(
+            self,
+            stream: Dict[str, Any],
+            publish: Callable[[Any, bool, Optional[bytes]], None],
+            precompress: bool = False
+    ):
+        self.camera_name = stream["name"]
+        self.publish = publish
+        self.precompress = precompress  # Сжимать изменившиеся кадры в JPEG сразу при захвате
+        self.detector = ChangeDetector()
+        self.overlay = OverlayCompositor(stream["name"], stream.get("overlay_position"), stream.get("overlay_text"))
+
+    def process(self, frame, pts: Optional[float] = None):
+        """Обрабатывает кадр и публикует его вызовом publish(frame, changed, frame_bytes).
+
+        pts — метка времени кадра от декодера, если она известна. frame_bytes передаётся
+        только при precompress, для остальных кадров JPEG сжимается по требованию.
+        """
+        try:
+            # Проверка изменений до наложения времени: часы на кадре не считаются движением
+            changed = self.detector.changed(frame, pts)
+
+            # Приводим кадр к полному разрешению, если камера отдаёт другой размер
+            width, height = Config.settings().CAMERA_RESOLUTION
+            frame_height, frame_width = frame.shape[:2]
+            if frame_width == width and frame_height == height:
+                resized_frame = frame
+            else:
+                resized_frame = cv2.resize(frame, (width, height))
+
+            # Наложение времени и названия камеры из заранее отрисованной плитки
+            self.overlay.apply(resized_frame)
+
+            frame_bytes = encode_jpeg(resized_frame) if changed and self.precompress else None
+            self.publish(resized_frame, changed, frame_bytes)
+
+        except Exception as e:
+            logger.error(f"Ошибка обработки кадра: {e}")
+
+
+def capture_frames(
+        stream: Dict[str, Any],
+        publish: Callable[[Any, bool, Optional[bytes]], None],
+        precompress: bool = False
+) -> bool:
+    """Цикл захвата кадров с камеры через OpenCV с декодированием каждого кадра.
+
+    Для каждого кадра вызывается publish(frame, changed, frame_bytes), где changed
+    показывает, изменился ли кадр с предыдущего (см. FrameProcessor). Работает, пока
+    stream["running"] истинно. Возвращает False, если камеру не удалось открыть.
+    """
+    camera_name = stream["name"]
+    logger.info(f"Запуск захвата камеры {camera_name}")
+    camera_url = validate_camera_url(stream["url"])
+    cap = cv2.VideoCapture(camera_url)
+
+    if not cap.isOpened():
+        logger.warning(f"Не удалось открыть камеру {camera_name}: {camera_url}")
+        return False
+
+    processor = FrameProcessor(stream, publish, precompress)
+
+    try:
+        while stream["running"]:
+            ret, frame = cap.read()
+            if not ret:
+                logger.error(f"Ошибка чтения кадра с камеры {camera_name}")
+                break
+            # Метка времени кадра, если источник её сообщает (у USB-камер обычно 0)
+            processor.process(frame, cap.get(cv2.CAP_PROP_POS_MSEC) or None)
+
+    finally:
+        cap.release()
+        logger.info(f"Захват камеры {camera_name} завершён.")
+
+    return True
+
+
+def capture_packets(
+        stream: Dict[str, Any],
+        publish: Callable[[Any, bool, Optional[bytes]], None],
+        publish_packets: Callable[[List[av.Packet]], None],
+        need_pixels: Callable[[], bool]
+) -> Optional[bool]:
+    """Цикл захвата со сквозной передачей H.264: пакеты камеры передаются без перекодирования.
+
+    Поток демультиплексируется через PyAV, пакеты приводятся к Annex B с SPS/PPS перед
+    каждым ключевым кадром и отдаются в publish_packets. Декодирование (и publish кадров)
+    выполняется, только пока need_pixels() истинно, начиная с ключевого кадра.
+    Возвращает False, если камеру не удалось открыть, и None, если поток не H.264.
+    """
+    camera_name = stream["name"]
+    logger.info(f"Запуск сквозного захвата камеры {camera_name}")
+    try:
+        container = av.open(stream["url"], options={"rtsp_transport": "tcp"}, timeout=(10, 10))
+    except Exception as e:
+        logger.warning(f"Не удалось открыть камеру {camera_name}: {e}")
+        return False
+
+    try:
+        if not container.streams.video:
+            logger.warning(f"Камера {camera_name} не передаёт видеопоток")
+            return False
+        video = container.streams.video[0]
+        if video.codec_context.name != "h264":
+            logger.warning(
+                f"Камера {camera_name} передаёт {video.codec_context.name}, "
+                f"сквозная передача поддерживает только H.264"
+            )
+            return None
+
+        # Размер кадра нужен записи пакетов без декодирования
+        stream["video_size"] = (video.codec_context.width, video.codec_context.height)
+
+        # MP4-подобные источники хранят SPS/PPS в avcC, RTSP — в Annex B в extradata
+        extradata = video.codec_context.extradata or b""
+        bitstream_filter = BitStreamFilterContext(
+            "h264_mp4toannexb" if extradata[:1] == b"\x01" else "dump_extra",
+            video
+        )
+        video.codec_context.thread_type = "AUTO"
+        processor = FrameProcessor(stream, publish)
+        decoding = False
+
+        for packet in container.demux(video):
+            if not stream["running"]:
+                break
+            if packet.size == 0:
+                continue
+
+            # Кадры нужны только модулям и потребителям сырых кадров
+            frames = []
+            if need_pixels():
+                if not decoding and packet.is_keyframe:
+                    decoding = True
+                if decoding:
+                    # Декодируем до фильтра: он забирает данные исходного пакета
+                    frames = video.codec_context.decode(packet)
+            else:
+                decoding = False
+
+            packets = []
+            for filtered in bitstream_filter.filter(packet):
+                filtered.time_base = video.time_base
+                packets.append(filtered)
+            publish_packets(packets)
+
+            for frame in frames:
+                processor.process(frame.to_ndarray(format="bgr24"), frame.pts)
+
+    except av.AVError as e:
+        logger.error(f"Ошибка чтения потока камеры {camera_name}: {e}")
+    finally:
+        container.close()
+        logger.info(f"Сквозной захват камеры {camera_name} завершён.")
+
+    return True
+
+
+_WORKER_STREAM_KEYS = ("id", "name", "url", "overlay_position", "overlay_text")
+
+
+def _capture_worker_thread(stream: Dict[str, Any], ring_name: str, events):
+    """Поток захвата одной камеры внутри рабочего процесса: пишет кадры в кольцо разделяемой памяти.
+
+    Имя кольца уникально для каждого запуска камеры и служит ключом во всех сообщениях,
+    поэтому уведомления от остановленного запуска не смешиваются с новым.
+    """
+    ring = SharedFrameRing.attach(ring_name)
+
+    def publish(frame, changed, frame_bytes):
+        seq = ring.write(frame, frame_bytes)
+        events.put(("frame", ring_name, seq, changed))
+
+    try:
+        # JPEG сжимается в процессе захвата, чтобы не нагружать основной процесс
+        capture_frames(stream, publish, precompress=True)
+    finally:
+        ring.close()
+        events.put(("stopped", ring_name))
+
+
+def capture_worker(commands, events):
+    """Точка входа рабочего процесса захвата: обслуживает назначенные ему камеры."""
+    streams: Dict[Any, Dict[str, Any]] = {}
+    threads: Dict[Any, threading.Thread] = {}
+
+    while True:
+        command = commands.get()
+        action = command[0]
+
+        if action == "start":
+            _, ring_name, camera = command
+            stream = {**camera, "running": True}
+            streams[ring_name] = stream
+            threads[ring_name] = threading.Thread(
+                target=_capture_worker_thread,
+                args=(stream, ring_name, events),
+                name=f"capture-{stream['name']}",
+                daemon=True
+            )
+            threads[ring_name].start()
+
+        elif action == "stop":
+            stream = streams.pop(command[1], None)
+            threads.pop(command[1], None)
+            if stream:
+                stream["running"] = False
+
+        elif action == "shutdown":
+            for stream in streams.values():
+                stream["running"] = False
+            for thread in threads.values():
+                thread.join(timeout=5)
+            break
+
+
+class CaptureProcessPool:
+    """Пул процессов захвата: камеры распределяются по процессам, кадры передаются через разделяемую память.
+
+    Рабочие процессы запускаются по мере добавления камер, но не больше CAPTURE_PROCESSES
+    (0 — по числу ядер). Каждая камера закрепляется за наименее загруженным процессом.
+    """
+    _context = multiprocessing.get_context("spawn")
+    _workers: List[Dict[str, Any]] = []
+    _events = None
+    _listener: Optional[threading.Thread] = None
+    _cameras: Dict[str, Dict[str, Any]] = {}  # Запуски камер по имени кольца
+    _active: Dict[Any, str] = {}  # Имя кольца текущего запуска каждой камеры
+    _lock = threading.Lock()
+
+    @classmethod
+    def _max_workers(cls) -> int:
+        return Config.settings().CAPTURE_PROCESSES or os.cpu_count() or 1
+
+    @classmethod
+    def _ensure_listener(cls):
+        if cls._events is None:
+            cls._events = cls._context.Queue()
+        if cls._listener is None or not cls._listener.is_alive():
+            cls._listener = threading.Thread(target=cls._listen, name="capture-events", daemon=True)
+            cls._listener.start()
+
+    @classmethod
+    def _pick_worker(cls) -> Dict[str, Any]:
+        """Выбирает процесс для новой камеры, при необходимости запуская ещё один."""
+        alive = [worker for worker in cls._workers if worker["process"].is_alive()]
+        cls._workers = alive
+        if len(alive) < cls._max_workers() and all(worker["cameras"] for worker in alive):
+            commands = cls._context.Queue()
+            process = cls._context.Process(
+                target=capture_worker,
+                args=(commands, cls._events),
+                name=f"capture-worker-{len(alive)}",
+                daemon=True
+            )
+            process.start()
+            worker = {"process": process, "commands": commands, "cameras": set()}
+            cls._workers.append(worker)
+            logger.info(f"Запущен процесс захвата {process.name} (pid {process.pid})")
+            return worker
+        return min(alive, key=lambda worker: len(worker["cameras"]))
+
+    @classmethod
+    def start_camera(cls, stream: Dict[str, Any], publish: Callable, on_stop: Callable):
+        """Назначает камеру рабочему процессу и создаёт для неё кольцо кадров."""
+        width, height = Config.settings().CAMERA_RESOLUTION
+        with cls._lock:
+            cls._ensure_listener()
+            ring = SharedFrameRing.create((height, width, 3), Config.settings().FRAME_RING_SIZE)
+            worker = cls._pick_worker()
+            worker["cameras"].add(ring.name)
+            cls._cameras[ring.name] = {
+                "camera_id": stream["id"],
+                "ring": ring,
+                "worker": worker,
+                "publish": publish,
+                "on_stop": on_stop
+            }
+            cls._active[stream["id"]] = ring.name
+            # Процессу передаются только параметры захвата, без объектов основного процесса
+            camera = {key: stream.get(key) for key in _WORKER_STREAM_KEYS}
+            worker["commands"].put(("start", ring.name, camera))
+
+    @classmethod
+    def stop_camera(cls, camera_id):
+        """Останавливает захват камеры; кольцо освобождается после подтверждения от процесса."""
+        with cls._lock:
+            ring_name = cls._active.pop(camera_id, None)
+            camera = cls._cameras.get(ring_name)
+            if camera:
+                camera["worker"]["commands"].put(("stop", ring_name))
+
+    @classmethod
+    def _listen(cls):
+        """Принимает уведомления о новых кадрах от рабочих процессов и публикует их потребителям."""
+        while True:
+            try:
+                event = cls._events.get()
+            except (EOFError, OSError):
+                break
+            if event is None:
+                break
+
+            camera = cls._cameras.get(event[1])
+            if camera is None:
+                continue
+
+            if event[0] == "frame":
+                _, _, seq, changed = event
+                try:
+                    # Потребители держат кадр дольше, чем ячейка кольца остаётся неизменной
+                    result = camera["ring"].read(seq, copy=True)
+                    if result is None:
+                        continue  # Кадр уже перезаписан, дождёмся следующего уведомления
+                    frame, frame_bytes = result
+                    camera["publish"](frame, changed, frame_bytes)
+                except Exception as e:
+                    logger.error(f"Ошибка чтения кадра из разделяемой памяти: {e}")
+
+            elif event[0] == "stopped":
+                with cls._lock:
+                    cls._cameras.pop(event[1], None)
+                    camera["worker"]["cameras"].discard(event[1])
+                    if cls._active.get(camera["camera_id"]) == event[1]:
+                        del cls._active[camera["camera_id"]]
+                camera["ring"].close()
+                camera["ring"].unlink()
+                camera["on_stop"]()
+
+    @classmethod
+    def shutdown(cls):
+        """Останавливает все рабочие процессы и освобождает разделяемую память."""
+        with cls._lock:
+            workers, cls._workers = cls._workers, []
+            cameras, cls._cameras = cls._cameras, {}
+            cls._active = {}
+        for worker in workers:
+            _put_quietly(worker["commands"], ("shutdown",))
+        for worker in workers:
+            worker["process"].join(timeout=10)
+            if worker["process"].is_alive():
+                worker["process"].terminate()
+        for camera in cameras.values():
+            camera["ring"].close()
+            camera["ring"].unlink()
+        if cls._events is not None:
+            _put_quietly(cls._events, None)
+        cls._events = None
+        cls._listener = None
+
+
+def _put_quietly(target_queue, item):
+    """Отправляет сообщение в очередь, игнорируя ошибки закрытой очереди."""
+    try:
+        target_queue.put(item)
+    except (ValueError, OSError, queue.Full):
+        pass
@@ -1,4 +1,4 @@
-﻿from sqlalchemy import create_engine
+﻿from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker
 from app.models.table_models import Base
 from app.config import Config
@@ -9,18 +9,22 @@ logger = LoggerSingleton.get_logger()
 
 # Глобальная сессия базы данных
 global_db_session = None
+# Фабрика отдельных сессий для фоновых задач (запись результатов модулей и т.д.)
+session_factory = None
 
 def init_db():
     """Инициализация базы данных и создание всех таблиц"""
-    global global_db_session
+    global global_db_session, session_factory
     if global_db_session is None:
         try:
             engine = create_engine(Config.settings().DATABASE_URL)
             session_local = sessionmaker(autocommit=False, autoflush=False, bind=engine)
             global_db_session = session_local()
+            session_factory = session_local
 
-            # Создаём таблицы, если их нет
+            # Создаём таблицы, если их нет, и добавляем новые столбцы в существующие
             Base.metadata.create_all(bind=engine)
+            _upgrade_schema(engine)
             logger.info("База данных успешно инициализирована и таблицы созданы.")
         except Exception as e:
             logger.error(f"Ошибка при инициализации базы данных: {e}")
@@ -28,6 +32,30 @@ def init_db():
     else:
         logger.info("База данных уже инициализирована.")
 
+def _upgrade_schema(engine):
+    """Добавляет в существующие таблицы столбцы, появившиеся в моделях после их создания.
+
+    create_all не изменяет уже созданные таблицы, поэтому новые столбцы моделей
+    добавляются через ALTER TABLE со значением по умолчанию из модели.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                statement = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                if column.default is not None and column.default.is_scalar:
+                    default = column.default.arg
+                    if isinstance(default, bool):
+                        default = int(default)
+                    statement += f" DEFAULT {default!r}"
+                connection.execute(text(statement))
+                logger.info(f"В таблицу {table.name} добавлен столбец {column.name}")
+
+
 def close_db():
     """Закрытие сессии базы данных"""
     global global_db_session
@@ -48,3 +76,10 @@ def get_db():
         raise RuntimeError("База данных не инициализирована")
     logger.info("Получена текущая сессия базы данных.")
     return global_db_session
+
+
+def create_session():
+    """Новая сессия базы данных для фонового потока; закрывается вызывающим."""
+    if session_factory is None:
+        raise RuntimeError("База данных не инициализирована")
+    return session_factory()
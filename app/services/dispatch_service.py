@@ -0,0 +1,117 @@
+﻿import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from app.logger import LoggerSingleton
+from app.services.frame_service import CameraFrame
+
+logger = LoggerSingleton.get_logger()
+
+
+class FrameDispatcher:
+    """Передача изменившихся кадров камер в модули с ограничением числа одновременных обработок.
+
+    Для каждой камеры хранится не больше одного ожидающего кадра: новый кадр заменяет
+    ещё не отправленный (побеждает последний), поэтому при отстающих модулях память
+    не растёт. Одновременно обрабатывается не больше camera_limit кадров одной камеры
+    и global_limit кадров всех камер; камеры обслуживаются по очереди.
+    """
+
+    def __init__(
+            self,
+            loop: asyncio.AbstractEventLoop,
+            handler: Callable[[Dict[str, Any], CameraFrame], Awaitable[Any]],
+            camera_limit: int,
+            global_limit: int
+    ):
+        self._loop = loop
+        self._handler = handler
+        self.camera_limit = max(1, camera_limit)
+        self.global_limit = max(1, global_limit)
+        self._lock = threading.Lock()
+        self._pending: Dict[Any, Tuple[Dict[str, Any], CameraFrame]] = {}  # Ожидающий кадр каждой камеры
+        self._in_flight: Dict[Any, int] = {}  # Число обрабатываемых кадров каждой камеры
+        self._total_in_flight = 0
+        self._wakeup_scheduled = False
+        self._stats: Dict[Any, Dict[str, Any]] = {}
+
+    def _camera_stats(self, stream: Dict[str, Any]) -> Dict[str, Any]:
+        stats = self._stats.get(stream["id"])
+        if stats is None:
+            stats = {"name": stream["name"], "submitted": 0, "dispatched": 0, "coalesced": 0, "errors": 0}
+            self._stats[stream["id"]] = stats
+        return stats
+
+    def submit(self, stream: Dict[str, Any], frame: CameraFrame):
+        """Ставит кадр камеры на отправку в модули; вызывается из любого потока."""
+        with self._lock:
+            if not stream["running"]:
+                # Камера уже остановлена и забыта (forget): состояние для неё не создаётся заново
+                return
+            stats = self._camera_stats(stream)
+            stats["submitted"] += 1
+            if stream["id"] in self._pending:
+                # Предыдущий кадр так и не был отправлен: заменяем его новым
+                stats["coalesced"] += 1
+            self._pending[stream["id"]] = (stream, frame)
+            wakeup = not self._wakeup_scheduled
+            self._wakeup_scheduled = True
+        if wakeup:
+            self._loop.call_soon_threadsafe(self._pump)
+
+    def _pump(self):
+        """Запускает обработку ожидающих кадров в пределах лимитов; выполняется в цикле событий."""
+        with self._lock:
+            self._wakeup_scheduled = False
+            ready = []
+            for camera_id in list(self._pending):
+                if self._total_in_flight >= self.global_limit:
+                    break
+                if self._in_flight.get(camera_id, 0) >= self.camera_limit:
+                    continue
+                ready.append(self._pending.pop(camera_id))
+                self._in_flight[camera_id] = self._in_flight.get(camera_id, 0) + 1
+                self._total_in_flight += 1
+
+        for stream, frame in ready:
+            self._loop.create_task(self._run(stream, frame))
+
+    async def _run(self, stream: Dict[str, Any], frame: CameraFrame):
+        camera_id = stream["id"]
+        failed = False
+        try:
+            await self._handler(stream, frame)
+        except Exception as e:
+            failed = True
+            logger.error(f"Ошибка передачи кадра камеры {stream['name']} в модули: {e}")
+        finally:
+            with self._lock:
+                stats = self._stats.get(camera_id)
+                if stats is not None:
+                    stats["dispatched"] += 1
+                    stats["errors"] += failed
+                self._total_in_flight -= 1
+                self._in_flight[camera_id] -= 1
+                if not self._in_flight[camera_id]:
+                    del self._in_flight[camera_id]
+            self._pump()
+
+    def forget(self, camera_id):
+        """Отбрасывает ожидающий кадр и статистику остановленной камеры.
+
+        Вызывается после того, как stream["running"] сброшен: кадры камеры больше не
+        принимаются, а обработки, ещё идущие в модулях, только освобождают свои места.
+        """
+        with self._lock:
+            self._pending.pop(camera_id, None)
+            self._stats.pop(camera_id, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": self._total_in_flight,
+                "pending": len(self._pending),
+                "camera_limit": self.camera_limit,
+                "global_limit": self.global_limit,
+                "cameras": {str(camera_id): dict(stats) for camera_id, stats in self._stats.items()},
+            }
@@ -0,0 +1,270 @@
+﻿import asyncio
+import fractions
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set
+
+import av
+from av import VideoFrame
+
+from app.config import Config
+from app.logger import LoggerSingleton
+
+logger = LoggerSingleton.get_logger()
+
+VIDEO_CLOCK_RATE = 90000  # Тактовая частота RTP для видео
+VIDEO_TIME_BASE = fractions.Fraction(1, VIDEO_CLOCK_RATE)
+
+
+class PacketSubscription:
+    """Очередь закодированных пакетов одного потребителя (WebRTC-зрителя, записи и т.д.).
+
+    Потребитель всегда начинает с ключевого кадра. Если он не успевает забирать пакеты
+    и очередь переполняется, накопленное отбрасывается и он снова ждёт ключевой кадр —
+    медленный зритель не задерживает остальных.
+    """
+
+    def __init__(self, source: 'PacketBroadcaster', maxsize: int):
+        self.source = source
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.waiting_keyframe = True
+        self.dropped = 0  # Число отброшенных из-за переполнения пакетов
+
+    def _offer(self, packet: av.Packet):
+        if self.waiting_keyframe:
+            if not packet.is_keyframe:
+                return
+            self.waiting_keyframe = False
+
+        if self.queue.full():
+            self.dropped += self.queue.qsize()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.waiting_keyframe = True
+            self.source.request_keyframe()
+            return
+        self.queue.put_nowait(packet)
+
+    async def get(self) -> Optional[av.Packet]:
+        """Возвращает следующий пакет или None, если источник закрыт."""
+        return await self.queue.get()
+
+    def close(self):
+        self.source.unsubscribe(self)
+
+
+class PacketBroadcaster:
+    """Рассылка закодированных пакетов камеры всем подписчикам.
+
+    Пакеты кодируются один раз на камеру, подписчики получают ссылки на одни и те же
+    объекты av.Packet. Колбэки on_first/on_last позволяют источнику работать только
+    при наличии подписчиков.
+    """
+
+    def __init__(
+            self,
+            loop: asyncio.AbstractEventLoop,
+            on_first: Optional[Callable[[], None]] = None,
+            on_last: Optional[Callable[[], None]] = None,
+            on_keyframe_request: Optional[Callable[[], None]] = None
+    ):
+        self._loop = loop
+        self._subscribers: Set[PacketSubscription] = set()
+        self._on_first = on_first
+        self._on_last = on_last
+        self._on_keyframe_request = on_keyframe_request
+        self._closed = False
+
+    def subscribe(self, maxsize: int = 0) -> PacketSubscription:
+        """Добавляет подписчика; вызывается из цикла событий."""
+        subscription = PacketSubscription(self, maxsize or Config.settings().PACKET_QUEUE_SIZE)
+        if self._closed:
+            subscription.queue.put_nowait(None)
+            return subscription
+
+        self._subscribers.add(subscription)
+        if len(self._subscribers) == 1 and self._on_first:
+            self._on_first()
+        self.request_keyframe()
+        return subscription
+
+    def unsubscribe(self, subscription: PacketSubscription):
+        if subscription in self._subscribers:
+            self._subscribers.discard(subscription)
+            if not self._subscribers and self._on_last:
+                self._on_last()
+
+    def request_keyframe(self):
+        if self._on_keyframe_request:
+            self._on_keyframe_request()
+
+    def publish(self, packets: List[av.Packet]):
+        """Раздаёт пакеты подписчикам; вызывается из цикла событий."""
+        for packet in packets:
+            for subscription in list(self._subscribers):
+                subscription._offer(packet)
+
+    def publish_threadsafe(self, packets: List[av.Packet]):
+        """Раздаёт пакеты подписчикам из любого потока."""
+        if packets and self._subscribers:
+            self._loop.call_soon_threadsafe(self.publish, packets)
+
+    def close(self):
+        """Закрывает источник: подписчики получают None."""
+        self._closed = True
+        for subscription in self._subscribers:
+            while subscription.queue.full():
+                subscription.queue.get_nowait()
+            subscription.queue.put_nowait(None)
+        self._subscribers.clear()
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._loop
+
+
+class FrameEncoder:
+    """Кодирование кадров камеры (CameraFrame) в пакеты H.264 с метками времени захвата.
+
+    Метки времени берутся из времени захвата кадра в тактах 90 кГц: переменная
+    частота кадров без дублирования. Ключевой кадр выставляется по запросу и не реже
+    keyframe_interval секунд времени захвата. Не потокобезопасен: вызывается из одного потока.
+    """
+
+    def __init__(self, bitrate: int, preset: str, keyframe_interval: float):
+        self.bitrate = bitrate
+        self.preset = preset
+        self.keyframe_interval = keyframe_interval
+        self.codec: Optional[av.CodecContext] = None
+        self._force_keyframe = False
+        self._last_keyframe_time = 0.0
+        self._base_timestamp: Optional[float] = None
+        self._last_pts = -1
+        self.encoded_frames = 0  # Число закодированных кадров
+
+    def request_keyframe(self):
+        self._force_keyframe = True
+
+    def reset(self):
+        """Сбрасывает кодек после ошибки: следующий кадр откроет новый с ключевого кадра."""
+        self.codec = None
+
+    def _create_codec(self, width: int, height: int) -> av.CodecContext:
+        codec = av.CodecContext.create("libx264", "w")
+        codec.width = width
+        codec.height = height
+        codec.pix_fmt = "yuv420p"
+        codec.bit_rate = self.bitrate
+        codec.time_base = VIDEO_TIME_BASE
+        codec.framerate = fractions.Fraction(30, 1)
+        codec.gop_size = 10 ** 6  # Ключевые кадры выставляются вручную
+        codec.options = {
+            "profile": "baseline",
+            "preset": self.preset,
+            "tune": "zerolatency",
+        }
+        codec.open()
+        return codec
+
+    def encode(self, frame) -> List[av.Packet]:
+        """Кодирует кадр камеры в H.264."""
+        image = frame.image
+        height, width = image.shape[:2]
+        if self.codec is None or self.codec.width != width or self.codec.height != height:
+            self.codec = self._create_codec(width, height)
+            self._force_keyframe = True
+
+        video_frame = VideoFrame.from_ndarray(image, format="bgr24")
+
+        if self._base_timestamp is None:
+            self._base_timestamp = frame.timestamp
+        pts = int((frame.timestamp - self._base_timestamp) * VIDEO_CLOCK_RATE)
+        pts = max(pts, self._last_pts + 1)
+        self._last_pts = pts
+        video_frame.pts = pts
+        video_frame.time_base = VIDEO_TIME_BASE
+
+        if self._force_keyframe or frame.timestamp - self._last_keyframe_time >= self.keyframe_interval:
+            video_frame.pict_type = av.video.frame.PictureType.I
+            self._force_keyframe = False
+            self._last_keyframe_time = frame.timestamp
+
+        packets = self.codec.encode(video_frame)
+        for packet in packets:
+            packet.time_base = VIDEO_TIME_BASE
+        self.encoded_frames += 1
+        return packets
+
+
+class SharedEncoder:
+    """Общий H.264-кодировщик камеры: кадр кодируется один раз для всех WebRTC-зрителей.
+
+    Работает только при наличии подписчиков. Кодирование выполняется в отдельном
+    потоке кодировщика; если он не успевает, промежуточные кадры пропускаются
+    (берётся последний доступный кадр). Ключевой кадр выставляется по запросу
+    (новый зритель, переполнение очереди) и не реже ENCODER_KEYFRAME_INTERVAL секунд.
+    """
+
+    def __init__(self, stream: Dict[str, Any], loop: asyncio.AbstractEventLoop):
+        self._stream = stream
+        self._loop = loop
+        self.packets = PacketBroadcaster(
+            loop,
+            on_first=self._start,
+            on_last=self._stop,
+            on_keyframe_request=self.request_keyframe
+        )
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"encoder-{stream['name']}")
+        self._task: Optional[asyncio.Task] = None
+        settings = Config.settings()
+        self.encoder = FrameEncoder(
+            settings.ENCODER_BITRATE,
+            settings.ENCODER_PRESET,
+            settings.ENCODER_KEYFRAME_INTERVAL
+        )
+
+    def _start(self):
+        if self._task is None or self._task.done():
+            self._task = self._loop.create_task(self._run())
+            logger.info(f"Запущен общий кодировщик камеры {self._stream['name']}")
+
+    def _stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            logger.info(f"Общий кодировщик камеры {self._stream['name']} остановлен: нет зрителей")
+
+    def request_keyframe(self):
+        self.encoder.request_keyframe()
+
+    @property
+    def encoded_frames(self) -> int:
+        return self.encoder.encoded_frames
+
+    async def _run(self):
+        last_seq = 0
+        broadcaster = self._stream["broadcaster"]
+        try:
+            while True:
+                frame = await broadcaster.next_frame(last_seq)
+                if frame is None:
+                    break
+                last_seq = frame.seq
+                try:
+                    packets = await self._loop.run_in_executor(self._executor, self.encoder.encode, frame)
+                except Exception as e:
+                    logger.error(f"Ошибка кодирования кадра камеры {self._stream['name']}: {e}")
+                    self.encoder.reset()
+                    continue
+                self.packets.publish(packets)
+        except asyncio.CancelledError:
+            pass
+
+    def close(self):
+        """Останавливает кодировщик и отключает подписчиков."""
+        self._stop()
+        self.packets.close()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,134 @@
+﻿import io
+from typing import List, Optional
+
+import av
+
+from app.logger import LoggerSingleton
+
+logger = LoggerSingleton.get_logger()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Файловый объект, собирающий всё, что пишет муксер."""
+
+    def __init__(self):
+        super().__init__()
+        self.buffer = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.buffer += data
+        return len(data)
+
+
+class Mp4Fragmenter:
+    """Упаковка пакетов H.264 во фрагментированный MP4 (fMP4) в памяти без перекодирования.
+
+    Результат пригоден для MediaSource в браузере: сначала сегмент инициализации
+    (ftyp + moov, свойство init), затем фрагменты moof + mdat. Фрагмент выделяется на
+    каждый кадр и закрывается следующим пакетом, поэтому задержка — один кадр. Метки
+    времени отсчитываются от первого пакета, dts строго возрастает. Поток должен
+    начинаться с ключевого кадра. Не потокобезопасен.
+
+    max_gap ограничивает длительность кадра в секундах: если следующий пакет пришёл
+    позже (камера стояла или кадров не было), метки времени сдвигаются так, чтобы
+    пауза стала равной max_gap.
+    """
+    MOVFLAGS = "frag_every_frame+empty_moov+default_base_moof"
+
+    def __init__(self, movflags: str = MOVFLAGS, max_gap: Optional[float] = None):
+        self._sink = _ChunkSink()
+        self._output = av.open(self._sink, "w", format="mp4", options={"movflags": movflags})
+        self._stream = None
+        self._max_gap = max_gap
+        self._base_dts: Optional[int] = None
+        self._last_dts = -1
+        self._time_base = None
+        self.init: Optional[bytes] = None  # Сегмент инициализации, появляется после первого пакета
+        self.codec: Optional[str] = None  # Кодек по RFC 6381 для MediaSource, например "avc1.42c01f"
+
+    @property
+    def mime_type(self) -> Optional[str]:
+        return f'video/mp4; codecs="{self.codec}"' if self.codec else None
+
+    def write(self, packets: List[av.Packet]) -> bytes:
+        """Добавляет пакеты и возвращает готовые фрагменты (moof + mdat) подряд; b"" — пока нет."""
+        for packet in packets:
+            if packet.pts is None or packet.time_base is None:
+                continue
+            if self._stream is None:
+                self._add_stream(packet)
+
+            dts = packet.dts if packet.dts is not None else packet.pts
+            if self._base_dts is None:
+                self._base_dts = dts
+            if self._max_gap is not None and self._last_dts >= 0:
+                max_gap = int(self._max_gap / packet.time_base)
+                if dts - self._base_dts - self._last_dts > max_gap:
+                    self._base_dts = dts - self._last_dts - max_gap
+            # Пакеты общие с другими потребителями: муксируется копия со своими метками времени
+            dts = max(dts - self._base_dts, self._last_dts + 1)
+            copy = av.Packet(bytes(packet))
+            copy.dts = dts
+            copy.pts = max(packet.pts - self._base_dts, dts)
+            copy.is_keyframe = packet.is_keyframe
+            copy.time_base = packet.time_base
+            copy.stream = self._stream
+            self._last_dts = dts
+            self._time_base = packet.time_base
+            self._output.mux(copy)
+        return self._take()
+
+    @property
+    def timestamp(self) -> Optional[float]:
+        """Время последнего пакета в выходном потоке, с (с учётом сдвигов max_gap)."""
+        if self._time_base is None:
+            return None
+        return float(self._last_dts * self._time_base)
+
+    def _add_stream(self, packet: av.Packet):
+        """Создаёт выходной поток с параметрами из SPS/PPS ключевого кадра (Annex B).
+
+        Без шаблона PyAV открыл бы для выходного потока кодировщик libx264, и в moov
+        попали бы его SPS/PPS вместо параметров камеры.
+        """
+        with av.open(io.BytesIO(bytes(packet)), format="h264") as source:
+            self._stream = self._output.add_stream(template=source.streams.video[0])
+
+    def _take(self) -> bytes:
+        """Забирает из буфера муксера целые блоки верхнего уровня MP4."""
+        buffer = self._sink.buffer
+        position = 0
+        fragments = bytearray()
+        while position + 8 <= len(buffer):
+            size = int.from_bytes(buffer[position:position + 4], "big")
+            if size < 8 or position + size > len(buffer):
+                break
+            box = bytes(buffer[position:position + size])
+            kind = box[4:8]
+            if kind in (b"ftyp", b"moov"):
+                self.init = (self.init or b"") + box
+                if kind == b"moov":
+                    self.codec = self._parse_codec(box)
+            else:
+                fragments += box
+            position += size
+        del buffer[:position]
+        return bytes(fragments)
+
+    @staticmethod
+    def _parse_codec(moov: bytes) -> Optional[str]:
+        # avcC: версия, profile_idc, ограничения профиля, level_idc
+        index = moov.find(b"avcC")
+        if index < 0 or index + 8 > len(moov):
+            return None
+        profile, constraints, level = moov[index + 5:index + 8]
+        return f"avc1.{profile:02x}{constraints:02x}{level:02x}"
+
+    def close(self):
+        try:
+            self._output.close()
+        except Exception as e:
+            logger.debug(f"Ошибка закрытия фрагментированного MP4: {e}")
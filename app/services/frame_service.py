@@ -0,0 +1,278 @@
+﻿import asyncio
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Any, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from app.config import Config
+
+FULL_PROFILE = "full"  # Профиль с разрешением CAMERA_RESOLUTION
+
+
+def profile_size(profile: Optional[str]) -> Tuple[int, int]:
+    """Возвращает размер (ширина, высота) профиля разрешения; None и "full" — CAMERA_RESOLUTION."""
+    if not profile or profile == FULL_PROFILE:
+        return tuple(Config.settings().CAMERA_RESOLUTION)
+    profiles = Config.settings().CAMERA_PROFILES
+    if profile not in profiles:
+        raise ValueError(f"Неизвестный профиль разрешения: {profile}")
+    return tuple(profiles[profile])
+
+
+def encode_jpeg(image: np.ndarray) -> bytes:
+    """Сжимает кадр в JPEG с качеством из настроек."""
+    _, encoded_frame = cv2.imencode(
+        '.jpg', image,
+        [int(cv2.IMWRITE_JPEG_QUALITY), Config.settings().JPEG_QUALITY]
+    )
+    return encoded_frame.tobytes()
+
+
+class CameraFrame:
+    """Кадр камеры с порядковым номером и метаданными.
+
+    Передаётся потребителям и локальным модулям как есть: image — numpy array,
+    JPEG сжимается только при первом обращении к jpeg_bytes().
+    """
+    __slots__ = ("seq", "image", "jpeg", "changed", "timestamp", "_profiles")
+
+    def __init__(self, seq: int, image: Any, jpeg: Optional[bytes], changed: bool, timestamp: float):
+        self.seq = seq  # Порядковый номер кадра в потоке камеры
+        self.image = image  # numpy array (BGR)
+        self.jpeg = jpeg  # JPEG кадра, если уже сжат
+        self.changed = changed  # Изменился ли кадр относительно предыдущего
+        self.timestamp = timestamp  # Время захвата (time.time())
+        self._profiles: Optional[Dict[str, 'CameraFrame']] = None  # Уменьшенные копии по профилям
+
+    def jpeg_bytes(self) -> bytes:
+        """Возвращает JPEG кадра, сжимая его при первом обращении."""
+        if self.jpeg is None:
+            self.jpeg = encode_jpeg(self.image)
+        return self.jpeg
+
+    def resized(self, profile: Optional[str]) -> 'CameraFrame':
+        """Возвращает кадр в разрешении профиля; масштабирование выполняется один раз на кадр и профиль."""
+        width, height = profile_size(profile)
+        if self.image.shape[1] == width and self.image.shape[0] == height:
+            return self
+
+        cached = self._profiles.get(profile) if self._profiles else None
+        if cached is not None:
+            return cached
+
+        image = cv2.resize(self.image, (width, height), interpolation=cv2.INTER_AREA)
+        frame = CameraFrame(self.seq, image, None, self.changed, self.timestamp)
+        if self._profiles is None:
+            self._profiles = {}
+        self._profiles[profile] = frame
+        return frame
+
+
+def _resolve_waiter(waiter: asyncio.Future, frame: Optional[CameraFrame]):
+    if not waiter.done():
+        waiter.set_result(frame)
+
+
+class FrameBroadcaster:
+    """Рассылка кадров камеры потребителям.
+
+    Поток захвата публикует кадры из любого потока, асинхронные потребители (WebRTC,
+    модули) ожидают следующий кадр по его номеру и не опрашивают камеру в цикле.
+    Все ожидающие потребители разделяют одно future, поэтому публикация кадра стоит
+    один вызов в цикл событий независимо от числа зрителей, и только если кто-то ждёт.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._latest: Optional[CameraFrame] = None
+        self._waiter: Optional[asyncio.Future] = None
+        self._closed = False
+        self._last_demand = 0.0  # Время последнего ожидания кадра потребителем
+        self.skipped = 0  # Число кадров без изменений (JPEG не сжимался)
+
+    def publish(
+            self,
+            image: Any,
+            changed: bool = True,
+            jpeg: Optional[bytes] = None,
+            timestamp: Optional[float] = None
+    ) -> CameraFrame:
+        """Публикует новый кадр; jpeg передаётся, если кадр уже сжат при захвате."""
+        with self._lock:
+            self._seq += 1
+            if not changed:
+                self.skipped += 1
+            frame = CameraFrame(
+                self._seq,
+                image,
+                jpeg,
+                changed,
+                time.time() if timestamp is None else timestamp
+            )
+            self._latest = frame
+            waiter, self._waiter = self._waiter, None
+
+        if waiter is not None:
+            self._loop.call_soon_threadsafe(_resolve_waiter, waiter, frame)
+        return frame
+
+    async def next_frame(self, after_seq: int = 0, timeout: Optional[float] = None) -> Optional[CameraFrame]:
+        """Возвращает первый кадр с номером больше after_seq, ожидая его при необходимости.
+
+        Возвращает None, если рассылка закрыта (камера остановлена) или истёк timeout.
+        """
+        with self._lock:
+            self._last_demand = time.monotonic()
+            if self._latest is not None and self._latest.seq > after_seq:
+                return self._latest
+            if self._closed:
+                return None
+            if self._waiter is None:
+                self._waiter = self._loop.create_future()
+            waiter = self._waiter
+
+        try:
+            # shield: отмена одного потребителя не должна отменять общее ожидание
+            return await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        """Закрывает рассылку, ожидающие потребители получают None."""
+        with self._lock:
+            self._closed = True
+            waiter, self._waiter = self._waiter, None
+        if waiter is not None:
+            self._loop.call_soon_threadsafe(_resolve_waiter, waiter, None)
+
+    def has_demand(self, window: float = 2.0) -> bool:
+        """Запрашивал ли кто-нибудь кадры за последние window секунд."""
+        return time.monotonic() - self._last_demand < window
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def latest(self) -> Optional[CameraFrame]:
+        with self._lock:
+            return self._latest
+
+    @property
+    def seq(self) -> int:
+        with self._lock:
+            return self._seq
+
+
+class SharedFrameRing:
+    """Кольцевой буфер кадров в разделяемой памяти для передачи кадров между процессами.
+
+    Раскладка: общий заголовок (номер последнего кадра), затем slots ячеек, каждая из
+    которых содержит заголовок (номер кадра, длина JPEG), BGR-кадр фиксированного размера
+    и место под JPEG. Писатель один (процесс захвата камеры), читателей может быть много.
+    Чтение кадра по умолчанию не копирует данные: возвращается представление numpy поверх
+    ячейки, которое остаётся корректным, пока писатель не сделает ещё slots - 1 записей.
+    Кадр, который живёт дольше (очереди модулей, кодировщик), читается с copy=True.
+    """
+    _HEADER = struct.Struct("qqqq")  # slots, высота, ширина, номер последнего кадра
+    _SLOT_HEADER = struct.Struct("qq")  # номер кадра в ячейке, длина JPEG
+    _SLOT_HEADER_SIZE = 64  # Выравнивание заголовка ячейки
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self.shm = shm
+        self.owner = owner
+        self.slots, height, width, _ = self._HEADER.unpack_from(shm.buf, 0)
+        self.shape = (height, width, 3)
+        self.frame_size = height * width * 3
+        self.jpeg_capacity = self.frame_size
+        self.slot_size = self._SLOT_HEADER_SIZE + self.frame_size + self.jpeg_capacity
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @classmethod
+    def create(cls, shape: Tuple[int, int, int], slots: int) -> 'SharedFrameRing':
+        """Создаёт новое кольцо для кадров формы shape (высота, ширина, 3)."""
+        height, width, _ = shape
+        slots = max(2, slots)
+        frame_size = height * width * 3
+        size = cls._HEADER.size + slots * (cls._SLOT_HEADER_SIZE + 2 * frame_size)
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        cls._HEADER.pack_into(shm.buf, 0, slots, height, width, 0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> 'SharedFrameRing':
+        """Подключается к кольцу, созданному другим процессом."""
+        return cls(shared_memory.SharedMemory(name=name), owner=False)
+
+    def _slot_offset(self, seq: int) -> int:
+        return self._HEADER.size + (seq % self.slots) * self.slot_size
+
+    @property
+    def latest_seq(self) -> int:
+        return struct.unpack_from("q", self.shm.buf, 24)[0]
+
+    def write(self, frame: np.ndarray, jpeg: Optional[bytes]) -> int:
+        """Записывает кадр (и JPEG, если он есть) в следующую ячейку, возвращает номер кадра."""
+        seq = self.latest_seq + 1
+        offset = self._slot_offset(seq)
+        jpeg_len = len(jpeg) if jpeg is not None and len(jpeg) <= self.jpeg_capacity else 0
+
+        # Помечаем ячейку как записываемую, чтобы читатели не получили частично записанный кадр
+        self._SLOT_HEADER.pack_into(self.shm.buf, offset, -1, 0)
+        frame_offset = offset + self._SLOT_HEADER_SIZE
+        target = np.ndarray(self.shape, dtype=np.uint8, buffer=self.shm.buf, offset=frame_offset)
+        target[...] = frame
+        if jpeg_len:
+            jpeg_offset = frame_offset + self.frame_size
+            self.shm.buf[jpeg_offset:jpeg_offset + jpeg_len] = jpeg
+        self._SLOT_HEADER.pack_into(self.shm.buf, offset, seq, jpeg_len)
+        struct.pack_into("q", self.shm.buf, 24, seq)
+        return seq
+
+    def read(self, seq: Optional[int] = None, copy: bool = False) -> Optional[Tuple[np.ndarray, Optional[bytes]]]:
+        """Возвращает (кадр, JPEG) с номером seq (по умолчанию последний) или None, если он перезаписан.
+
+        С copy=True кадр копируется из ячейки и проверяется после копирования, поэтому
+        копия не зависит от дальнейших записей.
+        """
+        seq = self.latest_seq if seq is None else seq
+        if seq <= 0:
+            return None
+        offset = self._slot_offset(seq)
+        slot_seq, jpeg_len = self._SLOT_HEADER.unpack_from(self.shm.buf, offset)
+        if slot_seq != seq:
+            return None
+
+        frame_offset = offset + self._SLOT_HEADER_SIZE
+        frame = np.ndarray(self.shape, dtype=np.uint8, buffer=self.shm.buf, offset=frame_offset)
+        if copy:
+            frame = frame.copy()
+        jpeg = None
+        if jpeg_len:
+            jpeg_offset = frame_offset + self.frame_size
+            jpeg = bytes(self.shm.buf[jpeg_offset:jpeg_offset + jpeg_len])
+
+        # Если писатель успел занять ячейку во время чтения, кадр недействителен
+        if self._SLOT_HEADER.unpack_from(self.shm.buf, offset)[0] != seq:
+            return None
+        return frame, jpeg
+
+    def close(self):
+        try:
+            self.shm.close()
+        except BufferError:
+            # Потребители ещё держат представления кадров; память освободится вместе с ними
+            pass
+
+    def unlink(self):
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,364 @@
+﻿import asyncio
+import math
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from app.config import Config
+from app.logger import LoggerSingleton
+from app.services.fragment_service import Mp4Fragmenter
+from app.services.video_service import get_frame_source
+
+logger = LoggerSingleton.get_logger()
+
+PLAYLIST_MEDIA_TYPE = "application/vnd.apple.mpegurl"
+SEGMENT_MEDIA_TYPE = "video/mp4"
+EXTRA_SEGMENTS = 2  # Сегментов сверх плейлиста, которые ещё хранятся для догружающих их клиентов
+PART_SEGMENTS = 3  # У скольких последних сегментов в плейлисте перечисляются части
+KEYFRAME_SLACK = 1.0  # Запас EXT-X-TARGETDURATION сверх HLS_SEGMENT_DURATION на ожидание ключевого кадра, с
+
+
+class HlsPackager:
+    """HLS с частичными сегментами (LL-HLS) одной камеры в профиле разрешения.
+
+    Пакеты H.264 берутся у того же источника, что и WebRTC и запись (общий кодировщик
+    или сквозная передача камеры), и без перекодирования упаковываются во фрагменты
+    MP4. Фрагменты собираются в части не длиннее HLS_PART_DURATION (более длинная пауза
+    между кадрами укорачивается до неё), части — в сегменты: сегмент закрывается на
+    первом ключевом кадре после HLS_SEGMENT_DURATION, к этому моменту ключевой кадр
+    запрашивается у источника (общий кодировщик выдаёт его следующим кадром).
+    EXT-X-TARGETDURATION постоянна. Сквозная передача камеры ключевые кадры по запросу
+    не даёт, поэтому без них сегмент закрывается принудительно, не превысив
+    TARGETDURATION, и начинается с зависимой части.
+    Всё хранится в памяти: последние HLS_SEGMENT_COUNT сегментов и ещё EXTRA_SEGMENTS.
+
+    Медиаплейлист, части и сегменты лежат по адресам со случайным идентификатором сессии
+    упаковщика и без токена, поэтому CDN отдаёт их всем зрителям; части и сегменты
+    никогда не меняют содержимое и кэшируются навсегда. Упаковщик работает
+    только пока к нему обращаются: через HLS_IDLE_TIMEOUT секунд без запросов он
+    останавливается и отписывается от пакетов камеры.
+    """
+
+    def __init__(self, camera_id, profile: Optional[str]):
+        settings = Config.settings()
+        self.camera_id = camera_id
+        self.profile = profile
+        self.session = uuid.uuid4().hex
+        self.segment_target = float(settings.HLS_SEGMENT_DURATION)
+        self.part_target = float(settings.HLS_PART_DURATION)
+        # Не меняется за время жизни плейлиста; не меньше сегмента плюс часть, чтобы хватало места ключевому кадру
+        self.target_duration = math.ceil(self.segment_target + max(self.part_target, KEYFRAME_SLACK))
+        self.window = max(1, settings.HLS_SEGMENT_COUNT)
+        self.idle_timeout = settings.HLS_IDLE_TIMEOUT
+        self.segments: Deque[Dict[str, Any]] = deque()  # Последний сегмент может быть незавершённым
+        self.inits: Dict[int, bytes] = {}  # Сегменты инициализации по номеру
+        self.codec: Optional[str] = None  # Кодек по RFC 6381 для CODECS многовариантного плейлиста
+        self.closed = False
+        self.last_access = time.monotonic()
+        self.requests = 0
+        self._init_id = 0
+        self._discontinuity = 0  # Номер разрыва потока (перезапуск камеры или переход на кодировщик)
+        self._sequence = 0  # Номер следующего сегмента
+        self._current: Optional[Dict[str, Any]] = None
+        self._part: Optional[Dict[str, Any]] = None
+        self._changed = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        self._task = self._loop.create_task(self._run())
+        self._idle_timer = self._loop.call_later(self.idle_timeout, self._check_idle)
+
+    def touch(self):
+        self.last_access = time.monotonic()
+        self.requests += 1
+
+    def _check_idle(self):
+        idle = time.monotonic() - self.last_access
+        if idle >= self.idle_timeout:
+            logger.info(f"HLS камеры {self.camera_id} остановлен: нет зрителей")
+            self.close()
+        else:
+            self._idle_timer = self._loop.call_later(self.idle_timeout - idle, self._check_idle)
+
+    async def _run(self):
+        source = None
+        subscription = None
+        fragmenter = None
+        previous: Optional[Tuple[float, bool]] = None  # Время и ключевой кадр предыдущего пакета
+        try:
+            while True:
+                stream = get_frame_source(self.camera_id, self.profile)
+                if stream is None:
+                    break
+                if stream["packets"] is not source:
+                    if subscription is not None:
+                        subscription.close()
+                        fragmenter.close()
+                        self._close_segment()
+                        self._discontinuity += 1
+                    source = stream["packets"]
+                    subscription = source.subscribe()
+                    fragmenter = Mp4Fragmenter(max_gap=self.part_target)
+                    previous = None
+
+                packet = await subscription.get()
+                if packet is None:
+                    # Источник закрыт (камера, профиль или переход на общий кодировщик)
+                    source = None
+                    continue
+                if packet.pts is None or packet.time_base is None:
+                    continue
+
+                # Фрагмент предыдущего пакета готов, когда муксируется следующий
+                data = fragmenter.write([packet])
+                timestamp = fragmenter.timestamp
+                if previous is None:
+                    self._init_id += 1
+                    self.inits[self._init_id] = fragmenter.init
+                    self.codec = fragmenter.codec
+                else:
+                    self._add_fragment(data, max(timestamp - previous[0], 0.0), previous[1])
+                previous = (timestamp, packet.is_keyframe)
+
+                if self._current is None:
+                    if packet.is_keyframe:
+                        self._open_segment()
+                elif (packet.is_keyframe and self._current["duration"] >= self.segment_target
+                      or self._current["duration"] + self.part_target > self.target_duration):
+                    # Ключевого кадра нет (сквозная передача): сегмент режется, пока следующий кадр не вывел его за TARGETDURATION
+                    self._close_segment()
+                    self._open_segment()
+                elif self._current["duration"] >= self.segment_target and not self._current["keyframe_requested"]:
+                    # Сегмент ждёт ключевого кадра: общий кодировщик выдаст его следующим кадром
+                    self._current["keyframe_requested"] = True
+                    source.request_keyframe()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Ошибка упаковки HLS камеры {self.camera_id}: {e}")
+        finally:
+            if subscription is not None:
+                subscription.close()
+                fragmenter.close()
+            self.close()
+
+    def _open_segment(self):
+        self._current = {
+            "sequence": self._sequence,
+            "started": time.time(),
+            "init": self._init_id,
+            "discontinuity": self._discontinuity,
+            "parts": [],
+            "duration": 0.0,
+            "keyframe_requested": False,
+            "complete": False,
+            "data": None,
+        }
+        self._sequence += 1
+        self.segments.append(self._current)
+        while len(self.segments) > self.window + EXTRA_SEGMENTS:
+            self.segments.popleft()
+        used = {segment["init"] for segment in self.segments}
+        for init_id in [init_id for init_id in self.inits if init_id not in used]:
+            del self.inits[init_id]
+        self._notify()
+
+    def _add_fragment(self, data: bytes, duration: float, keyframe: bool):
+        if self._current is None or not data:
+            return
+        if self._part is not None and self._part["duration"] + duration > self.part_target:
+            self._close_part()
+        if self._part is None:
+            self._part = {"data": bytearray(), "duration": 0.0, "independent": keyframe}
+        self._part["data"] += data
+        self._part["duration"] += duration
+        self._current["duration"] += duration
+
+    def _close_part(self):
+        if self._part is not None and self._current is not None:
+            self._part["data"] = bytes(self._part["data"])
+            self._current["parts"].append(self._part)
+            self._notify()
+        self._part = None
+
+    def _close_segment(self):
+        self._close_part()
+        segment, self._current = self._current, None
+        if segment is None:
+            return
+        if not segment["parts"]:
+            self.segments.remove(segment)
+        else:
+            segment["data"] = b"".join(part["data"] for part in segment["parts"])
+            segment["complete"] = True
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _find(self, sequence: int) -> Optional[Dict[str, Any]]:
+        if not self.segments:
+            return None
+        index = sequence - self.segments[0]["sequence"]
+        if 0 <= index < len(self.segments):
+            return self.segments[index]
+        return None
+
+    @property
+    def next_sequence(self) -> int:
+        return self._sequence
+
+    def is_ready(self, sequence: int, part: Optional[int] = None) -> bool:
+        """Есть ли сегмент sequence (завершённый) или его часть part."""
+        if self.segments and sequence < self.segments[0]["sequence"]:
+            return True
+        segment = self._find(sequence)
+        if segment is None:
+            return False
+        if part is None:
+            return segment["complete"]
+        return segment["complete"] or len(segment["parts"]) > part
+
+    async def wait_ready(self, sequence: int, part: Optional[int], timeout: float) -> bool:
+        """Ждёт появления сегмента или части (блокирующие запросы LL-HLS)."""
+        deadline = self._loop.time() + timeout
+        while not self.is_ready(sequence, part):
+            remaining = deadline - self._loop.time()
+            if self.closed or remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    def get_segment(self, sequence: int) -> Optional[bytes]:
+        segment = self._find(sequence)
+        return segment["data"] if segment is not None and segment["complete"] else None
+
+    def get_part(self, sequence: int, part: int) -> Optional[bytes]:
+        segment = self._find(sequence)
+        if segment is None or part >= len(segment["parts"]):
+            return None
+        return segment["parts"][part]["data"]
+
+    def master_playlist(self) -> Optional[str]:
+        """Многовариантный плейлист со ссылкой на медиаплейлист сессии или None, если ещё нет ни одной части."""
+        if self.codec is None or self.playlist() is None:
+            return None
+        bitrates = [
+            len(segment["data"]) * 8 / segment["duration"]
+            for segment in self.segments if segment["complete"] and segment["duration"] > 0
+        ]
+        bandwidth = int(max(bitrates, default=Config.settings().ENCODER_BITRATE))
+        return "\n".join([
+            "#EXTM3U",
+            "#EXT-X-VERSION:9",
+            f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},CODECS="{self.codec}"',
+            f"{self.session}/index.m3u8",
+        ]) + "\n"
+
+    def playlist(self) -> Optional[str]:
+        """Медиаплейлист LL-HLS (адреса относительно каталога сессии) или None, если ещё нет ни одной части."""
+        complete = [segment for segment in self.segments if segment["complete"]][-self.window:]
+        current = self._current if self._current is not None and self._current["parts"] else None
+        listed = complete + ([current] if current is not None else [])
+        if not listed:
+            return None
+
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:9",
+            f"#EXT-X-TARGETDURATION:{self.target_duration}",
+            f"#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK={3 * self.part_target:.3f}",
+            f"#EXT-X-PART-INF:PART-TARGET={self.part_target:.3f}",
+            f"#EXT-X-MEDIA-SEQUENCE:{listed[0]['sequence']}",
+            f"#EXT-X-DISCONTINUITY-SEQUENCE:{listed[0]['discontinuity']}",
+        ]
+        init_id = None
+        discontinuity = listed[0]["discontinuity"]
+        for index, segment in enumerate(listed):
+            if segment["discontinuity"] != discontinuity:
+                discontinuity = segment["discontinuity"]
+                lines.append("#EXT-X-DISCONTINUITY")
+            if segment["init"] != init_id:
+                init_id = segment["init"]
+                lines.append(f'#EXT-X-MAP:URI="init{init_id}.mp4"')
+            started = datetime.fromtimestamp(segment["started"], timezone.utc)
+            lines.append(f"#EXT-X-PROGRAM-DATE-TIME:{started.isoformat(timespec='milliseconds')}")
+            if index >= len(listed) - PART_SEGMENTS:
+                for number, part in enumerate(segment["parts"]):
+                    independent = ",INDEPENDENT=YES" if part["independent"] else ""
+                    lines.append(
+                        f'#EXT-X-PART:DURATION={part["duration"]:.5f},'
+                        f'URI="{segment["sequence"]}.{number}.m4s"{independent}'
+                    )
+            if segment["complete"]:
+                lines.append(f"#EXTINF:{segment['duration']:.5f},")
+                lines.append(f"{segment['sequence']}.m4s")
+
+        # Следующая часть: клиент запрашивает её заранее, ответ придёт, как только она будет готова
+        if self._current is not None:
+            hint = f"{self._current['sequence']}.{len(self._current['parts'])}"
+        else:
+            hint = f"{self._sequence}.0"
+        lines.append(f'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="{hint}.m4s"')
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._idle_timer.cancel()
+        self._task.cancel()
+        self._notify()
+        HlsManager.forget(self)
+
+    def get_stats(self) -> dict:
+        return {
+            "camera_id": str(self.camera_id),
+            "profile": self.profile,
+            "session": self.session,
+            "segments": sum(1 for segment in self.segments if segment["complete"]),
+            "next_sequence": self._sequence,
+            "bytes": sum(len(part["data"]) for segment in self.segments for part in segment["parts"]),
+            "requests": self.requests,
+        }
+
+
+class HlsManager:
+    """Упаковщики HLS по камерам и профилям; создаются при первом запросе плейлиста."""
+    _packagers: Dict[Tuple[Any, Optional[str]], HlsPackager] = {}
+    _sessions: Dict[str, HlsPackager] = {}
+
+    @classmethod
+    def get(cls, camera_id, profile: Optional[str] = None) -> Optional[HlsPackager]:
+        """Упаковщик камеры; None, если камера не запущена."""
+        packager = cls._packagers.get((camera_id, profile))
+        if packager is None or packager.closed:
+            if get_frame_source(camera_id, profile) is None:
+                return None
+            packager = HlsPackager(camera_id, profile)
+            cls._packagers[(camera_id, profile)] = packager
+            cls._sessions[packager.session] = packager
+            logger.info(f"Запущен HLS камеры {camera_id}, профиль {profile or 'full'}")
+        packager.touch()
+        return packager
+
+    @classmethod
+    def get_session(cls, session: str) -> Optional[HlsPackager]:
+        packager = cls._sessions.get(session)
+        if packager is not None:
+            packager.touch()
+        return packager
+
+    @classmethod
+    def forget(cls, packager: HlsPackager):
+        if cls._packagers.get((packager.camera_id, packager.profile)) is packager:
+            del cls._packagers[(packager.camera_id, packager.profile)]
+        cls._sessions.pop(packager.session, None)
+
+    @classmethod
+    def get_stats(cls) -> List[dict]:
+        return [packager.get_stats() for packager in list(cls._packagers.values())]
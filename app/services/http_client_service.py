@@ -0,0 +1,244 @@
+﻿import asyncio
+import bisect
+import json
+import struct
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from app.config import Config
+from app.logger import LoggerSingleton
+
+logger = LoggerSingleton.get_logger()
+
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)  # Верхние границы корзин, мс
+
+
+class LatencyHistogram:
+    """Гистограмма времени ответа с фиксированными корзинами (как в Prometheus, без накопления)."""
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts: List[int] = [0] * (len(buckets) + 1)  # Последняя корзина — больше максимальной границы
+        self.total = 0
+        self.sum_ms = 0.0
+        self.errors = 0
+
+    def observe(self, latency_ms: float, error: bool = False):
+        self.counts[bisect.bisect_left(self.buckets, latency_ms)] += 1
+        self.total += 1
+        self.sum_ms += latency_ms
+        self.errors += error
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Оценка квантиля по верхней границе корзины."""
+        if not self.total:
+            return None
+        rank = q * self.total
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return float(self.buckets[index]) if index < len(self.buckets) else float("inf")
+        return None
+
+    def to_dict(self) -> dict:
+        buckets = {f"le_{bound}": count for bound, count in zip(self.buckets, self.counts)}
+        buckets["inf"] = self.counts[-1]
+        return {
+            "count": self.total,
+            "errors": self.errors,
+            "avg_ms": round(self.sum_ms / self.total, 2) if self.total else None,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "buckets": buckets,
+        }
+
+
+class ModuleHttpClient:
+    """Долгоживущий HTTP-клиент сетевого модуля с пулом keep-alive соединений.
+
+    Сессия создаётся при первом запросе (в цикле событий) и переиспользуется всеми
+    запросами к модулю, поэтому TCP/TLS-соединение устанавливается один раз, а не на
+    каждый кадр. Время ответов собирается в гистограммы по видам запросов.
+    aiohttp работает только по HTTP/1.1; постоянный поток кадров — через ModuleStream.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.latency: Dict[str, LatencyHistogram] = {}
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            settings = Config.settings()
+            connector = aiohttp.TCPConnector(
+                limit=settings.MODULE_HTTP_POOL_SIZE,
+                keepalive_timeout=settings.MODULE_HTTP_KEEPALIVE
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(
+                    total=settings.MODULE_HTTP_TIMEOUT,
+                    connect=settings.MODULE_HTTP_CONNECT_TIMEOUT
+                )
+            )
+        return self._session
+
+    def observe(self, kind: str, started: float, error: bool = False):
+        """Учитывает время запроса, начатого в started (time.perf_counter())."""
+        histogram = self.latency.get(kind)
+        if histogram is None:
+            histogram = self.latency[kind] = LatencyHistogram()
+        histogram.observe((time.perf_counter() - started) * 1000, error)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def get_stats(self) -> dict:
+        return {kind: histogram.to_dict() for kind, histogram in self.latency.items()}
+
+
+class ModuleStream:
+    """Постоянный WebSocket-канал к сетевому модулю для потоковой передачи кадров.
+
+    Кадры отправляются подряд без ожидания ответа на каждый. Протокол:
+    - сервер -> модуль: бинарное сообщение = длина заголовка (4 байта, big-endian),
+      JSON-заголовок {"camera_id", "camera_name", "seq", "timestamp"} и JPEG кадра;
+    - модуль -> сервер: текстовое сообщение с JSON-результатом, в котором есть
+      "camera_id" и "seq" кадра, к которому он относится. Результаты могут приходить
+      в любом порядке и не на каждый кадр.
+    Без ответа одновременно может быть не больше window кадров; остальные кадры
+    отбрасываются, пока модуль не догонит. Модуль может не отвечать на кадр, поэтому
+    кадр без ответа дольше pending_timeout (MODULE_STREAM_PENDING_TIMEOUT, несколько
+    интервалов между кадрами) освобождает место в окне. При разрыве канал переподключается.
+    """
+    HEADER_SIZE = struct.Struct(">I")
+    RECONNECT_DELAY = 2.0  # Пауза перед повторным подключением, с
+
+    def __init__(
+            self,
+            client: ModuleHttpClient,
+            url: str,
+            on_result: Callable[[dict], None],
+            window: int,
+            pending_timeout: float
+    ):
+        self.client = client
+        self.url = url
+        self.on_result = on_result
+        self.window = max(1, window)
+        self.pending_timeout = pending_timeout
+        self._ws: Optional[aiohttp.ClientWebSocketResponse] = None
+        self._connect_task: Optional[asyncio.Task] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._retry_at = 0.0
+        self._pending: Dict[Tuple[str, int], float] = {}  # Кадры без ответа: (камера, номер) -> время отправки
+        self.sent = 0
+        self.dropped = 0
+        self.results = 0
+        self.unanswered = 0  # Кадров, на которые модуль не ответил за pending_timeout
+
+    @property
+    def connected(self) -> bool:
+        return self._ws is not None and not self._ws.closed
+
+    def _ensure_connection(self):
+        if self._connect_task is None or self._connect_task.done():
+            if time.monotonic() >= self._retry_at:
+                self._connect_task = asyncio.get_running_loop().create_task(self._connect())
+
+    async def _connect(self):
+        try:
+            ws = await self.client.session.ws_connect(self.url, heartbeat=30, max_msg_size=0)
+        except Exception as e:
+            self._retry_at = time.monotonic() + self.RECONNECT_DELAY
+            logger.warning(f"Не удалось подключиться к потоку модуля {self.client.name}: {e}")
+            return
+        self._ws = ws
+        self._pending.clear()
+        self._reader_task = asyncio.get_running_loop().create_task(self._read(ws))
+        logger.info(f"Подключён поток модуля {self.client.name}: {self.url}")
+
+    async def _read(self, ws: aiohttp.ClientWebSocketResponse):
+        try:
+            async for message in ws:
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                try:
+                    result = json.loads(message.data)
+                except ValueError:
+                    logger.warning(f"Модуль {self.client.name} прислал некорректный результат")
+                    continue
+                started = self._pending.pop((str(result.get("camera_id")), result.get("seq")), None)
+                if started is not None:
+                    self.client.observe("stream", started)
+                self.results += 1
+                self.on_result(result)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if self._ws is ws:
+                self._ws = None
+                self._retry_at = time.monotonic() + self.RECONNECT_DELAY
+                logger.warning(f"Поток модуля {self.client.name} закрыт")
+
+    def _expire_pending(self):
+        """Освобождает окно от кадров, ответа на которые нет дольше pending_timeout.
+
+        Отсутствие ответа — не ошибка: модуль мог ничего не найти в кадре. Такие кадры
+        не попадают в гистограмму времени ответа.
+        """
+        deadline = time.perf_counter() - self.pending_timeout
+        while self._pending:
+            key, started = next(iter(self._pending.items()))
+            if started > deadline:
+                break
+            del self._pending[key]
+            self.unanswered += 1
+
+    async def send(self, header: dict, payload: bytes) -> bool:
+        """Отправляет кадр в канал; возвращает False, если кадр отброшен."""
+        if not self.connected:
+            self._ensure_connection()
+            self.dropped += 1
+            return False
+
+        self._expire_pending()
+        if len(self._pending) >= self.window:
+            self.dropped += 1
+            return False
+
+        encoded = json.dumps(header).encode("utf-8")
+        self._pending[(str(header["camera_id"]), header["seq"])] = time.perf_counter()
+        try:
+            await self._ws.send_bytes(self.HEADER_SIZE.pack(len(encoded)) + encoded + payload)
+        except Exception as e:
+            logger.warning(f"Ошибка отправки кадра в поток модуля {self.client.name}: {e}")
+            self.dropped += 1
+            return False
+        self.sent += 1
+        return True
+
+    async def close(self):
+        ws, self._ws = self._ws, None
+        for task in (self._connect_task, self._reader_task):
+            if task is not None:
+                task.cancel()
+        if ws is not None:
+            await ws.close()
+
+    def get_stats(self) -> dict:
+        return {
+            "connected": self.connected,
+            "in_flight": len(self._pending),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "results": self.results,
+            "unanswered": self.unanswered,
+        }
@@ -0,0 +1,107 @@
+﻿import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+
+LOG_LEVELS = ("debug", "info", "warning", "error")
+
+
+class ModuleLog:
+    """Журнал модуля: кольцевой буфер последних capacity записей.
+
+    Каждая запись — словарь {"id", "time", "level", "camera", "message"}; номер id
+    растёт с каждой записью и служит курсором страниц, поэтому страницы не сдвигаются,
+    когда старые записи вытесняются. Потокобезопасен: записи добавляются из потоков
+    модулей, читаются из обработчиков запросов.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self._entries: Deque[Dict[str, Any]] = deque(maxlen=self.capacity)
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self.dropped = 0  # Число вытесненных записей
+
+    def add(self, message: str, level: str = "info", camera: Optional[str] = None) -> Dict[str, Any]:
+        if level not in LOG_LEVELS:
+            raise ValueError(f"Неизвестный уровень журнала: {level}")
+        with self._lock:
+            entry = {
+                "id": self._next_id,
+                "time": time.time(),
+                "level": level,
+                "camera": camera,
+                "message": message,
+            }
+            self._next_id += 1
+            if len(self._entries) == self.capacity:
+                self.dropped += 1
+            self._entries.append(entry)
+        return entry
+
+    def query(
+            self,
+            level: Optional[str] = None,
+            camera: Optional[str] = None,
+            search: Optional[str] = None,
+            since: Optional[float] = None,
+            before_id: Optional[int] = None,
+            after_id: Optional[int] = None,
+            limit: int = 100
+    ) -> Dict[str, Any]:
+        """Страница записей, новые первыми.
+
+        level — не ниже этого уровня; search — подстрока сообщения без учёта регистра;
+        since — время записи (time.time()). before_id листает назад: следующая страница
+        запрашивается с before_id = "next_before_id". after_id возвращает только записи
+        новее него (для опроса новых записей).
+        """
+        min_level = LOG_LEVELS.index(level) if level is not None else 0
+        needle = search.lower() if search else None
+        with self._lock:
+            entries = list(self._entries)
+            first_id = entries[0]["id"] if entries else self._next_id
+            last_id = self._next_id - 1
+
+        page: List[Dict[str, Any]] = []
+        has_more = False
+        for entry in reversed(entries):
+            if before_id is not None and entry["id"] >= before_id:
+                continue
+            if after_id is not None and entry["id"] <= after_id:
+                break
+            if since is not None and entry["time"] < since:
+                break
+            if LOG_LEVELS.index(entry["level"]) < min_level:
+                continue
+            if camera is not None and entry["camera"] != camera:
+                continue
+            if needle is not None and needle not in entry["message"].lower():
+                continue
+            if len(page) == limit:
+                has_more = True
+                break
+            page.append(dict(entry))
+
+        return {
+            "entries": page,
+            "next_before_id": page[-1]["id"] if has_more else None,
+            "first_id": first_id,
+            "last_id": last_id,
+            "size": len(entries),
+            "capacity": self.capacity,
+            "dropped": self.dropped,
+        }
+
+    def tail(self, limit: int) -> List[str]:
+        """Последние limit записей строками для отчёта, старые первыми."""
+        with self._lock:
+            entries = list(self._entries)[-limit:] if limit > 0 else []
+        return [format_entry(entry) for entry in entries]
+
+
+def format_entry(entry: Dict[str, Any]) -> str:
+    timestamp = datetime.fromtimestamp(entry["time"]).strftime('%Y-%m-%d %H:%M:%S')
+    camera = f"[{entry['camera']}] " if entry["camera"] else ""
+    return f"[{timestamp}] {camera}{entry['message']}"
@@ -3,24 +3,207 @@ import importlib
 import json
 import os
 import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import suppress
-from typing import Dict, List, Optional
+from typing import Any, Callable, Deque, Dict, List, Optional, Set
+from urllib.parse import quote
 
 import aiohttp
 from sqlalchemy.orm import Session
 
+from app.config import Config
 from app.models import table_models
 from app.services.database_service import get_db
+from app.services.http_client_service import ModuleHttpClient, ModuleStream
+from app.services.result_service import ResultStore
 from modules.Module import Module
 from app.logger import LoggerSingleton
 
 logger = LoggerSingleton.get_logger()
 
 
+QUEUE_POLICIES = ("drop_oldest", "drop_newest")
+
+
+class FrameSampler:
+    """Выборка кадров для одного модуля, независимо по каждой камере.
+
+    sample_fps ограничивает частоту кадров каждой камеры по времени захвата,
+    sample_every_n пропускает модулю каждый N-й изменившийся кадр камеры. Если
+    заданы оба ограничения, кадр должен пройти оба; без ограничений модуль получает
+    все кадры.
+    """
+
+    def __init__(self, sample_fps: Optional[float] = None, sample_every_n: Optional[int] = None):
+        self.interval = 1.0 / sample_fps if sample_fps else None
+        self.every_n = sample_every_n if sample_every_n and sample_every_n > 1 else None
+        self._counters: Dict[Any, int] = {}  # Счётчик кадров каждой камеры
+        self._next_time: Dict[Any, float] = {}  # Время, с которого камера может дать следующий кадр
+        self.accepted = 0
+        self.skipped = 0
+
+    def accept(self, camera_id, timestamp: float) -> bool:
+        """Решает, передавать ли кадр камеры модулю; вызывается для каждого кадра по порядку."""
+        if self.every_n:
+            count = self._counters.get(camera_id, 0) + 1
+            self._counters[camera_id] = count
+            if count % self.every_n:
+                self.skipped += 1
+                return False
+
+        if self.interval:
+            next_time = self._next_time.get(camera_id, 0.0)
+            if timestamp < next_time:
+                self.skipped += 1
+                return False
+            # Держим равномерную сетку времени; после долгой паузы отсчёт начинается заново
+            if timestamp - next_time < self.interval:
+                self._next_time[camera_id] = next_time + self.interval
+            else:
+                self._next_time[camera_id] = timestamp + self.interval
+
+        self.accepted += 1
+        return True
+
+    def forget(self, camera_id):
+        self._counters.pop(camera_id, None)
+        self._next_time.pop(camera_id, None)
+
+    def get_stats(self) -> dict:
+        return {
+            "sample_fps": round(1.0 / self.interval, 3) if self.interval else None,
+            "sample_every_n": self.every_n,
+            "accepted": self.accepted,
+            "skipped": self.skipped,
+        }
+
+
+class ModuleWorker:
+    """Очередь кадров одного локального модуля, обрабатываемая в общем пуле потоков.
+
+    Кадры модуля обрабатываются строго по одному (экземпляр модуля не обязан быть
+    потокобезопасным), разные модули работают параллельно. Очередь ограничена: если
+    модуль не успевает, лишние кадры отбрасываются по политике drop_oldest (вытесняется
+    самый старый кадр) или drop_newest (новый кадр не принимается), и медленный модуль
+    снижает частоту кадров только себе. Вызовы start/stop/finalize проходят через ту же
+    очередь вне очереди кадров и никогда не отбрасываются.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            handler: Callable[[dict], Any],
+            executor: ThreadPoolExecutor,
+            maxsize: int,
+            policy: str
+    ):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Неизвестная политика очереди модуля: {policy}")
+        self.name = name
+        self.handler = handler
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self._executor = executor
+        self._frames: Deque[dict] = deque()
+        self._calls: Deque[tuple] = deque()  # Вызовы жизненного цикла: (функция, Future)
+        self._lock = threading.Lock()
+        self._running = False  # Запланирована ли обработка очереди в пуле
+        self.processed = 0  # Число обработанных кадров
+        self.dropped = 0  # Число отброшенных кадров
+        self.busy_time = 0.0  # Суммарное время обработки кадров, с
+
+    def submit(self, data: dict) -> bool:
+        """Ставит кадр в очередь модуля; возвращает False, если кадр отброшен."""
+        with self._lock:
+            accepted = True
+            if len(self._frames) >= self.maxsize:
+                self.dropped += 1
+                if self.policy == "drop_newest":
+                    accepted = False
+                else:
+                    self._frames.popleft()
+            if accepted:
+                self._frames.append(data)
+            self._schedule()
+        return accepted
+
+    def call(self, function: Callable[[], Any]) -> Future:
+        """Выполняет функцию в потоке модуля после текущего кадра, но раньше кадров из очереди."""
+        future = Future()
+        with self._lock:
+            self._calls.append((function, future))
+            self._schedule()
+        return future
+
+    def clear(self):
+        """Отбрасывает кадры, ожидающие обработки."""
+        with self._lock:
+            self._frames.clear()
+
+    def _schedule(self):
+        # Вызывается под self._lock
+        if not self._running:
+            self._running = True
+            self._executor.submit(self._drain)
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                if self._calls:
+                    function, future = self._calls.popleft()
+                    data = None
+                elif self._frames:
+                    function, future = None, None
+                    data = self._frames.popleft()
+                else:
+                    self._running = False
+                    return
+
+            if function is not None:
+                try:
+                    future.set_result(function())
+                except Exception as e:
+                    future.set_exception(e)
+                continue
+
+            started = time.perf_counter()
+            try:
+                self.handler(data)
+            except Exception as e:
+                logger.error(f"Ошибка локального модуля {self.name}: {e}")
+            self.busy_time += time.perf_counter() - started
+            self.processed += 1
+
+    @property
+    def depth(self) -> int:
+        return len(self._frames)
+
+    def get_stats(self) -> dict:
+        return {
+            "queue_depth": self.depth,
+            "queue_size": self.maxsize,
+            "policy": self.policy,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "avg_proceed_ms": round(self.busy_time / self.processed * 1000, 2) if self.processed else None,
+        }
+
+
 class ModuleManager:
     _instance: Optional['ModuleManager'] = None
     modules: Dict[str, Module] = {}
-    frame_counter: int = 0  # Счётчик кадров
+    instances: Dict[str, Module] = {}  # Экземпляры локальных модулей, живут всё время работы сервера
+    workers: Dict[str, ModuleWorker] = {}  # Очереди кадров локальных модулей
+    clients: Dict[str, ModuleHttpClient] = {}  # HTTP-клиенты сетевых модулей с пулом соединений
+    streams: Dict[str, ModuleStream] = {}  # Потоковые каналы сетевых модулей с адресом ws:// или wss://
+    samplers: Dict[str, FrameSampler] = {}  # Выборка кадров по камерам для каждого модуля
+    requests_in_flight: Dict[str, int] = {}  # Запросов к каждому сетевому модулю в обработке
+    requests_dropped: Dict[str, int] = {}  # Кадров, не отправленных сетевому модулю из-за лимита запросов
+    _request_tasks: Set[asyncio.Task] = set()  # Задачи отправки кадров сетевым модулям
+    _executor: Optional[ThreadPoolExecutor] = None  # Общий пул потоков локальных модулей
 
     def __new__(cls):
         if cls._instance is None:
@@ -40,7 +223,9 @@ class ModuleManager:
             module_type: str,
             loaded_class: Optional[type] = None,
             address: Optional[str] = None,
-            enabled: bool = False
+            enabled: bool = False,
+            sample_fps: Optional[float] = None,
+            sample_every_n: Optional[int] = None
     ) -> None:
         if name not in cls.modules:
             module = Module(
@@ -51,10 +236,103 @@ class ModuleManager:
                 loaded_class=loaded_class
             )
             cls.modules[name] = module
+            cls.set_sampling(name, sample_fps, sample_every_n)
+            if module_type == "local" and loaded_class:
+                cls._create_instance(module)
+            elif module_type == "network":
+                cls.clients[name] = ModuleHttpClient(name)
             logger.info(f"Module added: {name} ({module_type})")
         else:
             logger.warning(f"Module already exists: {name}")
 
+    @classmethod
+    def register_module(cls, db_module) -> None:
+        """Добавляет модуль из записи БД, загружая класс локального модуля."""
+        loaded_class = None
+        if db_module.module_type == "local":
+            loaded_class = cls._load_local_module_class(db_module)
+
+        cls.add_module(
+            name=db_module.name,
+            module_type=db_module.module_type,
+            loaded_class=loaded_class,
+            address=db_module.address,
+            enabled=db_module.enabled,
+            sample_fps=db_module.sample_fps,
+            sample_every_n=db_module.sample_every_n
+        )
+
+    @classmethod
+    def set_sampling(cls, module_name: str, sample_fps: Optional[float], sample_every_n: Optional[int]) -> None:
+        """Меняет частоту кадров модуля; отсчёт по камерам начинается заново."""
+        module = cls.modules[module_name]
+        if module.module_type == "network" and not sample_fps and not sample_every_n:
+            # Сетевые модули без явной частоты получают каждый N-й кадр камеры
+            sample_every_n = Config.settings().NETWORK_MODULE_EVERY_N
+        cls.samplers[module_name] = FrameSampler(sample_fps, sample_every_n)
+
+    @classmethod
+    def _create_instance(cls, module: Module) -> None:
+        """Создаёт экземпляр локального модуля один раз и запускает его, если модуль включён."""
+        try:
+            instance = module.loaded_class(
+                name=module.name,
+                module_type="local",
+                address=module.address,
+                enabled=module.enabled
+            )
+        except Exception as e:
+            logger.error(f"Ошибка создания локального модуля {module.name}: {e}")
+            return
+
+        settings = Config.settings()
+        cls.instances[module.name] = instance
+        cls.workers[module.name] = ModuleWorker(
+            module.name,
+            lambda data: cls._process_local_module(module, data),
+            cls._get_executor(),
+            getattr(instance, "queue_size", None) or settings.MODULE_QUEUE_SIZE,
+            getattr(instance, "queue_policy", None) or settings.MODULE_QUEUE_POLICY
+        )
+        if module.enabled:
+            cls._start_instance(module.name)
+
+    @classmethod
+    def _get_executor(cls) -> ThreadPoolExecutor:
+        if cls._executor is None:
+            cls._executor = ThreadPoolExecutor(
+                max_workers=Config.settings().MODULE_WORKERS or None,
+                thread_name_prefix="module"
+            )
+        return cls._executor
+
+    @classmethod
+    def _call_instance(cls, module_name: str, action: str, enabled: bool) -> Optional[Future]:
+        """Вызывает метод жизненного цикла модуля в его потоке, после уже начатого кадра."""
+        instance = cls.instances.get(module_name)
+        if instance is None:
+            return None
+
+        def call():
+            try:
+                instance.enabled = enabled
+                getattr(instance, action)()
+            except Exception as e:
+                logger.error(f"Ошибка {action} модуля {module_name}: {e}")
+
+        return cls.workers[module_name].call(call)
+
+    @classmethod
+    def _start_instance(cls, module_name: str) -> Optional[Future]:
+        return cls._call_instance(module_name, "start", True)
+
+    @classmethod
+    def _stop_instance(cls, module_name: str) -> Optional[Future]:
+        worker = cls.workers.get(module_name)
+        if worker:
+            worker.clear()
+        return cls._call_instance(module_name, "stop", False)
+
     @classmethod
     def toggle_module(cls, module_name: str, enable: bool) -> str:
         if module_name not in cls.modules:
@@ -62,11 +340,106 @@ class ModuleManager:
             return f"Module {module_name} not found"
 
         module = cls.modules[module_name]
+        if module.enabled != enable:
+            if enable:
+                cls._start_instance(module_name)
+            else:
+                cls._stop_instance(module_name)
         module.enabled = enable
         status = "enabled" if enable else "disabled"
         logger.info(f"Module {module_name} {status}")
         return f"Module {module_name} {status}"
 
+    @classmethod
+    def enable_module(cls, module_name: str) -> str:
+        return cls.toggle_module(module_name, True)
+
+    @classmethod
+    def disable_module(cls, module_name: str) -> str:
+        return cls.toggle_module(module_name, False)
+
+    @classmethod
+    def shutdown(cls, timeout: float = 10.0) -> None:
+        """Останавливает локальные модули и вызывает finalize, чтобы они закрыли файлы и освободили ресурсы."""
+        futures = []
+        for name in list(cls.instances):
+            if cls.modules[name].enabled:
+                cls._stop_instance(name)
+            else:
+                cls.workers[name].clear()
+            futures.append((name, cls._call_instance(name, "finalize", False)))
+
+        # Дожидаемся finalize: модуль может дописывать файлы после текущего кадра
+        for name, future in futures:
+            try:
+                future.result(timeout)
+            except Exception as e:
+                logger.error(f"Модуль {name} не завершился за {timeout} с: {e}")
+
+        cls.instances.clear()
+        cls.workers.clear()
+        if cls._executor is not None:
+            cls._executor.shutdown(wait=False)
+            cls._executor = None
+        logger.info("Модули остановлены")
+
+    @classmethod
+    async def close_clients(cls) -> None:
+        """Закрывает потоковые каналы и HTTP-соединения сетевых модулей."""
+        for task in list(cls._request_tasks):
+            task.cancel()
+        for stream in list(cls.streams.values()):
+            await stream.close()
+        cls.streams.clear()
+        for client in list(cls.clients.values()):
+            await client.close()
+
+    @classmethod
+    def _get_client(cls, module: Module) -> ModuleHttpClient:
+        client = cls.clients.get(module.name)
+        if client is None:
+            client = cls.clients[module.name] = ModuleHttpClient(module.name)
+        return client
+
+    @classmethod
+    def _get_stream(cls, module: Module) -> ModuleStream:
+        url = f"{module.address}/stream"
+        stream = cls.streams.get(module.name)
+        if stream is None or stream.url != url:
+            stream = ModuleStream(
+                cls._get_client(module),
+                url,
+                lambda result: cls._handle_stream_result(module.name, result),
+                Config.settings().MODULE_STREAM_WINDOW,
+                Config.settings().MODULE_STREAM_PENDING_TIMEOUT
+            )
+            cls.streams[module.name] = stream
+        return stream
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, dict]:
+        """Состояние очередей локальных модулей и время ответа сетевых модулей для метрик."""
+        stats = {name: {"sampling": sampler.get_stats()} for name, sampler in list(cls.samplers.items())}
+        for name, worker in list(cls.workers.items()):
+            stats.setdefault(name, {}).update(worker.get_stats())
+        for name, client in list(cls.clients.items()):
+            stats.setdefault(name, {})["latency"] = client.get_stats()
+        for name, stream in list(cls.streams.items()):
+            stats.setdefault(name, {})["stream"] = stream.get_stats()
+        for name, in_flight in list(cls.requests_in_flight.items()):
+            stats.setdefault(name, {})["requests"] = {
+                "in_flight": in_flight,
+                "dropped": cls.requests_dropped.get(name, 0),
+            }
+        return stats
+
+    @classmethod
+    def forget_camera(cls, camera_id) -> None:
+        """Сбрасывает состояние выборки и последние результаты остановленной камеры."""
+        for sampler in list(cls.samplers.values()):
+            sampler.forget(camera_id)
+        ResultStore.forget_camera(camera_id)
+
     @classmethod
     def get_module_status(cls, module_name: str) -> str:
         module = cls.modules.get(module_name)
@@ -76,69 +449,153 @@ class ModuleManager:
         return f"Module {module_name} is {'enabled' if module.enabled else 'disabled'}"
 
     @classmethod
-    async def process_data(cls, data: dict) -> List[dict]:
-        results = []
+    def has_active_modules(cls, decoded_only: bool = False) -> bool:
+        """Есть ли включённые модули, которым нужны кадры.
+
+        decoded_only — не считать модули, которые для камер со сквозной передачей
+        работают со сжатыми пакетами (records_packets): ради них кадры не декодируются.
+        """
+        return any(
+            module.enabled and not (decoded_only and cls._records_packets(module))
+            for module in cls.modules.values()
+        )
+
+    @classmethod
+    def _records_packets(cls, module: Module) -> bool:
+        instance = cls.instances.get(module.name)
+        return bool(getattr(instance if instance is not None else module.loaded_class, "records_packets", False))
+
+    @classmethod
+    async def process_data(cls, data: dict) -> None:
+        """Передаёт кадр модулям.
+
+        data содержит "frame" (CameraFrame), "camera_id" и "camera_name". Локальные модули
+        получают кадр как numpy array без сжатия, сетевые — JPEG в теле запроса. Метод
+        возвращается, как только кадр поставлен в очереди локальных модулей: запросы к
+        сетевым модулям выполняются отдельными задачами, и медленный сетевой модуль не
+        задерживает следующие кадры камеры. К каждому сетевому модулю одновременно идёт
+        не больше MODULE_REQUEST_LIMIT запросов, кадры сверх лимита ему не отправляются.
+        """
         active_modules = [m for m in cls.modules.values() if m.enabled]
 
         if not active_modules:
             logger.warning("No active modules to process data")
-            return []
+            return
 
+        # Каждый модуль получает кадры камеры со своей частотой
+        camera_id = data["camera_id"]
+        timestamp = data["frame"].timestamp
+        network_modules = []
         for module in active_modules:
+            sampler = cls.samplers.get(module.name)
+            if sampler is not None and not sampler.accept(camera_id, timestamp):
+                continue
             if module.module_type == "local":
-                cls._process_local_module(module, data)
-        cls.frame_counter += 1  # Увеличиваем счётчик кадров
-        if cls.frame_counter % 10 == 0:  # Если это 10-й кадр
-            try:
-                async with asyncio.TaskGroup() as tg:
-                    tasks = [tg.create_task(cls._process_single_module(module, data))
-                             for module in active_modules if module.module_type == "network"]
+                # Модуль работает в пуле потоков, цикл событий не ждёт его
+                worker = cls.workers.get(module.name)
+                if worker is not None:
+                    worker.submit(data)
+            elif module.module_type == "network" and cls._acquire_request(module.name):
+                network_modules.append(module)
+
+        if network_modules:
+            task = asyncio.get_running_loop().create_task(cls._process_network_modules(network_modules, data))
+            cls._request_tasks.add(task)
+            task.add_done_callback(cls._request_tasks.discard)
 
-                for task in tasks:
-                    if not task.cancelled() and not isinstance(task.result(), Exception):
-                        results.append(task.result())
+    @classmethod
+    def _acquire_request(cls, module_name: str) -> bool:
+        """Занимает место для запроса к сетевому модулю; False — модуль ещё занят предыдущими кадрами."""
+        in_flight = cls.requests_in_flight.get(module_name, 0)
+        if in_flight >= max(1, Config.settings().MODULE_REQUEST_LIMIT):
+            cls.requests_dropped[module_name] = cls.requests_dropped.get(module_name, 0) + 1
+            return False
+        cls.requests_in_flight[module_name] = in_flight + 1
+        return True
 
-            except ExceptionGroup as eg:
-                for ex in eg.exceptions:
-                    logger.error(f"Task group error: {ex}")
-            except Exception as e:
-                logger.error(f"Unexpected processing error: {e}")
+    @classmethod
+    def _release_request(cls, module_name: str):
+        cls.requests_in_flight[module_name] = max(0, cls.requests_in_flight.get(module_name, 0) - 1)
 
-        return results
+    @classmethod
+    async def _process_network_modules(cls, modules: List[Module], data: dict):
+        """Отправляет кадр сетевым модулям; место каждого модуля освобождается по его ответу."""
+        try:
+            # Кадр сжимается один раз для всех сетевых модулей и вне цикла событий
+            frame_bytes = await asyncio.get_running_loop().run_in_executor(None, data["frame"].jpeg_bytes)
+        except BaseException as e:
+            for module in modules:
+                cls._release_request(module.name)
+            if not isinstance(e, Exception):
+                raise
+            logger.error(f"Ошибка сжатия кадра для сетевых модулей: {e}")
+            return
+
+        async def send(module: Module):
+            try:
+                await cls._process_single_module(module, data, frame_bytes)
+            finally:
+                cls._release_request(module.name)
+
+        await asyncio.gather(*(send(module) for module in modules))
 
     @classmethod
-    async def _process_single_module(cls, module: Module, data: dict):
+    async def _process_single_module(cls, module: Module, data: dict, frame_bytes: Optional[bytes] = None):
         with suppress(asyncio.CancelledError):
             try:
                 if module.module_type == "network":
-                    return await cls._process_network_request(module, data)
+                    if is_stream_address(module.address):
+                        return await cls._process_stream_request(module, data, frame_bytes)
+                    return await cls._process_network_request(module, data, frame_bytes)
                 return cls._process_local_module(module, data)
             except Exception as e:
                 logger.error(f"Module {module.name} error: {e}")
                 return e
 
     @classmethod
-    async def _process_network_request(cls, module: Module, data: dict):
-        timeout = aiohttp.ClientTimeout(total=30, connect=10)
+    def _frame_headers(cls, data: dict) -> Dict[str, str]:
+        """Заголовки запроса к сетевому модулю с метаданными кадра."""
+        frame = data["frame"]
+        return {
+            "Content-Type": "image/jpeg",
+            "X-Camera-Id": str(data["camera_id"]),
+            "X-Camera-Name": quote(data["camera_name"]),  # Заголовки HTTP допускают только ASCII
+            "X-Frame-Seq": str(frame.seq),
+            "X-Frame-Timestamp": f"{frame.timestamp:.6f}",
+        }
+
+    @classmethod
+    async def _process_network_request(cls, module: Module, data: dict, frame_bytes: Optional[bytes] = None):
+        """Отправляет кадр сетевому модулю: тело запроса — JPEG, метаданные — в заголовках X-Camera-*/X-Frame-*."""
+        if frame_bytes is None:
+            frame_bytes = data["frame"].jpeg_bytes()
+        client = cls._get_client(module)
+        started = time.perf_counter()
         try:
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                try:
-                    async with session.post(
-                            f"{module.address}/proceed",
-                            json=data,
-                            timeout=timeout
-                    ) as response:
-                        response.raise_for_status()
-                        return await cls._handle_network_response(response, module.name)
-                except asyncio.TimeoutError:
-                    logger.warning(f"Таймаут в процессе ожидания ответа от  {module.name}")
-                    return {"error": "Превышено время ожидание ответа"}
-                except aiohttp.ClientError as e:
-                    logger.error(f"Сетевая ошибка в  {module.name}: {e}")
-                    return {"error": str(e)}
-                except Exception as e:
-                    logger.error(f"Неизвестная ошибка в {module.name}: {e}")
-                    return {"error": f"Неизвестная ошибка в: {e}"}
+            session = client.session
+            try:
+                async with session.post(
+                        f"{module.address}/proceed",
+                        data=frame_bytes,
+                        headers=cls._frame_headers(data)
+                ) as response:
+                    response.raise_for_status()
+                    result = await cls._handle_network_response(response, module.name)
+                    client.observe("proceed", started)
+                    cls._store_result(module.name, data, result)
+                    return result
+            except asyncio.TimeoutError:
+                client.observe("proceed", started, error=True)
+                logger.warning(f"Таймаут в процессе ожидания ответа от  {module.name}")
+                return {"error": "Превышено время ожидание ответа"}
+            except aiohttp.ClientError as e:
+                client.observe("proceed", started, error=True)
+                logger.error(f"Сетевая ошибка в  {module.name}: {e}")
+                return {"error": str(e)}
+            except Exception as e:
+                client.observe("proceed", started, error=True)
+                logger.error(f"Неизвестная ошибка в {module.name}: {e}")
+                return {"error": f"Неизвестная ошибка в: {e}"}
 
         except asyncio.CancelledError:
             logger.warning(f"Запрос отклонен от : {module.name}")
@@ -147,42 +604,81 @@ class ModuleManager:
             logger.error(f"Неизвестная ошибка от {module.name}: {e}")
             return {"error": f"Неизвестная ошибка в процессе установления соединения: {e}"}
 
+    @classmethod
+    async def _process_stream_request(cls, module: Module, data: dict, frame_bytes: Optional[bytes] = None):
+        """Отправляет кадр в потоковый канал модуля, не дожидаясь результата.
+
+        Результат придёт позже в _handle_stream_result с camera_id и seq кадра.
+        """
+        if frame_bytes is None:
+            frame_bytes = data["frame"].jpeg_bytes()
+        frame = data["frame"]
+        header = {
+            "camera_id": str(data["camera_id"]),
+            "camera_name": data["camera_name"],
+            "seq": frame.seq,
+            "timestamp": frame.timestamp,
+        }
+        await cls._get_stream(module).send(header, frame_bytes)
+        return None
+
+    @classmethod
+    def _handle_stream_result(cls, module_name: str, result: dict):
+        """Принимает результат потокового модуля, привязанный к кадру камеры."""
+        ResultStore.add(
+            module_name,
+            result.get("camera_id"),
+            result,
+            seq=result.get("seq"),
+            frame_timestamp=result.get("timestamp")
+        )
+
+    @classmethod
+    def _store_result(cls, module_name: str, data: dict, result: Any):
+        """Сохраняет результат модуля по кадру; пустые результаты не сохраняются."""
+        if result is None:
+            return
+        frame = data["frame"]
+        ResultStore.add(
+            module_name,
+            data["camera_id"],
+            result,
+            seq=frame.seq,
+            frame_timestamp=frame.timestamp,
+            camera_name=data["camera_name"]
+        )
+
     @classmethod
     def _process_local_module(cls, module: Module, data: dict):
-        if not module.loaded_class:
+        """Обрабатывает кадр локальным модулем; выполняется в потоке модуля."""
+        instance = cls.instances.get(module.name)
+        if instance is None:
             logger.error(f"Класс не был загружен для модуля: {module.name}")
             return {"error": "Класс модуля не был загружен"}
 
         try:
-            instance = module.loaded_class(
-                name=module.name,
-                module_type="local",
-                address=module.address,
-                enabled=module.enabled
-            )
-            result = instance.proceed(data)
+            result = instance.proceed(cls._data_for_resolution(module, data))
+            cls._store_result(module.name, data, result)
             return result
         except Exception as e:
             logger.error(f"Ошибка локального модуля {module.name}: {e}")
             return {"error": str(e)}
 
+    @classmethod
+    def _data_for_resolution(cls, module: Module, data: dict) -> dict:
+        """Подменяет кадр в данных на кадр в профиле разрешения, который запросил модуль."""
+        resolution = getattr(module.loaded_class, "resolution", None)
+        if not resolution:
+            return data
+        return {**data, "frame": data["frame"].resized(resolution)}
+
     @classmethod
     def initialize_modules(cls):
         logger.info("Initializing modules from database")
         db_modules = cls.get_all_modules()
 
         for db_module in db_modules:
-            loaded_class = None
-            if db_module.module_type == "local":
-                loaded_class = cls._load_local_module_class(db_module)
-
-            cls.add_module(
-                name=db_module.name,
-                module_type=db_module.module_type,
-                loaded_class=loaded_class,
-                address=db_module.address,
-                enabled=db_module.enabled
-            )
+            cls.register_module(db_module)
 
         logger.info(f"Initialized modules: {len(cls.modules)}")
 
@@ -232,33 +728,42 @@ class ModuleManager:
             logger.error(f"Info request error {module_name}: {e}")
             return {"error": str(e)}
 
+    @classmethod
+    def get_module_logs(cls, module_name: str, **query) -> Optional[dict]:
+        """Страница журнала локального модуля (см. ModuleLog.query); None — журнала нет.
+
+        Журналы сетевых модулей хранятся у самих модулей и доступны через их /getinfo.
+        """
+        instance = cls.instances.get(module_name)
+        if instance is None:
+            return None
+        return instance.get_logs(**query)
+
     @classmethod
     def _get_local_module_info(cls, module: Module) -> dict:
-        if not module.loaded_class:
+        instance = cls.instances.get(module.name)
+        if instance is None:
             return {"error": "Module class not loaded"}
 
         try:
-            instance = module.loaded_class(
-                name=module.name,
-                module_type="local",
-                address=module.address,
-                enabled=module.enabled
-            )
             return instance.get_info()
         except Exception as e:
             return {"error": str(e)}
 
     @classmethod
     async def _get_network_module_info(cls, module: Module) -> dict:
+        client = cls._get_client(module)
+        started = time.perf_counter()
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"{module.address}/getinfo") as response:
-                    content = await response.text()
-                    return {
-                        "status": response.status,
-                        "content": cls._parse_module_content(content)
-                    }
+            async with client.session.get(f"{http_address(module.address)}/getinfo") as response:
+                content = await response.text()
+                client.observe("getinfo", started)
+                return {
+                    "status": response.status,
+                    "content": cls._parse_module_content(content)
+                }
         except aiohttp.ClientError as e:
+            client.observe("getinfo", started, error=True)
             return {"error": str(e)}
 
     @classmethod
@@ -273,7 +778,24 @@ class ModuleManager:
 
     @classmethod
     async def _handle_network_response(cls, response, name):
-        logger.debug(f"Network response {name}, {response}")
+        # Тело читается полностью, иначе соединение не вернётся в пул
+        body = await response.read()
+        logger.debug(f"Network response {name}, {response.status}, {len(body)} байт")
+        if response.content_type == "application/json" and body:
+            return json.loads(body)
+        return None
+
+
+def is_stream_address(address: Optional[str]) -> bool:
+    """Адрес потокового канала сетевого модуля (WebSocket), а не HTTP."""
+    return bool(address) and address.startswith(("ws://", "wss://"))
+
+
+def http_address(address: str) -> str:
+    """HTTP-адрес модуля для служебных запросов (getinfo) при адресе ws:// или wss://."""
+    if is_stream_address(address):
+        return "http" + address[2:]
+    return address
 
 
 # Функция для проверки, является ли контент HTML
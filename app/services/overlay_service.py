@@ -0,0 +1,113 @@
+﻿from datetime import datetime
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+from app.config import Config
+
+OVERLAY_POSITIONS = ("top-left", "top-right", "bottom-left", "bottom-right")
+OVERLAY_OFF = "off"
+DEFAULT_OVERLAY_POSITION = "bottom-right"
+DEFAULT_OVERLAY_TEXT = "{time} | Cam: {camera}"  # {time} и {camera} заменяются временем и названием камеры
+
+
+def validate_overlay_position(position: Optional[str]) -> str:
+    """Проверяет положение надписи; None означает положение по умолчанию."""
+    if not position:
+        return DEFAULT_OVERLAY_POSITION
+    if position != OVERLAY_OFF and position not in OVERLAY_POSITIONS:
+        raise ValueError(f"Неизвестное положение надписи: {position}")
+    return position
+
+
+class OverlayCompositor:
+    """Надпись с временем и названием камеры поверх кадров.
+
+    Текст меняется раз в секунду, поэтому он растеризуется в небольшую BGRA-плитку
+    только при изменении строки, а на каждом кадре плитка лишь копируется (или
+    смешивается по альфа-каналу при полупрозрачном фоне) в область кадра.
+    """
+    FONT = cv2.FONT_HERSHEY_SIMPLEX
+    FONT_SCALE = 1.0
+    THICKNESS = 2
+    TEXT_COLOR = (255, 255, 255)  # Белый цвет текста
+    BACKGROUND_COLOR = (0, 0, 0)  # Чёрный фон
+    PADDING = 5  # Отступ текста от края фона
+    MARGIN = 5  # Отступ фона от края кадра
+
+    def __init__(self, camera_name: str, position: Optional[str] = None, text: Optional[str] = None):
+        self.camera_name = camera_name
+        self.position = validate_overlay_position(position)
+        self.template = text or DEFAULT_OVERLAY_TEXT
+        self.opacity = float(Config.settings().OVERLAY_OPACITY)
+        self._text: Optional[str] = None  # Строка, для которой построена плитка
+        self._tile: Optional[np.ndarray] = None  # BGR плитки, при прозрачности — уже умноженный на альфу
+        self._inverse_alpha: Optional[np.ndarray] = None  # 1 - альфа для смешивания с кадром
+
+    @property
+    def enabled(self) -> bool:
+        return self.position != OVERLAY_OFF
+
+    def _format(self) -> str:
+        current_time = datetime.now().strftime("%d.%m.%Y %H:%M:%S")
+        return self.template.replace("{time}", current_time).replace("{camera}", self.camera_name)
+
+    def _render(self, text: str):
+        """Растеризует надпись в плитку BGRA и готовит её к наложению."""
+        (text_width, text_height), baseline = cv2.getTextSize(text, self.FONT, self.FONT_SCALE, self.THICKNESS)
+        width = text_width + 2 * self.PADDING
+        height = text_height + baseline + 2 * self.PADDING
+
+        tile = np.zeros((height, width, 4), dtype=np.uint8)
+        tile[:, :, :3] = self.BACKGROUND_COLOR
+        tile[:, :, 3] = int(round(255 * self.opacity))
+        cv2.putText(
+            tile,
+            text,
+            (self.PADDING, self.PADDING + text_height),
+            self.FONT,
+            self.FONT_SCALE,
+            self.TEXT_COLOR + (255,),
+            self.THICKNESS,
+            cv2.LINE_AA
+        )
+
+        self._text = text
+        if self.opacity >= 1.0:
+            self._tile = np.ascontiguousarray(tile[:, :, :3])
+            self._inverse_alpha = None
+        else:
+            alpha = tile[:, :, 3:].astype(np.float32) / 255.0
+            self._tile = tile[:, :, :3].astype(np.float32) * alpha
+            self._inverse_alpha = 1.0 - alpha
+
+    def _origin(self, frame_width: int, frame_height: int, width: int, height: int) -> Tuple[int, int]:
+        vertical, horizontal = self.position.split("-")
+        x = self.MARGIN if horizontal == "left" else frame_width - width - self.MARGIN
+        y = self.MARGIN if vertical == "top" else frame_height - height - self.MARGIN
+        return max(0, x), max(0, y)
+
+    def apply(self, frame: np.ndarray):
+        """Накладывает надпись на кадр на месте."""
+        if not self.enabled:
+            return
+        text = self._format()
+        if text != self._text:
+            self._render(text)
+
+        frame_height, frame_width = frame.shape[:2]
+        tile_height, tile_width = self._tile.shape[:2]
+        x, y = self._origin(frame_width, frame_height, tile_width, tile_height)
+        # Плитка обрезается, если кадр меньше надписи
+        height = min(tile_height, frame_height - y)
+        width = min(tile_width, frame_width - x)
+        if height <= 0 or width <= 0:
+            return
+
+        roi = frame[y:y + height, x:x + width]
+        tile = self._tile[:height, :width]
+        if self._inverse_alpha is None:
+            roi[:] = tile
+        else:
+            roi[:] = (roi * self._inverse_alpha[:height, :width] + tile).astype(np.uint8)
@@ -0,0 +1,109 @@
+﻿import asyncio
+import time
+from typing import Any, Dict, Optional
+
+from app.logger import LoggerSingleton
+from app.services.encoder_service import SharedEncoder
+from app.services.frame_service import FrameBroadcaster, profile_size
+
+logger = LoggerSingleton.get_logger()
+
+PROFILE_IDLE_TIMEOUT = 5.0  # Через сколько секунд без потребителей профиль перестаёт вычисляться
+
+
+class ProfileStream:
+    """Поток кадров камеры в разрешении дополнительного профиля (720p, 360p и т.д.).
+
+    Создаётся при первом обращении и масштабирует кадры основного потока камеры,
+    только пока у него есть потребители кадров или WebRTC-зрители; после
+    PROFILE_IDLE_TIMEOUT секунд простоя останавливается и удаляется из камеры.
+    У профиля свой общий кодировщик, поэтому зрители сетки получают дешёвый поток.
+    """
+
+    def __init__(self, camera_stream: Dict[str, Any], profile: str, loop: asyncio.AbstractEventLoop):
+        self.profile = profile
+        self.size = profile_size(profile)
+        self._camera_stream = camera_stream
+        self._loop = loop
+        self._started = time.monotonic()
+
+        broadcaster = FrameBroadcaster(loop)
+        # Описание потока профиля в том же виде, что и у камеры: кадры и пакеты
+        self.stream = {
+            "id": camera_stream["id"],
+            "name": f"{camera_stream['name']}/{profile}",
+            "broadcaster": broadcaster,
+        }
+        self.encoder = SharedEncoder(self.stream, loop)
+        self.stream["packets"] = self.encoder.packets
+        self._task = loop.create_task(self._run())
+        logger.info(f"Запущен профиль {self.stream['name']} {self.size[0]}x{self.size[1]}")
+
+    def _in_use(self) -> bool:
+        if time.monotonic() - self._started < PROFILE_IDLE_TIMEOUT:
+            return True
+        return (
+            self.stream["broadcaster"].has_demand(PROFILE_IDLE_TIMEOUT)
+            or self.stream["packets"].subscriber_count > 0
+        )
+
+    async def _run(self):
+        source: FrameBroadcaster = self._camera_stream["broadcaster"]
+        broadcaster: FrameBroadcaster = self.stream["broadcaster"]
+        last_seq = 0
+        try:
+            while self._in_use():
+                frame = await source.next_frame(last_seq, timeout=PROFILE_IDLE_TIMEOUT)
+                if frame is None:
+                    if source.closed:
+                        break
+                    continue
+                last_seq = frame.seq
+
+                resized = await self._loop.run_in_executor(None, frame.resized, self.profile)
+                broadcaster.publish(resized.image, frame.changed, timestamp=frame.timestamp)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Ошибка профиля {self.stream['name']}: {e}")
+        finally:
+            self._release()
+
+    def _release(self):
+        profiles = self._camera_stream.get("profiles", {})
+        if profiles.get(self.profile) is self:
+            del profiles[self.profile]
+        self.stream["broadcaster"].close()
+        self.encoder.close()
+        logger.info(f"Профиль {self.stream['name']} остановлен")
+
+    def close(self):
+        self._task.cancel()
+
+
+def get_profile_stream(
+        camera_stream: Dict[str, Any],
+        profile: Optional[str],
+        loop: Optional[asyncio.AbstractEventLoop] = None
+) -> Dict[str, Any]:
+    """Возвращает описание потока камеры в нужном профиле, создавая профиль при необходимости.
+
+    Для полного разрешения возвращается сам поток камеры.
+    """
+    width, height = profile_size(profile)
+    full_width, full_height = profile_size(None)
+    if width == full_width and height == full_height:
+        return camera_stream
+
+    profiles = camera_stream.setdefault("profiles", {})
+    profile_stream = profiles.get(profile)
+    if profile_stream is None:
+        profile_stream = ProfileStream(camera_stream, profile, loop or asyncio.get_running_loop())
+        profiles[profile] = profile_stream
+    return profile_stream.stream
+
+
+def close_profiles(camera_stream: Dict[str, Any]):
+    """Останавливает все профили камеры."""
+    for profile_stream in list(camera_stream.get("profiles", {}).values()):
+        profile_stream.close()
@@ -0,0 +1,934 @@
+﻿import asyncio
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+import av
+
+from app.logger import LoggerSingleton
+from app.models.table_models import RecordingSegment
+from app.services import database_service
+
+logger = LoggerSingleton.get_logger()
+
+# Контейнеры сегментов: формат FFmpeg и параметры муксера
+SEGMENT_CONTAINERS = {
+    # Фрагментированный MP4: фрагмент пишется на каждом ключевом кадре, файл читается во время записи
+    "mp4": ("mp4", {"movflags": "frag_keyframe+empty_moov+default_base_moof"}),
+    "mkv": ("matroska", {}),
+}
+SEGMENT_INDEX_FILE = "index.jsonl"  # Индекс завершённых сегментов в каталоге камеры, по строке JSON на сегмент
+MAX_PRE_EVENT_GROUP = 30.0  # Группа без ключевого кадра дольше этого не хранится в буфере предзаписи, с
+MAX_TIMESTAMP_GAP = 5.0  # Разрыв меток времени пакетов (переподключение камеры), после которого начинается новый сегмент, с
+MAX_CLIP_DURATION = 600.0  # Наибольшая длительность клипа, собираемого из сегментов, с
+CLIP_CACHE_SIZE = 16  # Собранных клипов во временных файлах; старые удаляются
+SEGMENT_MEDIA_TYPES = {"mp4": "video/mp4", "mkv": "video/x-matroska"}
+
+# Закрытие файлов (запись хвоста контейнера, индекс) выполняется вне потока записи
+# Там же ведутся каталог записей и удаление старых записей, поэтому индекс и файлы меняются по порядку
+_finalizer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="segment-finalizer")
+# Перенос пакетов камер со сквозной передачей в файлы: дёшево, один поток на все камеры сохраняет порядок
+_packet_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="segment-writer")
+
+
+def submit_segment_task(function: Callable, *args) -> Future:
+    """Выполняет function в потоке завершения сегментов: по порядку с записью индексов и каталога."""
+    return _finalizer.submit(function, *args)
+
+
+class WriteMeter:
+    """Объём записанных в сегменты пакетов и скорость записи за последние секунды."""
+    WINDOW = 60.0  # За сколько последних секунд считается скорость записи
+    total = 0  # Всего записано байт
+    _samples: Deque[tuple] = deque()  # Не чаще раза в секунду: (time.monotonic(), total)
+    _lock = threading.Lock()
+
+    @classmethod
+    def add(cls, size: int):
+        now = time.monotonic()
+        with cls._lock:
+            cls.total += size
+            if not cls._samples or now - cls._samples[-1][0] >= 1.0:
+                cls._samples.append((now, cls.total))
+                while cls._samples and cls._samples[0][0] < now - cls.WINDOW:
+                    cls._samples.popleft()
+
+    @classmethod
+    def rate(cls) -> float:
+        """Скорость записи, байт/с."""
+        now = time.monotonic()
+        with cls._lock:
+            while cls._samples and cls._samples[0][0] < now - cls.WINDOW:
+                cls._samples.popleft()
+            if not cls._samples:
+                return 0.0
+            started, total = cls._samples[0]
+            return (cls.total - total) / max(now - started, 1.0)
+
+
+def read_segment_index(directory: str) -> List[Dict[str, Any]]:
+    """Читает индекс завершённых сегментов каталога камеры."""
+    path = os.path.join(directory, SEGMENT_INDEX_FILE)
+    if not os.path.exists(path):
+        return []
+    segments = []
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                segments.append(json.loads(line))
+    return segments
+
+
+def compact_segment_index(directory: str, removed: Set[str]):
+    """Убирает из индекса каталога камеры удалённые сегменты.
+
+    Вызывается в потоке завершения сегментов, как и дописывание индекса.
+    """
+    path = os.path.join(directory, SEGMENT_INDEX_FILE)
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as file:
+        lines = [line for line in file if line.strip() and json.loads(line)["path"] not in removed]
+    temporary = path + ".tmp"
+    with open(temporary, "w", encoding="utf-8") as file:
+        file.writelines(lines)
+    os.replace(temporary, path)
+
+
+def is_idr_packet(packet: av.Packet) -> bool:
+    """Есть ли в пакете H.264, прочитанном из MP4/MKV, кадр IDR (NAL-блок типа 5).
+
+    Флаг ключевого кадра у прочитанных из файла пакетов ненадёжен (демультиплексор
+    ставит его всем пакетам), поэтому NAL-блоки формата AVCC (длина + блок) разбираются.
+    """
+    data = bytes(packet)
+    position = 0
+    while position + 4 < len(data):
+        length = int.from_bytes(data[position:position + 4], "big")
+        if data[position + 4] & 0x1F == 5:
+            return True
+        position += 4 + length
+    return False
+
+
+def find_keyframe(segment: Dict[str, Any], target: float) -> float:
+    """Смещение последнего ключевого кадра сегмента не позже target (от начала сегмента), с.
+
+    У записываемого сегмента ключевых кадров в каталоге ещё нет: файл демультиплексируется
+    до target, кадры IDR отмечаются по ходу.
+    """
+    if segment["complete"]:
+        return max([keyframe for keyframe in segment["keyframes"] if keyframe <= target], default=0.0)
+    found = 0.0
+    try:
+        with av.open(segment["path"]) as source:
+            stream = source.streams.video[0]
+            for packet in source.demux(stream):
+                if packet.pts is None:
+                    continue
+                offset = float(packet.pts * stream.time_base)
+                if offset > target:
+                    break
+                if is_idr_packet(packet):
+                    found = offset
+    except (av.AVError, OSError) as e:
+        logger.error(f"Ошибка поиска ключевого кадра в сегменте {segment['path']}: {e}")
+    return found
+
+
+def probe_segment(path: str) -> Dict[str, Any]:
+    """Длительность, число кадров и ключевые кадры файла сегмента по его пакетам (без декодирования)."""
+    keyframes = []
+    frames = 0
+    duration = 0.0
+    with av.open(path) as source:
+        stream = source.streams.video[0]
+        for packet in source.demux(stream):
+            if packet.pts is None:
+                continue
+            offset = float(packet.pts * stream.time_base)
+            if is_idr_packet(packet):
+                keyframes.append(round(offset, 3))
+            frames += 1
+            duration = max(duration, offset)
+    return {"duration": duration, "frames": frames, "keyframes": keyframes}
+
+
+class RecordingCatalog:
+    """Каталог записанных сегментов в базе данных (таблица recording_segments).
+
+    Сегмент попадает в каталог при открытии файла (complete = False) и обновляется
+    при завершении: время конца, размер, смещения ключевых кадров. Запись в базу
+    выполняется в потоке завершения сегментов, поток записи видео её не ждёт.
+    Маршруты /recordings ищут сегменты только по каталогу, не просматривая videos/.
+    Пока база данных не инициализирована (модуль записи запущен отдельно), каталог
+    не ведётся: сегменты остаются в index.jsonl и добавляются при следующем sync().
+    """
+    stats = {"saved": 0, "imported": 0, "recovered": 0, "removed": 0, "errors": 0}
+    _listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+    @staticmethod
+    def enabled() -> bool:
+        return database_service.session_factory is not None
+
+    @classmethod
+    def add_listener(cls, listener: Callable[[Dict[str, Any]], None]):
+        """Подписывает на завершённые сегменты (и при отключённой базе данных); вызывается в потоке завершения."""
+        if listener not in cls._listeners:
+            cls._listeners.append(listener)
+
+    @classmethod
+    def remove_listener(cls, listener: Callable[[Dict[str, Any]], None]):
+        if listener in cls._listeners:
+            cls._listeners.remove(listener)
+
+    @classmethod
+    def notify(cls, segment: Dict[str, Any]):
+        for listener in list(cls._listeners):
+            try:
+                listener(segment)
+            except Exception as e:
+                logger.error(f"Ошибка обработки сегмента {segment['path']}: {e}")
+
+    @staticmethod
+    def _row(segment: Dict[str, Any], complete: bool) -> RecordingSegment:
+        # У сегментов из индексов старых версий нет идентификатора: он выводится из пути
+        segment_id = segment.get("id") or uuid.uuid5(uuid.NAMESPACE_URL, segment["path"])
+        return RecordingSegment(
+            id=uuid.UUID(str(segment_id)),
+            camera_id=str(segment["camera_id"]),
+            camera_name=segment.get("camera_name"),
+            path=segment["path"],
+            container=segment.get("container") or os.path.splitext(segment["path"])[1].lstrip("."),
+            width=segment.get("width"),
+            height=segment.get("height"),
+            start=segment["start"],
+            end=segment["end"],
+            duration=segment.get("duration", 0.0),
+            frames=segment.get("frames", 0),
+            size=segment.get("size", 0),
+            keyframes=json.dumps(segment.get("keyframes", [])),
+            trigger=segment.get("trigger"),
+            complete=complete,
+        )
+
+    @classmethod
+    def save(cls, segment: Dict[str, Any], complete: bool = True):
+        """Добавляет или обновляет сегмент в каталоге; вызывается в потоке завершения сегментов."""
+        if not cls.enabled():
+            return
+        try:
+            session = database_service.create_session()
+            try:
+                session.merge(cls._row(segment, complete))
+                session.commit()
+            finally:
+                session.close()
+            cls.stats["saved"] += 1
+        except Exception as e:
+            cls.stats["errors"] += 1
+            logger.error(f"Ошибка записи сегмента {segment['path']} в каталог записей: {e}")
+
+    @classmethod
+    def sync(cls, directory: str):
+        """Приводит каталог в соответствие с индексами сегментов в directory.
+
+        Добавляет сегменты из index.jsonl камер, которых нет в каталоге (записанные без
+        базы данных), и дописывает сегменты, оставшиеся незавершёнными после аварийной
+        остановки: их длительность и ключевые кадры определяются по самому файлу.
+        Вызывается при запуске модуля записи, до открытия новых сегментов.
+        """
+        if not cls.enabled() or not os.path.isdir(directory):
+            return
+        try:
+            session = database_service.create_session()
+            try:
+                prefix = os.path.join(directory, "")
+                rows = session.query(RecordingSegment).filter(RecordingSegment.path.startswith(prefix)).all()
+                known = {row.path: row for row in rows}
+
+                for camera_dir in os.listdir(directory):
+                    for segment in read_segment_index(os.path.join(directory, camera_dir)):
+                        row = known.get(segment["path"])
+                        if row is not None and row.complete:
+                            continue
+                        if not os.path.exists(segment["path"]):
+                            continue
+                        if row is not None:
+                            session.delete(row)
+                            session.flush()
+                        known[segment["path"]] = session.merge(cls._row(segment, True))
+                        cls.stats["imported"] += 1
+
+                for path, row in known.items():
+                    if row.complete:
+                        continue
+                    if not os.path.exists(path):
+                        session.delete(row)
+                        continue
+                    try:
+                        probe = probe_segment(path)
+                    except Exception as e:
+                        logger.warning(f"Не удалось прочитать незавершённый сегмент {path}: {e}")
+                        probe = {"duration": 0.0, "frames": 0, "keyframes": []}
+                    row.duration = probe["duration"]
+                    row.end = row.start + probe["duration"]
+                    row.frames = probe["frames"]
+                    row.keyframes = json.dumps(probe["keyframes"])
+                    row.size = os.path.getsize(path)
+                    row.complete = True
+                    cls.stats["recovered"] += 1
+                session.commit()
+            finally:
+                session.close()
+        except Exception as e:
+            cls.stats["errors"] += 1
+            logger.error(f"Ошибка синхронизации каталога записей {directory}: {e}")
+
+    @classmethod
+    def remove(cls, paths: List[str]):
+        """Удаляет сегменты из каталога по путям файлов; вызывается в потоке завершения сегментов."""
+        if not cls.enabled() or not paths:
+            return
+        try:
+            session = database_service.create_session()
+            try:
+                for index in range(0, len(paths), 500):
+                    chunk = paths[index:index + 500]
+                    session.query(RecordingSegment).filter(RecordingSegment.path.in_(chunk)).delete(
+                        synchronize_session=False
+                    )
+                session.commit()
+            finally:
+                session.close()
+            cls.stats["removed"] += len(paths)
+        except Exception as e:
+            cls.stats["errors"] += 1
+            logger.error(f"Ошибка удаления сегментов из каталога записей: {e}")
+
+    @classmethod
+    def completed(cls, directory: str) -> List[Dict[str, Any]]:
+        """Завершённые сегменты в directory: камера, начало, размер и путь.
+
+        Берутся из каталога, а без базы данных — из index.jsonl камер.
+        """
+        if not cls.enabled():
+            segments = []
+            if os.path.isdir(directory):
+                for camera_dir in os.listdir(directory):
+                    segments += read_segment_index(os.path.join(directory, camera_dir))
+            return [
+                {"camera_id": str(segment["camera_id"]), "start": segment["start"],
+                 "size": segment.get("size", 0), "path": segment["path"]}
+                for segment in segments
+            ]
+        session = database_service.create_session()
+        try:
+            rows = (
+                session.query(RecordingSegment.camera_id, RecordingSegment.start, RecordingSegment.size, RecordingSegment.path)
+                .filter(RecordingSegment.path.startswith(os.path.join(directory, "")), RecordingSegment.complete.is_(True))
+                .all()
+            )
+        finally:
+            session.close()
+        return [{"camera_id": row.camera_id, "start": row.start, "size": row.size or 0, "path": row.path} for row in rows]
+
+    @classmethod
+    def sync_later(cls, directory: str) -> Future:
+        """sync() в потоке завершения сегментов: по порядку с записью новых сегментов в каталог."""
+        return _finalizer.submit(cls.sync, directory)
+
+    @staticmethod
+    def to_dict(row: RecordingSegment) -> Dict[str, Any]:
+        return {
+            "id": str(row.id),
+            "camera_id": row.camera_id,
+            "camera_name": row.camera_name,
+            "file": os.path.basename(row.path),
+            "path": row.path,
+            "container": row.container,
+            "width": row.width,
+            "height": row.height,
+            "start": row.start,
+            "end": row.end,
+            "duration": row.duration,
+            "frames": row.frames,
+            "size": row.size,
+            "keyframes": json.loads(row.keyframes or "[]"),
+            "trigger": row.trigger,
+            "complete": row.complete,
+        }
+
+    @staticmethod
+    def _overlapping(db, camera_id: str, since: Optional[float], until: Optional[float]):
+        query = db.query(RecordingSegment).filter(RecordingSegment.camera_id == camera_id)
+        if until is not None:
+            query = query.filter(RecordingSegment.start <= until)
+        if since is not None:
+            # Время конца записываемого сегмента ещё неизвестно
+            query = query.filter((RecordingSegment.end >= since) | (RecordingSegment.complete.is_(False)))
+        return query
+
+    @classmethod
+    def query(
+            cls,
+            db,
+            camera_id: str,
+            since: Optional[float] = None,
+            until: Optional[float] = None,
+            limit: int = 100
+    ) -> List[Dict[str, Any]]:
+        """Сегменты камеры, пересекающие период [since, until], по времени начала."""
+        rows = cls._overlapping(db, camera_id, since, until).order_by(RecordingSegment.start).limit(limit).all()
+        return [cls.to_dict(row) for row in rows]
+
+    @classmethod
+    def get(cls, db, segment_id: uuid.UUID) -> Optional[Dict[str, Any]]:
+        row = db.query(RecordingSegment).filter(RecordingSegment.id == segment_id).first()
+        return cls.to_dict(row) if row is not None else None
+
+    @classmethod
+    def seek(cls, db, camera_id: str, timestamp: float) -> Optional[Dict[str, Any]]:
+        """Сегмент с моментом timestamp и смещение последнего ключевого кадра не позже него.
+
+        Если в этот момент записи нет, возвращается начало следующего сегмента.
+        """
+        row = (
+            db.query(RecordingSegment)
+            .filter(RecordingSegment.camera_id == camera_id, RecordingSegment.start <= timestamp)
+            .order_by(RecordingSegment.start.desc())
+            .first()
+        )
+        if row is None or (row.complete and row.end < timestamp):
+            row = (
+                db.query(RecordingSegment)
+                .filter(RecordingSegment.camera_id == camera_id, RecordingSegment.start > timestamp)
+                .order_by(RecordingSegment.start)
+                .first()
+            )
+            if row is None:
+                return None
+        segment = cls.to_dict(row)
+        offset = find_keyframe(segment, max(0.0, timestamp - segment["start"]))
+        return {"segment": segment, "offset": offset, "timestamp": segment["start"] + offset}
+
+
+def build_clip(segments: List[Dict[str, Any]], start: float, end: float, path: str) -> Dict[str, Any]:
+    """Собирает в файл path фрагментированный MP4 из сегментов каталога за [start, end] без перекодирования.
+
+    Клип начинается с последнего ключевого кадра не позже start, поэтому воспроизводится
+    с первого кадра; время этого кадра возвращается в "start". Сегменты берутся
+    подряд, пока не изменится разрешение.
+    """
+    container_format, options = SEGMENT_CONTAINERS["mp4"]
+    output = av.open(path, "w", format=container_format, options=options)
+    output_stream = None
+    clip_start: Optional[float] = None
+    last_dts = -1
+    frames = 0
+    try:
+        for segment in segments:
+            if segment["end"] < start and segment["complete"]:
+                continue
+            if clip_start is None:
+                first_offset = find_keyframe(segment, max(0.0, start - segment["start"]))
+            else:
+                first_offset = 0.0
+            with av.open(segment["path"]) as source:
+                stream = source.streams.video[0]
+                if output_stream is None:
+                    output_stream = output.add_stream(template=stream)
+                elif (stream.codec_context.width, stream.codec_context.height) != (
+                        output_stream.codec_context.width, output_stream.codec_context.height):
+                    break
+                for packet in source.demux(stream):
+                    if packet.pts is None or packet.dts is None:
+                        continue
+                    offset = float(packet.pts * stream.time_base)
+                    keyframe = is_idr_packet(packet)
+                    if clip_start is None and (offset < first_offset or not keyframe):
+                        continue
+                    timestamp = segment["start"] + offset
+                    if timestamp > end:
+                        break
+                    if clip_start is None:
+                        clip_start = timestamp
+                    # Метки времени относительно начала клипа; dts строго возрастает, как в сегментах
+                    shift = segment["start"] - clip_start
+                    dts = max(int(round((float(packet.dts * stream.time_base) + shift) / stream.time_base)), last_dts + 1)
+                    packet.pts = max(int(round((offset + shift) / stream.time_base)), dts)
+                    packet.dts = dts
+                    last_dts = dts
+                    packet.is_keyframe = keyframe
+                    packet.stream = output_stream
+                    output.mux(packet)
+                    frames += 1
+                else:
+                    continue
+                break
+    finally:
+        output.close()
+    return {"path": path, "start": clip_start, "frames": frames}
+
+
+class ClipCache:
+    """Собранные клипы во временных файлах, чтобы отдавать их с поддержкой Range.
+
+    Плеер перематывает клип повторными запросами Range того же адреса: клип
+    собирается один раз, одновременные запросы ждут одну сборку. Ключ включает
+    размеры файлов сегментов, поэтому клип с дописанным сегментом собирается заново.
+    Хранится CLIP_CACHE_SIZE последних клипов; каталог удаляется в clear().
+    """
+    _directory: Optional[str] = None
+    _clips: Dict[str, Dict[str, Any]] = {}  # Ключ -> клип в порядке использования
+    _building: Dict[str, threading.Lock] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def _key(cls, segments: List[Dict[str, Any]], start: float, end: float) -> str:
+        parts = [f"{start:.3f}", f"{end:.3f}"]
+        for segment in segments:
+            # Размер записываемого сегмента в каталоге появляется только после его закрытия
+            size = segment["size"]
+            if not segment["complete"]:
+                try:
+                    size = os.path.getsize(segment["path"])
+                except OSError:
+                    pass
+            parts.append(f"{segment['id']}:{size}")
+        return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+    @classmethod
+    def get(cls, segments: List[Dict[str, Any]], start: float, end: float) -> Dict[str, Any]:
+        """Клип за [start, end]: {"path", "start", "frames"}; собирается при первом запросе."""
+        key = cls._key(segments, start, end)
+        with cls._lock:
+            clip = cls._clips.pop(key, None)
+            if clip is not None:
+                cls._clips[key] = clip
+                return clip
+            if cls._directory is None:
+                cls._directory = tempfile.mkdtemp(prefix="clips-")
+            building = cls._building.setdefault(key, threading.Lock())
+
+        with building:
+            with cls._lock:
+                clip = cls._clips.get(key)
+            if clip is not None:
+                return clip
+            path = os.path.join(cls._directory, f"{key}.mp4")
+            try:
+                clip = build_clip(segments, start, end, path)
+            except Exception:
+                cls._remove(path)
+                raise
+            finally:
+                with cls._lock:
+                    cls._building.pop(key, None)
+            with cls._lock:
+                cls._clips[key] = clip
+                expired = []
+                while len(cls._clips) > CLIP_CACHE_SIZE:
+                    expired.append(cls._clips.pop(next(iter(cls._clips))))
+            for old in expired:
+                cls._remove(old["path"])
+        return clip
+
+    @classmethod
+    def clear(cls):
+        """Удаляет временный каталог со всеми клипами (при остановке сервера)."""
+        with cls._lock:
+            directory, cls._directory = cls._directory, None
+            cls._clips.clear()
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class SegmentMuxer:
+    """Запись пакетов H.264 камеры в сегменты ограниченной длины без перекодирования.
+
+    Новый сегмент начинается с ключевого кадра, когда текущий достиг segment_duration
+    секунд или изменилось разрешение. Метки времени пакетов переносятся в файл как
+    есть (переменная частота кадров), отсчёт в каждом сегменте начинается с нуля.
+    Закрытие файла и запись в индекс выполняются в фоне, поэтому поток записи не
+    ждёт диска. Пакеты копируются: исходные пакеты могут быть общими с другими
+    потребителями. Не потокобезопасен: пакеты передаются из одного потока.
+    """
+
+    def __init__(
+            self,
+            camera_id: Any,
+            directory: str,
+            segment_duration: float,
+            container: str = "mp4",
+            camera_name: Optional[str] = None,
+            on_segment: Optional[Callable[[Dict[str, Any]], None]] = None
+    ):
+        if container not in SEGMENT_CONTAINERS:
+            raise ValueError(f"Неизвестный контейнер записи: {container}")
+        self.camera_id = str(camera_id)
+        self.camera_name = camera_name or self.camera_id
+        self.directory = directory
+        self.segment_duration = segment_duration
+        self.container = container
+        self.on_segment = on_segment  # Вызывается в фоновом потоке для каждого завершённого сегмента
+        self._output: Optional[av.container.OutputContainer] = None
+        self._stream = None
+        self._segment: Optional[Dict[str, Any]] = None  # Описание записываемого сегмента
+        self._base_pts = 0
+        self._last_dts = -1
+        self._last_source_dts: Optional[int] = None
+        self._time_base = 0
+        self._size = (0, 0)
+        self._pending: Set[Future] = set()
+        self._pending_lock = threading.Lock()
+        self.segments_written = 0
+        self.trigger_reason: Optional[str] = None  # Причина записи (событие), попадает в описание сегмента
+
+    @property
+    def wants_keyframe(self) -> bool:
+        """Текущий сегмент достиг нужной длины и ждёт ключевого кадра, чтобы закрыться."""
+        return self._output is not None and self._last_dts * self._time_base >= self.segment_duration
+
+    @property
+    def current(self) -> Optional[Dict[str, Any]]:
+        """Записываемый сейчас сегмент."""
+        return self._segment
+
+    def _open_segment(self, packet: av.Packet, width: int, height: int, started: float):
+        os.makedirs(self.directory, exist_ok=True)
+        extension = self.container
+        filename = f"{self.camera_id}_{datetime.fromtimestamp(started).strftime('%Y%m%d_%H%M%S_%f')[:-3]}.{extension}"
+        path = os.path.join(self.directory, filename)
+
+        container_format, options = SEGMENT_CONTAINERS[self.container]
+        output = av.open(path, "w", format=container_format, options=options)
+        stream = output.add_stream("h264")
+        stream.width = width
+        stream.height = height
+        stream.time_base = packet.time_base
+        stream.codec_context.time_base = packet.time_base
+
+        self._output = output
+        self._stream = stream
+        self._size = (width, height)
+        self._base_pts = packet.dts if packet.dts is not None else packet.pts
+        self._last_dts = -1
+        self._time_base = packet.time_base
+        self._segment = {
+            "id": str(uuid.uuid4()),
+            "camera_id": self.camera_id,
+            "camera_name": self.camera_name,
+            "file": filename,
+            "path": path,
+            "container": self.container,
+            "width": width,
+            "height": height,
+            "start": started,
+            "end": started,
+            "duration": 0.0,
+            "frames": 0,
+            "keyframes": [],  # Смещения ключевых кадров от начала сегмента, с
+            "trigger": self.trigger_reason,
+        }
+        # Сегмент виден в каталоге с начала записи; запись в базу — в потоке завершения сегментов
+        _finalizer.submit(RecordingCatalog.save, dict(self._segment, keyframes=[]), False)
+        logger.info(f"Запись камеры {self.camera_name}: новый сегмент {path}")
+
+    def _close_segment(self):
+        if self._output is None:
+            return
+        output, segment = self._output, self._segment
+        self._output = None
+        self._stream = None
+        self._segment = None
+        future = _finalizer.submit(self._finalize, output, segment)
+        with self._pending_lock:
+            self._pending.add(future)
+        future.add_done_callback(self._discard_pending)
+
+    def _discard_pending(self, future: Future):
+        with self._pending_lock:
+            self._pending.discard(future)
+
+    def _finalize(self, output, segment: Dict[str, Any]):
+        """Дописывает контейнер и добавляет сегмент в индекс; выполняется в фоновом потоке."""
+        try:
+            output.close()
+        except Exception as e:
+            logger.error(f"Ошибка закрытия сегмента {segment['path']}: {e}")
+        if not os.path.exists(segment["path"]):
+            return
+        segment["size"] = os.path.getsize(segment["path"])
+        try:
+            with open(os.path.join(self.directory, SEGMENT_INDEX_FILE), "a", encoding="utf-8") as file:
+                file.write(json.dumps(segment) + "\n")
+        except OSError as e:
+            logger.error(f"Ошибка записи индекса сегментов {self.directory}: {e}")
+        RecordingCatalog.save(segment)
+        RecordingCatalog.notify(segment)
+        self.segments_written += 1
+        logger.info(f"Сегмент записи камеры {self.camera_name} завершён: {segment['path']}, {segment['duration']:.1f} с")
+        if self.on_segment is not None:
+            try:
+                self.on_segment(segment)
+            except Exception as e:
+                logger.error(f"Ошибка обработки завершённого сегмента {segment['path']}: {e}")
+
+    def write(self, packet: av.Packet, width: int, height: int, timestamp: Optional[float] = None):
+        """Записывает пакет; до первого ключевого кадра пакеты пропускаются.
+
+        timestamp — время захвата кадра (time.time()), по нему отмечается начало сегмента;
+        если неизвестно, берётся текущее время.
+        """
+        if packet.pts is None or packet.time_base is None:
+            return
+        dts = packet.dts if packet.dts is not None else packet.pts
+
+        if self._output is not None and self._last_source_dts is not None:
+            gap = float((dts - self._last_source_dts) * packet.time_base)
+            if gap <= 0 or gap > MAX_TIMESTAMP_GAP:
+                # Камера переподключилась или метки времени сбились: продолжаем с ключевого кадра в новом сегменте
+                logger.warning(f"Разрыв меток времени камеры {self.camera_name} ({gap:.2f} с), новый сегмент")
+                self._close_segment()
+        self._last_source_dts = dts
+
+        if self._output is not None and packet.is_keyframe:
+            elapsed = float((dts - self._base_pts) * packet.time_base)
+            if elapsed >= self.segment_duration or (width, height) != self._size:
+                self._close_segment()
+        if self._output is None:
+            if not packet.is_keyframe:
+                return
+            try:
+                self._open_segment(packet, width, height, timestamp or time.time())
+            except Exception as e:
+                logger.error(f"Ошибка создания сегмента записи камеры {self.camera_name}: {e}")
+                self._output = None
+                return
+
+        # Метки времени относительно начала сегмента; dts строго возрастает, как требует муксер
+        dts = max(dts - self._base_pts, self._last_dts + 1)
+        pts = max(packet.pts - self._base_pts, dts)
+        self._last_dts = dts
+
+        copy = av.Packet(bytes(packet))
+        copy.pts = pts
+        copy.dts = dts
+        copy.is_keyframe = packet.is_keyframe
+        copy.time_base = packet.time_base
+        copy.stream = self._stream
+        try:
+            self._output.mux(copy)
+        except Exception as e:
+            logger.error(f"Ошибка записи пакета камеры {self.camera_name}: {e}")
+            self._close_segment()
+            return
+        WriteMeter.add(copy.size)
+
+        segment = self._segment
+        offset = float(pts * packet.time_base)
+        if packet.is_keyframe:
+            segment["keyframes"].append(round(offset, 3))
+        segment["frames"] += 1
+        segment["duration"] = max(segment["duration"], offset)
+        segment["end"] = segment["start"] + segment["duration"]
+
+    def close(self, wait: bool = False, timeout: Optional[float] = None):
+        """Завершает текущий сегмент; при wait дожидается записи всех сегментов на диск."""
+        self._close_segment()
+        if wait:
+            with self._pending_lock:
+                pending = list(self._pending)
+            for future in pending:
+                future.result(timeout)
+
+
+class EventMuxer(SegmentMuxer):
+    """Запись сегментов только при событиях с предзаписью.
+
+    Пока событий нет, пакеты хранятся в памяти группами от ключевого кадра (GOP) за
+    последние pre_event секунд (плюс незавершённая группа). trigger() отмечает событие
+    (движение, результат модуля); со следующим пакетом буфер записывается в новый
+    сегмент, и запись продолжается, пока события повторяются. Если событий нет
+    post_event секунд, сегмент закрывается и снова копится буфер.
+    trigger() можно вызывать из любого потока.
+    """
+
+    def __init__(self, *args, pre_event: float, post_event: float, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pre_event = pre_event
+        self.post_event = post_event
+        self._groups: Deque[List[tuple]] = deque()  # Группы пакетов от ключевого кадра: (пакет, ширина, высота, время)
+        self._last_trigger = float("-inf")
+        self._last_reason: Optional[str] = None
+        self.recording = False
+        self.events = 0  # Число записанных событий
+
+    def trigger(self, reason: str, timestamp: Optional[float] = None):
+        """Отмечает событие в момент timestamp (time.time())."""
+        timestamp = timestamp or time.time()
+        if timestamp > self._last_trigger:
+            self._last_trigger = timestamp
+            self._last_reason = reason
+
+    @property
+    def wants_keyframe(self) -> bool:
+        if self.recording:
+            return super().wants_keyframe
+        return not self._groups  # Буфер предзаписи пуст и ждёт ключевого кадра
+
+    def expire(self, timestamp: Optional[float] = None):
+        """Закрывает запись события, если событий не было post_event секунд; вызывается в потоке записи."""
+        timestamp = timestamp or time.time()
+        if self.recording and timestamp - self._last_trigger > self.post_event:
+            self.recording = False
+            self._close_segment()
+            logger.info(f"Запись события камеры {self.camera_name} завершена")
+
+    def _buffer(self, packet: av.Packet, width: int, height: int, timestamp: float):
+        entry = (packet, width, height, timestamp)
+        if packet.is_keyframe:
+            self._groups.append([entry])
+            # Старые группы не нужны, если следующая за ними начинается раньше границы предзаписи
+            while len(self._groups) > 1 and self._groups[1][0][3] <= timestamp - self.pre_event:
+                self._groups.popleft()
+        elif not self._groups:
+            return
+        elif self._groups[-1][0][3] < timestamp - MAX_PRE_EVENT_GROUP:
+            # Ключевых кадров слишком долго нет: не копим память, ждём следующий
+            self._groups.clear()
+        else:
+            self._groups[-1].append(entry)
+
+    def write(self, packet: av.Packet, width: int, height: int, timestamp: Optional[float] = None):
+        timestamp = timestamp or time.time()
+        # Событие закончилось: закрываем сегмент, дальше снова только буфер
+        self.expire(timestamp)
+
+        if self.recording:
+            super().write(packet, width, height, timestamp)
+            return
+
+        self._buffer(packet, width, height, timestamp)
+        if timestamp - self._last_trigger <= self.post_event:
+            self.recording = True
+            self.events += 1
+            self.trigger_reason = self._last_reason
+            logger.info(f"Запись события камеры {self.camera_name}: {self.trigger_reason}")
+            groups, self._groups = self._groups, deque()
+            for group in groups:
+                for buffered in group:
+                    super().write(*buffered)
+
+    def close(self, wait: bool = False, timeout: Optional[float] = None):
+        self.recording = False
+        self._groups.clear()
+        super().close(wait, timeout)
+
+
+class PacketRecorder:
+    """Запись сжатых пакетов камеры в сегменты без декодирования и перекодирования.
+
+    Подписывается на пакеты камеры в цикле событий и передаёт их в SegmentMuxer в
+    потоке записи. Сегменты начинаются с ключевых кадров. По умолчанию пишутся только
+    пакеты сквозной передачи, и запись прекращается, когда камера остановлена или
+    перешла на общий кодировщик (поток не H.264). С any_source=True пишутся и пакеты
+    общего кодировщика камеры: он кодирует каждый кадр, а не только изменившиеся.
+    """
+    QUEUE_SIZE = 1000  # Пакетов в очереди записи; при переполнении запись продолжается со следующего ключевого кадра
+
+    def __init__(self, stream: Dict[str, Any], muxer: SegmentMuxer, any_source: bool = False):
+        self.stream = stream
+        self.muxer = muxer
+        self.any_source = any_source
+        self.finished = threading.Event()
+        self._closed = False  # Закрыт ли muxer; меняется только в потоке записи
+        self._cancelled = False
+        self._loop = stream["packets"].loop
+        self._task: Optional[asyncio.Task] = None
+        self._loop.call_soon_threadsafe(self._start)
+
+    def _start(self):
+        if not self._cancelled:
+            self._task = self._loop.create_task(self._run())
+
+    def _is_source(self) -> bool:
+        return self.stream["running"] and (self.any_source or self.stream["encoder"] is None)
+
+    def _video_size(self) -> Tuple[int, int]:
+        encoder = self.stream["encoder"]
+        codec = encoder.encoder.codec if encoder is not None else None
+        if codec is not None:
+            return codec.width, codec.height
+        return self.stream.get("video_size") or (0, 0)
+
+    async def _run(self):
+        try:
+            while self._is_source():
+                subscription = self.stream["packets"].subscribe(self.QUEUE_SIZE)
+                try:
+                    closed = False
+                    while not closed:
+                        packet = await subscription.get()
+                        if packet is None:
+                            break
+                        # Всё, что накопилось в очереди, записывается одним заданием
+                        batch = [packet]
+                        while not subscription.queue.empty():
+                            packet = subscription.queue.get_nowait()
+                            if packet is None:
+                                closed = True
+                                break
+                            batch.append(packet)
+                        await asyncio.wrap_future(_packet_writer.submit(self._write, batch))
+                finally:
+                    subscription.close()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            _packet_writer.submit(self._finish)
+
+    def _write(self, packets: List[Any]):
+        if self._closed:
+            return
+        width, height = self._video_size()
+        for packet in packets:
+            self.muxer.write(packet, width, height)
+
+    def _finish(self):
+        if not self._closed:
+            self._closed = True
+            self.muxer.close(wait=True)
+        self.finished.set()
+
+    def close(self, wait: bool = True, timeout: Optional[float] = None):
+        """Останавливает запись и закрывает сегмент; не требует работы цикла событий."""
+        try:
+            self._loop.call_soon_threadsafe(self._cancel)
+        except RuntimeError:
+            pass  # Цикл событий уже закрыт
+        future = _packet_writer.submit(self._finish)
+        if wait:
+            future.result(timeout)
+
+    def _cancel(self):
+        self._cancelled = True  # Если задача ещё не создана, она и не будет создана
+        if self._task is not None:
+            self._task.cancel()
@@ -0,0 +1,298 @@
+﻿import asyncio
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Set
+
+from sqlalchemy import insert
+
+from app.config import Config
+from app.logger import LoggerSingleton
+from app.models.table_models import ModuleResult
+from app.services.database_service import create_session
+
+logger = LoggerSingleton.get_logger()
+
+PUSH_QUEUE_SIZE = 256  # Результатов в очереди одного WebSocket-клиента
+MAX_PENDING_BATCHES = 10  # Сколько пакетов может ждать записи, прежде чем старые результаты отбрасываются
+
+
+class ResultSubscription:
+    """Очередь результатов одного WebSocket-клиента с фильтром по камере и модулю.
+
+    Если клиент не успевает забирать результаты, вытесняются самые старые.
+    """
+
+    def __init__(self, camera_id: Optional[str] = None, module: Optional[str] = None):
+        self.camera_id = camera_id
+        self.module = module
+        self.queue: asyncio.Queue = asyncio.Queue(PUSH_QUEUE_SIZE)
+        self.dropped = 0
+
+    def matches(self, entry: Dict[str, Any]) -> bool:
+        return (
+            (self.camera_id is None or entry["camera_id"] == self.camera_id)
+            and (self.module is None or entry["module"] == self.module)
+        )
+
+    def _offer(self, message: str):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+    async def get(self) -> str:
+        return await self.queue.get()
+
+
+class ResultStore:
+    """Результаты модулей: кольцевой буфер последних результатов каждой камеры,
+    пакетная запись в базу данных и рассылка подписчикам по WebSocket.
+
+    add() вызывается из потоков модулей и из цикла событий и только кладёт результат
+    в буфер и очередь записи. Запись в базу выполняется фоновой задачей одним
+    INSERT на пакет из RESULT_BATCH_SIZE результатов (или всех накопленных за
+    RESULT_FLUSH_INTERVAL секунд) и одной фиксацией транзакции.
+    """
+    _loop: Optional[asyncio.AbstractEventLoop] = None
+    _lock = threading.Lock()
+    recent: Dict[str, Deque[Dict[str, Any]]] = {}  # Последние результаты каждой камеры
+    _batch: List[Dict[str, Any]] = []  # Результаты, ожидающие записи в базу
+    _subscribers: Set[ResultSubscription] = set()
+    _listeners: List[Callable[[Dict[str, Any]], None]] = []  # Вызываются для каждого результата в потоке add()
+    _flush_event: Optional[asyncio.Event] = None
+    _writer_task: Optional[asyncio.Task] = None
+    _executor: Optional[ThreadPoolExecutor] = None  # Один поток записи в базу
+    stats = {"received": 0, "written": 0, "batches": 0, "dropped": 0, "write_errors": 0}
+
+    @classmethod
+    def start(cls, loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        """Запускает фоновую запись результатов; вызывается из цикла событий."""
+        cls._loop = loop or asyncio.get_running_loop()
+        if cls._writer_task is None or cls._writer_task.done():
+            cls._flush_event = asyncio.Event()
+            cls._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="result-writer")
+            cls._writer_task = cls._loop.create_task(cls._writer())
+
+    @classmethod
+    async def stop(cls) -> None:
+        """Останавливает запись, сохранив накопленные результаты."""
+        if cls._writer_task is not None:
+            cls._writer_task.cancel()
+            try:
+                await cls._writer_task
+            except asyncio.CancelledError:
+                pass
+            cls._writer_task = None
+        await cls._flush()
+        if cls._executor is not None:
+            cls._executor.shutdown(wait=True)
+            cls._executor = None
+
+    @classmethod
+    def add(
+            cls,
+            module: str,
+            camera_id: Any,
+            result: Any,
+            seq: Optional[int] = None,
+            frame_timestamp: Optional[float] = None,
+            camera_name: Optional[str] = None
+    ) -> None:
+        """Сохраняет результат модуля по кадру камеры; вызывается из любого потока."""
+        now = time.time()
+        entry = {
+            "module": module,
+            "camera_id": str(camera_id) if camera_id is not None else None,
+            "camera_name": camera_name,
+            "seq": seq,
+            "frame_timestamp": frame_timestamp if frame_timestamp is not None else now,
+            "created_at": now,
+            "data": result,
+        }
+        settings = Config.settings()
+        with cls._lock:
+            cls.stats["received"] += 1
+            ring = cls.recent.get(entry["camera_id"])
+            if ring is None:
+                ring = cls.recent[entry["camera_id"]] = deque(maxlen=settings.RESULT_BUFFER_SIZE)
+            ring.append(entry)
+
+            if cls._writer_task is not None:
+                if len(cls._batch) >= settings.RESULT_BATCH_SIZE * MAX_PENDING_BATCHES:
+                    # База не успевает: отбрасываем самые старые результаты, а не копим память
+                    del cls._batch[:settings.RESULT_BATCH_SIZE]
+                    cls.stats["dropped"] += settings.RESULT_BATCH_SIZE
+                cls._batch.append(entry)
+                flush = len(cls._batch) == settings.RESULT_BATCH_SIZE
+            else:
+                flush = False
+
+        for listener in list(cls._listeners):
+            try:
+                listener(entry)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика результатов модулей: {e}")
+
+        if cls._loop is None:
+            return
+        if flush:
+            cls._loop.call_soon_threadsafe(cls._flush_event.set)
+        if cls._subscribers:
+            cls._loop.call_soon_threadsafe(cls._push, entry)
+
+    @classmethod
+    def _push(cls, entry: Dict[str, Any]):
+        message = None
+        for subscription in list(cls._subscribers):
+            if subscription.matches(entry):
+                if message is None:
+                    message = json.dumps(entry, default=str)
+                subscription._offer(message)
+
+    @classmethod
+    def subscribe(cls, camera_id: Optional[str] = None, module: Optional[str] = None) -> ResultSubscription:
+        """Подписка на новые результаты; вызывается из цикла событий."""
+        subscription = ResultSubscription(camera_id, module)
+        cls._subscribers.add(subscription)
+        return subscription
+
+    @classmethod
+    def unsubscribe(cls, subscription: ResultSubscription) -> None:
+        cls._subscribers.discard(subscription)
+
+    @classmethod
+    def add_listener(cls, listener: Callable[[Dict[str, Any]], None]) -> None:
+        """Добавляет обработчик новых результатов; он вызывается в потоке модуля и должен быть быстрым."""
+        if listener not in cls._listeners:
+            cls._listeners.append(listener)
+
+    @classmethod
+    def remove_listener(cls, listener: Callable[[Dict[str, Any]], None]) -> None:
+        if listener in cls._listeners:
+            cls._listeners.remove(listener)
+
+    @classmethod
+    def get_recent(
+            cls,
+            camera_id: str,
+            module: Optional[str] = None,
+            since: Optional[float] = None,
+            limit: int = 100
+    ) -> List[Dict[str, Any]]:
+        """Последние результаты камеры из памяти, новые в конце."""
+        with cls._lock:
+            entries = list(cls.recent.get(camera_id, ()))
+        if module is not None:
+            entries = [entry for entry in entries if entry["module"] == module]
+        if since is not None:
+            entries = [entry for entry in entries if entry["frame_timestamp"] > since]
+        return entries[-limit:] if limit > 0 else entries
+
+    @classmethod
+    def forget_camera(cls, camera_id: Any) -> None:
+        with cls._lock:
+            cls.recent.pop(str(camera_id), None)
+
+    @classmethod
+    async def _writer(cls):
+        interval = Config.settings().RESULT_FLUSH_INTERVAL
+        while True:
+            try:
+                await asyncio.wait_for(cls._flush_event.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            cls._flush_event.clear()
+            await cls._flush()
+
+    @classmethod
+    async def _flush(cls):
+        batch_size = Config.settings().RESULT_BATCH_SIZE
+        while True:
+            with cls._lock:
+                batch = cls._batch[:batch_size]
+                del cls._batch[:batch_size]
+            if not batch:
+                return
+            if cls._executor is None:
+                cls._write(batch)
+            else:
+                await asyncio.get_running_loop().run_in_executor(cls._executor, cls._write, batch)
+
+    @classmethod
+    def _write(cls, batch: List[Dict[str, Any]]):
+        """Записывает пакет результатов одним INSERT и одной транзакцией."""
+        rows = [
+            {
+                "id": uuid.uuid4(),
+                "camera_id": entry["camera_id"],
+                "module": entry["module"],
+                "seq": entry["seq"],
+                "frame_timestamp": entry["frame_timestamp"],
+                "created_at": entry["created_at"],
+                "data": json.dumps(entry["data"], default=str),
+            }
+            for entry in batch
+        ]
+        try:
+            session = create_session()
+            try:
+                session.execute(insert(ModuleResult), rows)
+                session.commit()
+            finally:
+                session.close()
+        except Exception as e:
+            with cls._lock:
+                cls.stats["write_errors"] += 1
+                cls.stats["dropped"] += len(rows)
+            logger.error(f"Ошибка записи результатов модулей в базу данных: {e}")
+            return
+        with cls._lock:
+            cls.stats["written"] += len(rows)
+            cls.stats["batches"] += 1
+
+    @classmethod
+    def query(
+            cls,
+            db,
+            camera_id: str,
+            module: Optional[str] = None,
+            since: Optional[float] = None,
+            until: Optional[float] = None,
+            limit: int = 100
+    ) -> List[Dict[str, Any]]:
+        """Результаты камеры из базы данных за период, новые в конце."""
+        query = db.query(ModuleResult).filter(ModuleResult.camera_id == camera_id)
+        if module is not None:
+            query = query.filter(ModuleResult.module == module)
+        if since is not None:
+            query = query.filter(ModuleResult.frame_timestamp > since)
+        if until is not None:
+            query = query.filter(ModuleResult.frame_timestamp <= until)
+        rows = query.order_by(ModuleResult.frame_timestamp.desc()).limit(limit).all()
+        return [
+            {
+                "module": row.module,
+                "camera_id": row.camera_id,
+                "seq": row.seq,
+                "frame_timestamp": row.frame_timestamp,
+                "created_at": row.created_at,
+                "data": json.loads(row.data),
+            }
+            for row in reversed(rows)
+        ]
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        with cls._lock:
+            pending = len(cls._batch)
+        return dict(
+            cls.stats,
+            pending=pending,
+            cameras=len(cls.recent),
+            subscribers=len(cls._subscribers),
+            push_dropped=sum(subscription.dropped for subscription in cls._subscribers),
+        )
@@ -0,0 +1,226 @@
+﻿import bisect
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from app.config import Config
+from app.logger import LoggerSingleton
+from app.services.recording_service import RecordingCatalog, WriteMeter, compact_segment_index, submit_segment_task
+
+logger = LoggerSingleton.get_logger()
+
+
+class RetentionManager:
+    """Хранение записей в пределах квот: объём всех записей и каждой камеры, возраст,
+    свободное место на диске.
+
+    Размеры и время начала завершённых сегментов хранятся в памяти по камерам в
+    порядке времени: список загружается один раз при запуске (из каталога записей или
+    index.jsonl) и дополняется завершёнными сегментами, поэтому проверка квот не
+    обходит каталог на диске. При превышении квоты удаляются самые старые сегменты:
+    сначала по возрасту, затем по квоте камеры, затем по общему объёму и свободному
+    месту. Ради свободного места записи удаляются, только если их удаление может его
+    обеспечить; если диск заняли чужие файлы, записывается предупреждение. Проверка и
+    удаление выполняются в потоке завершения сегментов — после каждого сегмента и раз
+    в RETENTION_INTERVAL секунд.
+    """
+    _directory: Optional[str] = None
+    _segments: Dict[str, Deque[Tuple[float, int, str]]] = {}  # Камера -> (начало, размер, путь) по времени начала
+    _camera_bytes: Dict[str, int] = {}
+    _total_bytes = 0
+    _lock = threading.Lock()
+    _timer: Optional[threading.Thread] = None
+    _stop = threading.Event()
+    stats = {"deleted_files": 0, "deleted_bytes": 0, "errors": 0, "last_pass": None, "min_free_unreachable": False}
+
+    @classmethod
+    def start(cls, directory: str):
+        """Начинает следить за записями в directory."""
+        if cls._timer is not None:
+            return
+        cls._directory = directory
+        cls._stop.clear()
+        RecordingCatalog.add_listener(cls._on_segment)
+        submit_segment_task(cls._load)
+        cls._timer = threading.Thread(target=cls._run, name="retention", daemon=True)
+        cls._timer.start()
+        logger.info(f"Запущено хранение записей {directory} по квотам")
+
+    @classmethod
+    def stop(cls):
+        RecordingCatalog.remove_listener(cls._on_segment)
+        cls._stop.set()
+        if cls._timer is not None:
+            cls._timer.join()
+            cls._timer = None
+
+    @classmethod
+    def _run(cls):
+        while not cls._stop.wait(Config.settings().RETENTION_INTERVAL):
+            submit_segment_task(cls.enforce)
+
+    @classmethod
+    def _load(cls):
+        """Загружает список сегментов; выполняется в потоке завершения сегментов."""
+        try:
+            segments = RecordingCatalog.completed(cls._directory)
+        except Exception as e:
+            cls.stats["errors"] += 1
+            logger.error(f"Ошибка загрузки списка записей {cls._directory}: {e}")
+            return
+        with cls._lock:
+            cls._segments = {}
+            cls._camera_bytes = {}
+            cls._total_bytes = 0
+            for segment in sorted(segments, key=lambda item: item["start"]):
+                cls._add(segment)
+        logger.info(f"Записей в {cls._directory}: {len(segments)}, {cls._total_bytes / (1024 ** 3):.2f} ГБ")
+        cls.enforce()
+
+    @classmethod
+    def _add(cls, segment: Dict[str, Any]):
+        camera_id = str(segment["camera_id"])
+        entries = cls._segments.setdefault(camera_id, deque())
+        entry = (segment["start"], segment.get("size", 0), segment["path"])
+        if entries and entries[-1][0] > entry[0]:
+            entries.insert(bisect.bisect(entries, entry), entry)
+        else:
+            entries.append(entry)
+        cls._camera_bytes[camera_id] = cls._camera_bytes.get(camera_id, 0) + entry[1]
+        cls._total_bytes += entry[1]
+
+    @classmethod
+    def _on_segment(cls, segment: Dict[str, Any]):
+        """Завершённый сегмент; вызывается в потоке завершения сегментов."""
+        if cls._directory is None or not segment["path"].startswith(os.path.join(cls._directory, "")):
+            return
+        with cls._lock:
+            cls._add(segment)
+        cls.enforce()
+
+    @classmethod
+    def _pop_oldest(cls, camera_id: str) -> Tuple[float, int, str]:
+        with cls._lock:
+            entry = cls._segments[camera_id].popleft()
+            cls._camera_bytes[camera_id] -= entry[1]
+            cls._total_bytes -= entry[1]
+        return entry
+
+    @classmethod
+    def _oldest_camera(cls) -> Optional[str]:
+        heads = [(entries[0][0], camera_id) for camera_id, entries in cls._segments.items() if entries]
+        return min(heads)[1] if heads else None
+
+    @classmethod
+    def _free_bytes(cls) -> Optional[int]:
+        try:
+            return shutil.disk_usage(cls._directory).free
+        except OSError:
+            return None
+
+    @classmethod
+    def enforce(cls):
+        """Удаляет самые старые сегменты сверх квот; выполняется в потоке завершения сегментов."""
+        if cls._directory is None:
+            return
+        settings = Config.settings()
+        deleted: List[Tuple[str, str, int]] = []  # (камера, путь, размер)
+
+        def delete(camera_id: str):
+            _, size, path = cls._pop_oldest(camera_id)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                cls.stats["errors"] += 1
+                logger.error(f"Не удалось удалить запись {path}: {e}")
+            deleted.append((camera_id, path, size))
+
+        if settings.RETENTION_MAX_AGE:
+            deadline = time.time() - settings.RETENTION_MAX_AGE
+            for camera_id, entries in list(cls._segments.items()):
+                while entries and entries[0][0] < deadline:
+                    delete(camera_id)
+
+        for camera_id, entries in list(cls._segments.items()):
+            limit = settings.RETENTION_CAMERA_LIMITS.get(camera_id, settings.RETENTION_CAMERA_MAX_BYTES)
+            while limit and entries and cls._camera_bytes[camera_id] > limit:
+                delete(camera_id)
+
+        while settings.RETENTION_MAX_BYTES and cls._total_bytes > settings.RETENTION_MAX_BYTES:
+            camera_id = cls._oldest_camera()
+            if camera_id is None:
+                break
+            delete(camera_id)
+
+        if settings.RETENTION_MIN_FREE_BYTES:
+            free = cls._free_bytes()
+            unreachable = free is not None and free + cls._total_bytes < settings.RETENTION_MIN_FREE_BYTES
+            if unreachable:
+                # Место заняли чужие файлы: удаление всех записей не освободит столько, записи не трогаем
+                if not cls.stats["min_free_unreachable"]:
+                    logger.warning(
+                        f"Свободного места на диске записей {free / (1024 ** 3):.2f} ГБ, записей "
+                        f"{cls._total_bytes / (1024 ** 3):.2f} ГБ: RETENTION_MIN_FREE_BYTES недостижим"
+                    )
+            else:
+                # Свободное место меняется и из-за чужих файлов, поэтому проверяется заново после каждого удаления
+                while free is not None and free < settings.RETENTION_MIN_FREE_BYTES:
+                    camera_id = cls._oldest_camera()
+                    if camera_id is None:
+                        break
+                    delete(camera_id)
+                    free = cls._free_bytes()
+            cls.stats["min_free_unreachable"] = unreachable
+
+        cls.stats["last_pass"] = time.time()
+        if deleted:
+            cls._forget(deleted)
+
+    @classmethod
+    def _forget(cls, deleted: List[Tuple[str, str, int]]):
+        """Убирает удалённые сегменты из каталога записей и индексов камер."""
+        cls.stats["deleted_files"] += len(deleted)
+        cls.stats["deleted_bytes"] += sum(size for _, _, size in deleted)
+        RecordingCatalog.remove([path for _, path, _ in deleted])
+        by_directory: Dict[str, Set[str]] = {}
+        for _, path, _ in deleted:
+            by_directory.setdefault(os.path.dirname(path), set()).add(path)
+        for directory, paths in by_directory.items():
+            try:
+                compact_segment_index(directory, paths)
+            except (OSError, ValueError) as e:
+                cls.stats["errors"] += 1
+                logger.error(f"Ошибка обновления индекса сегментов {directory}: {e}")
+        logger.info(
+            f"Удалено старых записей: {len(deleted)}, {sum(size for _, _, size in deleted) / (1024 ** 2):.1f} МБ"
+        )
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        with cls._lock:
+            cameras = {
+                camera_id: {"segments": len(cls._segments.get(camera_id, ())), "bytes": size}
+                for camera_id, size in cls._camera_bytes.items()
+            }
+            total = cls._total_bytes
+        disk = None
+        if cls._directory is not None:
+            try:
+                usage = shutil.disk_usage(cls._directory)
+                disk = {"total_bytes": usage.total, "used_bytes": usage.used, "free_bytes": usage.free}
+            except OSError:
+                pass
+        return dict(
+            cls.stats,
+            directory=cls._directory,
+            disk=disk,
+            recorded_bytes=total,
+            written_bytes=WriteMeter.total,
+            write_bytes_per_sec=round(WriteMeter.rate(), 1),
+            cameras=cameras,
+        )
@@ -1,7 +1,7 @@
 ﻿import jwt
-from fastapi import Depends, HTTPException
+from fastapi import Depends, HTTPException, Query
 from datetime import datetime, timedelta
-from typing import Union
+from typing import Optional, Union
 
 from fastapi.security import OAuth2PasswordBearer
 from passlib.context import CryptContext
@@ -16,6 +16,7 @@ logger = LoggerSingleton.get_logger()
 password_context = CryptContext(schemes=["bcrypt"],
                                 deprecated="auto")  # Контекст для хэширования паролей с использованием bcrypt
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")  # Указывает URL для получения токена
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login", auto_error=False)  # Токен из заголовка, если он есть
 
 
 # Проверка пароля
@@ -64,3 +65,30 @@ def get_current_user(token: str = Depends(oauth2_scheme)) -> dict:
     except jwt.PyJWTError as e:
         logger.error(f"Ошибка декодирования токена: {e}")
         raise HTTPException(status_code=401, detail="Неверный токен")  # Ошибка декодирования токена
+
+
+# Проверка токена из первого сообщения WebSocket-соединения
+def get_user_from_token(token: str) -> dict:
+
+    if not token:
+        raise ValueError("Отсуствует токен авторизации")
+    try:
+        payload = jwt.decode(token, Config.settings().SECRET_KEY, algorithms=[Config.settings().ALGORITHM])
+    except jwt.PyJWTError as e:
+        raise ValueError(f"Токен недействителен: {str(e)}")
+    if payload.get("sub") is None or payload.get("role") is None:
+        raise ValueError("Токен недействителен")
+    return {"username": payload["sub"], "role": payload["role"]}
+
+
+# Пользователь для медиа-ресурсов (снимки, MJPEG): теги <img> и <video> не передают заголовок Authorization
+def get_media_user(
+        token: Optional[str] = Depends(optional_oauth2_scheme),
+        access_token: Optional[str] = Query(None)
+) -> dict:
+
+    try:
+        return get_user_from_token(token or access_token)
+    except ValueError as e:
+        logger.error(f"Ошибка проверки токена: {e}")
+        raise HTTPException(status_code=401, detail="Неверный токен")
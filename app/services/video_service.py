@@ -1,150 +1,138 @@
 ﻿import asyncio
-from datetime import datetime
+import threading
+import time
 
-import cv2
-import hashlib
-import base64
-from typing import Dict, Any
+from typing import Dict, Any, Callable, Optional
 
 from app import logger
 from app.config import Config
 from app.logger import LoggerSingleton
 from app.models.table_models import Camera
+from app.services.capture_service import CaptureProcessPool, capture_frames, capture_packets
+from app.services.dispatch_service import FrameDispatcher
+from app.services.encoder_service import SharedEncoder, PacketBroadcaster
+from app.services.frame_service import FrameBroadcaster, CameraFrame
 from app.services.module_service import ModuleManager
+from app.services.profile_service import get_profile_stream, close_profiles
 
 logger = LoggerSingleton.get_logger()
-# Лимит на количество одновременных задач
-semaphore = asyncio.Semaphore(20)
+
+LATEST_FRAME_MAX_AGE = 2.0  # Кадр старше этого для снимка не годится: ждём следующий, с
+FRAME_WAIT_TIMEOUT = 5.0  # Сколько ждать кадр камеры для снимка, с
 
 # Структуры для управления потоками камер и их кадрами
-camera_tasks: Dict[int, asyncio.Task] = {}
+camera_tasks: Dict[int, Any] = {}  # Поток захвата камеры или пул процессов захвата
 camera_streams: Dict[int, Dict[str, Any]] = {}
+dispatcher: Optional[FrameDispatcher] = None  # Передача изменившихся кадров в модули
 
 
-def validate_camera_url(camera_url: str) -> Any:
-    """Проверяет URL камеры и преобразует строку в число, если это возможно."""
-    try:
-        return int(camera_url)
-    except ValueError:
-        return camera_url
+async def process_frame(stream: Dict[str, Any], frame: CameraFrame):
+    """Обрабатывает кадр, отправляя его в асинхронный модуль."""
+    await ModuleManager.process_data({
+        "frame": frame,
+        "camera_id": stream["id"],
+        "camera_name": stream["name"]
+    })
 
 
-def hash_frame(frame_bytes: bytes) -> str:
-    """Создаёт хэш для проверки изменений кадра."""
-    return hashlib.md5(frame_bytes).hexdigest()
+def get_dispatcher(loop: asyncio.AbstractEventLoop) -> FrameDispatcher:
+    """Возвращает общий диспетчер кадров, создавая его при первом запуске камеры."""
+    global dispatcher
+    if dispatcher is None:
+        dispatcher = FrameDispatcher(
+            loop,
+            process_frame,
+            Config.settings().DISPATCH_CAMERA_LIMIT,
+            Config.settings().DISPATCH_GLOBAL_LIMIT
+        )
+    return dispatcher
 
 
-async def process_frame(camera_id: int, frame_bytes: bytes, camera_name: str):
-    """Обрабатывает кадр, отправляя его в асинхронный модуль."""
-    frame_base64 = base64.b64encode(frame_bytes).decode('utf-8')
-    await ModuleManager.process_data({
-        "frame_bytes": frame_base64,
-        "camera_name": camera_name
-    })
+def _frame_publisher(stream: Dict[str, Any], loop: asyncio.AbstractEventLoop) -> Callable:
+    """Создаёт функцию публикации кадров камеры: кадр зрителям, изменившиеся кадры — в модули."""
+    broadcaster: FrameBroadcaster = stream["broadcaster"]
+    frame_dispatcher = get_dispatcher(loop)
 
+    def publish(image, changed: bool, frame_bytes: Optional[bytes] = None):
+        frame = broadcaster.publish(image, changed, frame_bytes)
+        if changed and ModuleManager.has_active_modules():
+            # Отправка в модули (выполняется в цикле событий с ограничением числа кадров в обработке)
+            frame_dispatcher.submit(stream, frame)
 
-async def video_capture(camera: Camera):
-    """Метод запускает захват кадров с камеры."""
-    logger.info(f"Запуск захвата камеры {camera.name}")
-    camera_url = validate_camera_url(camera.url)
-    cap = cv2.VideoCapture(camera_url)
+    return publish
 
-    if not cap.isOpened():
-        logger.warning(f"Не удалось открыть камеру {camera.name}: {camera_url}")
-        return
 
+def video_capture(stream: Dict[str, Any], loop: asyncio.AbstractEventLoop):
+    """Метод захвата кадров с камеры. Выполняется в отдельном потоке, не блокируя цикл событий.
 
-    camera_streams[camera.id] = {
-        "running": True,
-        "frame": None,  #  numpy array
-        "processed_frame": None  # JPEG, для модулей
-    }
+    Поток работает только со снимком параметров камеры из stream: ORM-объекты
+    привязаны к общей сессии БД и не должны использоваться вне цикла событий.
+    """
+    try:
+        capture_frames(stream, _frame_publisher(stream, loop))
+    finally:
+        loop.call_soon_threadsafe(_release_stream, stream["id"], stream)
+
+
+def passthrough_capture(stream: Dict[str, Any], loop: asyncio.AbstractEventLoop):
+    """Захват камеры со сквозной передачей H.264. Выполняется в отдельном потоке.
+
+    Пакеты камеры уходят WebRTC-зрителям и записи без перекодирования, кадры
+    декодируются только пока они нужны модулям или другим потребителям кадров.
+    Если камера передаёт не H.264, используется обычный захват с общим кодировщиком.
+    """
+    publish = _frame_publisher(stream, loop)
+    broadcaster: FrameBroadcaster = stream["broadcaster"]
 
-    previous_frame_hash = None
+    def publish_packets(packets):
+        stream["packets"].publish_threadsafe(packets)
+
+    def need_pixels() -> bool:
+        return ModuleManager.has_active_modules(decoded_only=True) or broadcaster.has_demand()
 
     try:
-        while camera_streams[camera.id]["running"]:
-            ret, frame = cap.read()
-            if not ret:
-                logger.error(f"Ошибка чтения кадра с камеры {camera.name}")
-                break
-
-            try:
-                # Наложение текста на кадр
-                current_time = datetime.now().strftime("%d.%m.%Y %H:%M:%S")
-                text = f"{current_time} | Cam: {camera.name}"
-                font = cv2.FONT_HERSHEY_SIMPLEX
-                font_scale = 1.0
-                thickness = 2
-                text_color = (255, 255, 255)  # Белый цвет текста
-                bg_color = (0, 0, 0)  # Чёрный фон
-                margin = 10
-
-                # Вычисляем размеры текста
-                frame_height, frame_width, _ = frame.shape
-                (text_width, text_height), baseline = cv2.getTextSize(text, font, font_scale, thickness)
-
-                # Позиция текста: правый нижний угол
-                x = frame_width - text_width - margin
-                y = frame_height - margin
-
-                # Рисуем фон под текстом
-                cv2.rectangle(
-                    frame,
-                    (x - 5, y - text_height - 5),  # Верхний левый угол фона
-                    (x + text_width + 5, y + baseline + 5),  # Нижний правый угол фона
-                    bg_color,
-                    thickness=cv2.FILLED  # Заливка
-                )
-
-                # Накладываем текст
-                cv2.putText(
-                    frame,
-                    text,
-                    (x, y),
-                    font,
-                    font_scale,
-                    text_color,
-                    thickness,
-                    cv2.LINE_AA
-                )
-
-                # Сохраняем сырой кадр для WebRTC
-                resized_frame = cv2.resize(frame, Config.settings().CAMERA_RESOLUTION)
-                camera_streams[camera.id]["frame"] = resized_frame
-
-                # Отдельно готовим JPEG для модулей со сжатием
-                _, encoded_frame = cv2.imencode(
-                    '.jpg', resized_frame,
-                    [int(cv2.IMWRITE_JPEG_QUALITY), Config.settings().JPEG_QUALITY]
-                )
-                frame_bytes = encoded_frame.tobytes()
-
-                # Проверка изменений кадра
-                frame_hash = hash_frame(frame_bytes)
-                if previous_frame_hash == frame_hash:
-                    await asyncio.sleep(0.001)
-                    continue
-
-                previous_frame_hash = frame_hash
-                camera_streams[camera.id]["processed_frame"] = frame_bytes
-
-                # Отправка в модули
-                asyncio.create_task(process_frame(camera.id, frame_bytes, camera.name))
-
-            except Exception as e:
-                logger.error(f"Ошибка обработки кадра: {e}")
-
-            await asyncio.sleep(0.001)
-
-    except KeyError as e:
-        logger.info(f"Камера была {camera.name} удалена из списка потоков")
+        result = capture_packets(stream, publish, publish_packets, need_pixels)
+        if result is None and stream["running"]:
+            loop.call_soon_threadsafe(_enable_encoder, stream, loop)
+            capture_frames(stream, publish)
     finally:
-        cap.release()
-        logger.info(f"Захват камеры {camera.name} завершён.")
-        # Очищаем данные
-        if camera.id in camera_streams:
-            del camera_streams[camera.id]
+        loop.call_soon_threadsafe(_release_stream, stream["id"], stream)
+
+
+def _enable_encoder(stream: Dict[str, Any], loop: asyncio.AbstractEventLoop):
+    """Переключает камеру со сквозной передачи на общий кодировщик."""
+    if not stream["running"]:
+        return
+    previous_packets = stream["packets"]
+    stream["encoder"] = SharedEncoder(stream, loop)
+    stream["packets"] = stream["encoder"].packets
+    previous_packets.close()  # Зрители переподпишутся на пакеты кодировщика
+
+
+def _close_stream(stream: Dict[str, Any]):
+    """Останавливает захват камеры и отключает всех потребителей её кадров и пакетов."""
+    stream["running"] = False
+    close_profiles(stream)
+    stream["broadcaster"].close()
+    stream["packets"].close()
+    if stream["encoder"] is not None:
+        stream["encoder"].close()
+
+
+def _release_stream(camera_id, stream: Dict[str, Any]):
+    """Очищает данные камеры, если они всё ещё принадлежат завершившемуся потоку."""
+    _close_stream(stream)
+    if camera_streams.get(camera_id) is stream:
+        del camera_streams[camera_id]
+        camera_tasks.pop(camera_id, None)
+        _forget_camera(camera_id)
+
+
+def _forget_camera(camera_id):
+    """Удаляет состояние камеры в диспетчере кадров и модулях (очереди, счётчики выборки)."""
+    if dispatcher is not None:
+        dispatcher.forget(camera_id)
+    ModuleManager.forget_camera(camera_id)
 
 
 async def start_camera(camera: Camera):
@@ -153,28 +141,111 @@ async def start_camera(camera: Camera):
         logger.info(f"Камера {camera.name} уже запущена.")
         return
 
-    camera_streams[camera.id] = {
+    if not camera.active:
+        return
+
+    loop = asyncio.get_running_loop()
+    stream = {
+        "id": camera.id,
+        "name": camera.name,
         "url": camera.url,
-        "frame": None,
-        "running": camera.active
+        "passthrough": bool(camera.passthrough),
+        "overlay_position": camera.overlay_position,
+        "overlay_text": camera.overlay_text,
+        "running": True,
+        "broadcaster": FrameBroadcaster(loop),  # Кадры: numpy array для WebRTC и JPEG для модулей
+        "profiles": {}  # Потоки дополнительных профилей разрешения, создаются по требованию
     }
-
-    if camera.active:
-        task = asyncio.create_task(video_capture(camera))
-        camera_tasks[camera.id] = task
-        logger.info(f"Камера {camera.name} запущена.")
+    if stream["passthrough"]:
+        # H.264 камеры передаётся зрителям без перекодирования
+        stream["encoder"] = None
+        stream["packets"] = PacketBroadcaster(loop)
+    else:
+        # H.264 для WebRTC-зрителей, общий кодировщик работает по требованию
+        stream["encoder"] = SharedEncoder(stream, loop)
+        stream["packets"] = stream["encoder"].packets
+    camera_streams[camera.id] = stream
+
+    if stream["passthrough"]:
+        # Сквозной захват не декодирует кадры и всегда выполняется в потоке основного процесса
+        thread = threading.Thread(
+            target=passthrough_capture,
+            args=(stream, loop),
+            name=f"capture-{camera.name}",
+            daemon=True
+        )
+        camera_tasks[camera.id] = thread
+        thread.start()
+    elif Config.settings().CAPTURE_MODE == "process":
+        # Захват в отдельном процессе, кадры передаются через разделяемую память
+        CaptureProcessPool.start_camera(
+            stream,
+            _frame_publisher(stream, loop),
+            lambda: loop.call_soon_threadsafe(_release_stream, stream["id"], stream)
+        )
+        camera_tasks[camera.id] = CaptureProcessPool
+    else:
+        # Чтение и обработка кадров выполняются в отдельном потоке на каждую камеру
+        thread = threading.Thread(
+            target=video_capture,
+            args=(stream, loop),
+            name=f"capture-{camera.name}",
+            daemon=True
+        )
+        camera_tasks[camera.id] = thread
+        thread.start()
+    logger.info(f"Камера {camera.name} запущена.")
+
+
+def get_frame_source(camera_id, profile: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Возвращает поток камеры (кадры и пакеты) в нужном профиле разрешения или None, если камера не запущена."""
+    stream = camera_streams.get(camera_id)
+    if stream is None or not stream["running"]:
+        return None
+    return get_profile_stream(stream, profile)
+
+
+async def get_latest_frame(stream: Dict[str, Any]) -> Optional[CameraFrame]:
+    """Последний кадр потока не старше LATEST_FRAME_MAX_AGE секунд или None, если кадров нет.
+
+    Запрос кадра отмечает спрос: камеры со сквозной передачей начинают декодировать
+    кадры, а профили разрешения — масштабировать, поэтому устаревший кадр заменяется новым.
+    """
+    broadcaster: FrameBroadcaster = stream["broadcaster"]
+    frame = await broadcaster.next_frame(0, FRAME_WAIT_TIMEOUT)
+    if frame is not None and time.time() - frame.timestamp > LATEST_FRAME_MAX_AGE:
+        frame = await broadcaster.next_frame(frame.seq, FRAME_WAIT_TIMEOUT) or frame
+    return frame
+
+
+async def get_frame_jpeg(frame: CameraFrame) -> bytes:
+    """JPEG кадра: уже сжатый при захвате или для модулей; иначе сжимается один раз для всех клиентов."""
+    if frame.jpeg is not None:
+        return frame.jpeg
+    return await asyncio.get_running_loop().run_in_executor(None, frame.jpeg_bytes)
 
 
 async def stop_camera(camera: Camera):
-    print(camera_streams.keys())
     """Метод останавливает захват камеры."""
     if camera.id not in camera_tasks:
         logger.info(f"Камера {camera.name} не запущена.")
         return
 
-    camera_streams[camera.id]["running"] = False
-    # await camera_tasks[camera.id]
+    stream = camera_streams.pop(camera.id, None)
+    if stream:
+        _close_stream(stream)
+    # Поток захвата завершится позже и уже не владеет камерой: его очистка сюда не дойдёт
+    _forget_camera(camera.id)
 
-    del camera_tasks[camera.id]
-    del camera_streams[camera.id]
+    if camera_tasks.pop(camera.id) is CaptureProcessPool:
+        CaptureProcessPool.stop_camera(camera.id)
     logger.info(f"Камера {camera.name} остановлена.")
+
+
+def shutdown_capture():
+    """Останавливает захват всех камер, в том числе рабочие процессы."""
+    for stream in camera_streams.values():
+        _close_stream(stream)
+    camera_streams.clear()
+    camera_tasks.clear()
+    CaptureProcessPool.shutdown()
@@ -3,11 +3,13 @@ from fastapi.openapi.utils import get_openapi
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.staticfiles import StaticFiles
-from app.routes import video, metrics, auth, cameras, module
+from app.routes import video, metrics, auth, cameras, module, results, recordings, hls
 from app.services.database_service import *
 from app.services.camera_service import get_camera_list
 from app.services.module_service import ModuleManager
-from app.services.video_service import start_camera
+from app.services.recording_service import ClipCache
+from app.services.result_service import ResultStore
+from app.services.video_service import start_camera, shutdown_capture
 from app.logger import LoggerSingleton
 
 # Получаем логгер
@@ -44,6 +46,7 @@ async def init_app():
 
     logger.info("Инициализация базы данных...")
     init_db()
+    ResultStore.start()
 
     logger.info("Инициализация модулей...")
     ModuleManager.initialize_modules()
@@ -62,6 +65,9 @@ async def init_app():
     app.include_router(auth.router, prefix="/auth", tags=["auth"])
     app.include_router(cameras.router, prefix="/cameras", tags=["cameras"])
     app.include_router(module.router, prefix="/modules", tags=["modules"])
+    app.include_router(results.router, tags=["results"])
+    app.include_router(recordings.router, prefix="/recordings", tags=["recordings"])
+    app.include_router(hls.router, prefix="/hls", tags=["hls"])
 
     # Подключение статических файлов (клиент)
     logger.info("Монтирование клиентских статических файлов...")
@@ -69,6 +75,19 @@ async def init_app():
 
 
 async def close_app():
+    logger.info("Остановка захвата видео...")
+    shutdown_capture()
+
+    logger.info("Остановка модулей...")
+    ModuleManager.shutdown()
+    await ModuleManager.close_clients()
+
+    logger.info("Запись результатов модулей...")
+    await ResultStore.stop()
+
+    logger.info("Удаление временных клипов записи...")
+    ClipCache.clear()
+
     logger.info("Закрытие соединения с базой данных...")
     close_db()
 
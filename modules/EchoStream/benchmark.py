@@ -0,0 +1,98 @@
+﻿"""Сравнение пропускной способности сетевого модуля: запрос на кадр (HTTP) и поток (WebSocket).
+
+Запуск: python -m modules.EchoStream.benchmark --frames 500 --delay 5
+Эхо-модуль поднимается в этом же процессе, кадры отправляются через ModuleManager
+так же, как при работе сервера.
+"""
+import argparse
+import asyncio
+import time
+
+import numpy as np
+from aiohttp import web
+
+from app.config import Config
+from app.services.frame_service import CameraFrame
+from app.services.module_service import ModuleManager
+from modules.Module import Module
+from modules.EchoStream.server import create_app
+
+
+def make_frames(count: int, width: int, height: int):
+    # Плавный градиент с шумом: JPEG по размеру близок к кадру камеры
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    noise = np.random.randint(0, 16, (height, width, 3)).astype(np.float32)
+    image = np.clip(gradient + noise, 0, 255).astype(np.uint8)
+    frame = CameraFrame(1, image, None, True, time.time())
+    jpeg = frame.jpeg_bytes()
+    return [CameraFrame(seq, image, jpeg, True, time.time()) for seq in range(1, count + 1)]
+
+
+async def run_http(module: Module, frames, concurrency: int) -> float:
+    """Кадры отправляются запросами /proceed, не больше concurrency одновременно."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(frame):
+        async with semaphore:
+            data = {"frame": frame, "camera_id": "bench", "camera_name": "bench"}
+            await ModuleManager._process_network_request(module, data, frame.jpeg)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send(frame) for frame in frames))
+    return time.perf_counter() - started
+
+
+async def run_stream(module: Module, frames) -> float:
+    """Кадры отправляются в поток подряд; ждём, пока придут все результаты."""
+    stream = ModuleManager._get_stream(module)
+    stream._ensure_connection()
+    while not stream.connected:
+        await asyncio.sleep(0.01)
+
+    started = time.perf_counter()
+    for frame in frames:
+        data = {"frame": frame, "camera_id": "bench", "camera_name": "bench"}
+        # Окно заполнено — ждём результатов, чтобы не терять кадры в замере
+        while stream.get_stats()["in_flight"] >= stream.window:
+            await asyncio.sleep(0.001)
+        await ModuleManager._process_stream_request(module, data, frame.jpeg)
+    while stream.results < stream.sent:
+        await asyncio.sleep(0.001)
+    return time.perf_counter() - started
+
+
+async def main(args):
+    runner = web.AppRunner(create_app(args.delay / 1000))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", args.port)
+    await site.start()
+
+    frames = make_frames(args.frames, args.width, args.height)
+    http_module = Module("echo-http", "network", f"http://127.0.0.1:{args.port}")
+    stream_module = Module("echo-ws", "network", f"ws://127.0.0.1:{args.port}")
+    try:
+        http_time = await run_http(http_module, frames, args.concurrency)
+        stream_time = await run_stream(stream_module, frames)
+        stats = ModuleManager.get_stats()
+    finally:
+        await ModuleManager.close_clients()
+        await runner.cleanup()
+
+    size_kb = len(frames[0].jpeg) / 1024
+    print(f"Кадров: {args.frames}, {args.width}x{args.height}, JPEG {size_kb:.0f} КБ, обработка {args.delay} мс")
+    print(f"HTTP (одновременно {args.concurrency}): {args.frames / http_time:8.1f} кадр/с")
+    print(f"WebSocket (окно {Config.settings().MODULE_STREAM_WINDOW}): {args.frames / stream_time:8.1f} кадр/с")
+    for name, module_stats in stats.items():
+        for kind, latency in module_stats.get("latency", {}).items():
+            print(f"{name} {kind}: p50 {latency['p50_ms']} мс, p95 {latency['p95_ms']} мс")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк транспорта сетевых модулей")
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--delay", type=float, default=5.0, help="Время обработки кадра модулем, мс")
+    parser.add_argument("--concurrency", type=int, default=1, help="Одновременных HTTP-запросов")
+    parser.add_argument("--port", type=int, default=8101)
+    asyncio.run(main(parser.parse_args()))
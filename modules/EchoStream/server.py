@@ -0,0 +1,88 @@
+﻿"""Эхо-модуль для проверки сетевых модулей: HTTP (/proceed) и потоковый канал (/stream).
+
+Запуск: python -m modules.EchoStream.server --port 8100 [--delay 5]
+Адрес модуля в VideoServer: http://host:8100 (запрос на кадр) или ws://host:8100 (поток).
+"""
+import argparse
+import asyncio
+import json
+import struct
+import time
+
+from aiohttp import web
+
+HEADER_SIZE = struct.Struct(">I")
+
+
+def parse_frame(message: bytes):
+    """Разбирает бинарное сообщение потока: длина заголовка, JSON-заголовок, JPEG."""
+    (header_length,) = HEADER_SIZE.unpack_from(message)
+    header_end = HEADER_SIZE.size + header_length
+    header = json.loads(message[HEADER_SIZE.size:header_end])
+    return header, memoryview(message)[header_end:]
+
+
+def make_result(header: dict, payload) -> dict:
+    return {
+        "camera_id": header.get("camera_id"),
+        "seq": header.get("seq"),
+        "timestamp": header.get("timestamp"),
+        "size": len(payload),
+        "processed_at": time.time(),
+    }
+
+
+def create_app(delay: float = 0.0) -> web.Application:
+    """Создаёт приложение эхо-модуля; delay — имитация времени обработки кадра, с."""
+
+    async def getinfo(request: web.Request) -> web.Response:
+        return web.json_response({"name": "EchoStream", "transports": ["http", "ws"], "delay": delay})
+
+    async def proceed(request: web.Request) -> web.Response:
+        payload = await request.read()
+        header = {
+            "camera_id": request.headers.get("X-Camera-Id"),
+            "seq": int(request.headers.get("X-Frame-Seq", 0)),
+            "timestamp": float(request.headers.get("X-Frame-Timestamp", 0)),
+        }
+        if delay:
+            await asyncio.sleep(delay)
+        return web.json_response(make_result(header, payload))
+
+    async def stream(request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(max_msg_size=0)
+        await ws.prepare(request)
+        pending = set()
+
+        async def answer(header: dict, payload):
+            # Кадры обрабатываются параллельно, результаты уходят по мере готовности
+            if delay:
+                await asyncio.sleep(delay)
+            if not ws.closed:
+                await ws.send_str(json.dumps(make_result(header, payload)))
+
+        async for message in ws:
+            if message.type != web.WSMsgType.BINARY:
+                continue
+            header, payload = parse_frame(message.data)
+            task = asyncio.create_task(answer(header, payload))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        for task in pending:
+            task.cancel()
+        return ws
+
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_get("/getinfo", getinfo)
+    app.router.add_post("/proceed", proceed)
+    app.router.add_get("/stream", stream)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Эхо-модуль VideoServer")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--delay", type=float, default=0.0, help="Время обработки кадра, мс")
+    args = parser.parse_args()
+    web.run_app(create_app(args.delay / 1000), host=args.host, port=args.port)
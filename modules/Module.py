@@ -1,7 +1,21 @@
-﻿import base64
+﻿from typing import Optional
+
+from app.config import Config
+from app.logger import LoggerSingleton
+from app.services.module_log_service import ModuleLog
+
+logger = LoggerSingleton.get_logger()
+
+LOG_METHODS = {"debug": logger.debug, "info": logger.info, "warning": logger.warning, "error": logger.error}
 
 
 class Module:
+    resolution = None  # Профиль разрешения кадров для модуля ("720p", "360p"...), None — полное разрешение
+    queue_size = None  # Размер очереди кадров модуля, None — MODULE_QUEUE_SIZE из настроек
+    queue_policy = None  # "drop_oldest" или "drop_newest", None — MODULE_QUEUE_POLICY из настроек
+    records_packets = False  # Модуль сам берёт сжатые пакеты камер со сквозной передачей, их кадры ему не нужны
+    log_size = None  # Записей в журнале модуля, None — MODULE_LOG_SIZE из настроек
+
     def __init__(self, name, module_type, address=None, enabled=False, loaded_class = None):
         """Модуль может быть сетевым или локальным"""
         self.name = name
@@ -9,9 +23,43 @@ class Module:
         self.address = address  # URL для сетевых модулей или путь к файлу для локальных
         self.enabled = enabled
         self.loaded_class = loaded_class
+        self._log = ModuleLog(self.log_size or Config.settings().MODULE_LOG_SIZE)  # Журнал модуля, см. add_log
+
+    @property
+    def log(self) -> ModuleLog:
+        """Журнал модуля; у подклассов без вызова Module.__init__ создаётся при первой записи."""
+        log = self.__dict__.get("_log")
+        if log is None:
+            log = self._log = ModuleLog(self.log_size or Config.settings().MODULE_LOG_SIZE)
+        return log
+
+    def add_log(self, message: str, level: str = "info", camera: Optional[str] = None):
+        """Добавляет запись в журнал модуля и в журнал сервера."""
+        self.log.add(message, level, camera)
+        prefix = f"[{camera}] " if camera else ""
+        LOG_METHODS[level](f"{self.name}: {prefix}{message}")
 
-    def proceed(self, data : base64):
-        """Обработка данных"""
+    def get_logs(self, **query) -> dict:
+        """Страница журнала модуля, параметры — как у ModuleLog.query."""
+        return self.log.query(**query)
+
+    def start(self):
+        """Вызывается при включении модуля: здесь загружаются модели, открываются файлы и т.д."""
+
+    def stop(self):
+        """Вызывается при выключении модуля; после stop модуль может быть снова запущен."""
+
+    def finalize(self):
+        """Вызывается один раз при остановке сервера после stop."""
+
+    def proceed(self, data: dict):
+        """Обработка кадра.
+
+        data["frame"] — CameraFrame: numpy array в frame.image (BGR), JPEG — frame.jpeg_bytes();
+        data["camera_id"] и data["camera_name"] — камера, с которой получен кадр.
+        Возвращённый результат (детекции, события и т.д., сериализуемые в JSON) сохраняется
+        в ResultStore; None — результата нет.
+        """
         raise NotImplementedError("Each module must implement the 'proceed' function.")
 
     def get_info(self):
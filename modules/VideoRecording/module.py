@@ -1,116 +1,248 @@
-﻿import base64
-import cv2
-import os
-from datetime import datetime
-import numpy as np
+﻿import os
+import threading
+from collections import deque
 from modules.Module import Module
-import time
+from app.config import Config
 from app.logger import LoggerSingleton  # Импортируем логгер
+from app.services.encoder_service import FrameEncoder
+from app.services.recording_service import EventMuxer, PacketRecorder, RecordingCatalog, SegmentMuxer
+from app.services.result_service import ResultStore
+from app.services.retention_service import RetentionManager
+from app.services.video_service import camera_streams
 
 logger = LoggerSingleton.get_logger()  # Получаем логгер
 
 
 class VideoRecording(Module):
-    recorders = {}  # Словарь для хранения записей по камерам
-    output_dir = "videos"
-    logs = []  # Список логов
+    """Запись камер в сегменты MP4/MKV ограниченной длины.
 
-    def __init__(self, name, module_type, address, enabled, output_dir="videos"):
+    Камеры со сквозной передачей H.264 записываются без декодирования: их пакеты
+    переносятся в сегменты как есть. Кадры остальных камер (MJPEG, USB и т.д.)
+    кодируются в H.264 с метками времени захвата (переменная частота кадров, без
+    дублирования кадров). Сегменты по RECORDING_SEGMENT_DURATION секунд закрываются
+    в фоне и добавляются в index.jsonl каталога камеры и в каталог записей в базе
+    данных (RecordingCatalog), по которому работают маршруты /recordings. Старые
+    сегменты удаляются по квотам RETENTION_* (RetentionManager).
+
+    В режиме RECORDING_MODE = "event" пишутся только события: последние
+    RECORDING_PRE_EVENT секунд хранятся в памяти в сжатом виде и попадают в файл,
+    когда в кадре есть изменения (кадры приходят в модуль только при изменениях,
+    см. CHANGE_DETECTION) или модуль вернул результат; запись идёт, пока события не
+    прекратятся на RECORDING_POST_EVENT секунд. Чтобы предзапись содержала и кадры
+    без изменений, в этом режиме все камеры записываются из общего потока пакетов
+    (общий кодировщик с настройками ENCODER_* или сквозная передача), а кадры модуля
+    только отмечают движение; RECORDING_BITRATE и RECORDING_PRESET в этом режиме не
+    действуют.
+    """
+    records_packets = True
+    WATCH_INTERVAL = 1.0  # Как часто проверять появление камер со сквозной передачей, с
+    REPORT_LOG_LINES = 100  # Последних записей журнала в HTML-отчёте; весь журнал — /modules/get_module_logs
+
+    def __init__(self, name, module_type, address, enabled, output_dir="videos", segment_duration=None, container=None):
         super().__init__(name, module_type, address, enabled)
-        VideoRecording.output_dir = output_dir
-        os.makedirs(VideoRecording.output_dir, exist_ok=True)
-
-    def add_log(self, log_message):
-        """Метод для добавления логов в систему."""
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        log_entry = f"[{timestamp}] {log_message}"
-        VideoRecording.logs.append(log_entry)
-        logger.info(log_entry)  # Логирование добавленных сообщений
-
-    @staticmethod
-    def _initialize_writer(camera_id, frame):
-        """Инициализация нового файла для записи для указанной камеры."""
-        now = datetime.now()
-        camera_dir = os.path.join(VideoRecording.output_dir, str(camera_id))
-        os.makedirs(camera_dir, exist_ok=True)
-
-        filename = f"{camera_id}_{now.strftime('%Y%m%d_%H%M%S')}.avi"
-        video_path = os.path.join(camera_dir, filename)
-
-        height, width, _ = frame.shape
-        frame_size = (width, height)
-
-        writer = cv2.VideoWriter(
-            video_path,
-            cv2.VideoWriter_fourcc(*"XVID"),
-            30,  # Установленная частота кадров
-            frame_size,
+        settings = Config.settings()
+        self.output_dir = output_dir
+        self.segment_duration = segment_duration or settings.RECORDING_SEGMENT_DURATION  # Длительность сегмента, с
+        self.container = container or settings.RECORDING_CONTAINER  # "mp4" или "mkv"
+        self.mode = settings.RECORDING_MODE  # "continuous" или "event"
+        self.triggers = set(settings.RECORDING_TRIGGERS)  # "motion" и/или "results"
+        self.trigger_modules = set(settings.RECORDING_TRIGGER_MODULES)
+        if self.mode == "event" and "motion" in self.triggers:
+            # Движение определяется по кадрам: камеры со сквозной передачей придётся декодировать
+            self.records_packets = False
+        self.event_muxers = {}  # Записи по событиям по идентификатору камеры (строкой, как в результатах модулей)
+        self.recorders = {}  # Словарь для хранения записей по камерам: кодировщик и сегменты
+        self.packet_recorders = {}  # Записи пакетов камер со сквозной передачей
+        self._packet_lock = threading.Lock()
+        self._watcher = None
+        self._watch_stop = threading.Event()
+        self.segments = deque(maxlen=100)  # Последние завершённые сегменты
+
+    def _create_muxer(self, camera_id, camera_name):
+        directory = os.path.join(self.output_dir, str(camera_id))
+        if self.mode != "event":
+            return SegmentMuxer(
+                camera_id,
+                directory,
+                self.segment_duration,
+                self.container,
+                camera_name=camera_name,
+                on_segment=self.segments.append
+            )
+
+        settings = Config.settings()
+        muxer = EventMuxer(
+            camera_id,
+            directory,
+            self.segment_duration,
+            self.container,
+            camera_name=camera_name,
+            on_segment=self.segments.append,
+            pre_event=settings.RECORDING_PRE_EVENT,
+            post_event=settings.RECORDING_POST_EVENT
         )
-        VideoRecording.recorders[camera_id] = {
-            "writer": writer,
-            "video_path": video_path,
-            "last_frame_time": None,
+        self.event_muxers[str(camera_id)] = muxer
+        return muxer
+
+    def _on_result(self, entry):
+        """Результат другого модуля по камере запускает запись события."""
+        if entry["module"] == self.name or not entry["data"]:
+            return
+        if self.trigger_modules and entry["module"] not in self.trigger_modules:
+            return
+        muxer = self.event_muxers.get(entry["camera_id"])
+        if muxer is not None:
+            muxer.trigger(f"module:{entry['module']}", entry["frame_timestamp"])
+
+    def _initialize_writer(self, camera_id, camera_name):
+        """Создание кодировщика и записи сегментов для указанной камеры."""
+        settings = Config.settings()
+        muxer = self._create_muxer(camera_id, camera_name)
+        self.recorders[camera_id] = {
+            "encoder": FrameEncoder(
+                settings.RECORDING_BITRATE,
+                settings.RECORDING_PRESET,
+                settings.ENCODER_KEYFRAME_INTERVAL
+            ),
+            "muxer": muxer,
         }
 
         # Логирование
-        VideoRecording.add_log(f"Запись для камеры {camera_id} начата, сохраняется в {video_path}")
+        self.add_log(f"Запись начата, сегменты сохраняются в {muxer.directory}", camera=camera_name)
 
-    @staticmethod
-    def _finalize_writer(camera_id):
+    def _is_packet_source(self, camera_id) -> bool:
+        """Камера записывается из потока пакетов: при сквозной передаче H.264 и в режиме событий."""
+        stream = camera_streams.get(camera_id)
+        if stream is None:
+            return False
+        if self.mode == "event":
+            return True
+        return stream["encoder"] is None and bool(stream.get("video_size"))
+
+    def _watch_packet_sources(self):
+        """Запускает запись пакетов для камер со сквозной передачей; выполняется в отдельном потоке."""
+        while not self._watch_stop.wait(self.WATCH_INTERVAL):
+            for camera_id, stream in list(camera_streams.items()):
+                if not stream["running"] or not self._is_packet_source(camera_id):
+                    continue
+                with self._packet_lock:
+                    recorder = self.packet_recorders.get(camera_id)
+                    if recorder is not None and recorder.stream is stream and not recorder.finished.is_set():
+                        continue
+                    if self._watch_stop.is_set():
+                        return
+                    self.packet_recorders[camera_id] = PacketRecorder(
+                        stream,
+                        self._create_muxer(camera_id, stream["name"]),
+                        any_source=self.mode == "event"
+                    )
+                self.add_log("Запись начата из потока пакетов камеры", camera=stream["name"])
+
+            with self._packet_lock:
+                for camera_id, recorder in list(self.packet_recorders.items()):
+                    if recorder.finished.is_set():
+                        del self.packet_recorders[camera_id]
+
+    def _finalize_writer(self, camera_id):
         """Завершение записи для указанной камеры."""
-        if camera_id in VideoRecording.recorders:
-            recorder = VideoRecording.recorders[camera_id]
-            if recorder["writer"]:
-                recorder["writer"].release()
-            del VideoRecording.recorders[camera_id]
+        if camera_id in self.recorders:
+            recorder = self.recorders.pop(camera_id)
+            muxer = recorder["muxer"]
+            muxer.close(wait=True)
 
             # Логирование
-            VideoRecording.add_log(f"Запись для камеры {camera_id} завершена, файл сохранен по пути {recorder['video_path']}")
+            self.add_log(f"Запись завершена, сегментов: {muxer.segments_written}", camera=muxer.camera_name)
 
-    def proceed(self, data: base64):
-        """Обрабатывает кадры для указанной камеры и сохраняет их в соответствующий видеофайл."""
-        frame64_bytes = data.get("frame_bytes")
-        frame_bytes = base64.b64decode(frame64_bytes)
-        camera_id = data.get("camera_name")
+    def start(self):
+        """Готовит каталог для записей; файлы открываются с первым кадром или пакетом камеры."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        # Сегменты, записанные без базы данных или прерванные аварийной остановкой
+        RecordingCatalog.sync_later(self.output_dir)
+        RetentionManager.start(self.output_dir)
+        if self.mode == "event" and "results" in self.triggers:
+            ResultStore.add_listener(self._on_result)
+        if self._watcher is None:
+            self._watch_stop.clear()
+            self._watcher = threading.Thread(target=self._watch_packet_sources, name=f"{self.name}-watch", daemon=True)
+            self._watcher.start()
+
+    def stop(self):
+        """При выключении модуля текущие записи закрываются."""
+        self.finalize()
+
+    def proceed(self, data: dict):
+        """Кодирует кадр камеры и записывает его в текущий сегмент."""
+        camera_id = data.get("camera_id")
+        camera_name = data.get("camera_name", camera_id)
 
         try:
-            frame = np.frombuffer(frame_bytes, dtype=np.uint8)
-            frame = cv2.imdecode(frame, cv2.IMREAD_COLOR)
-            if frame is None:
-                VideoRecording.add_log(f"[{camera_id}] Неверные данные кадра, пропуск...")  # Логирование ошибки
+            frame = data.get("frame")
+            if frame is None or frame.image is None:
+                self.add_log("Неверные данные кадра, пропуск...", level="warning", camera=camera_name)
                 return
 
-            if camera_id not in VideoRecording.recorders:
-                VideoRecording._initialize_writer(camera_id, frame)
+            if self._is_packet_source(camera_id):
+                # Камера записывается из потока пакетов, кадр нужен только для движения
+                if camera_id in self.recorders:
+                    self._finalize_writer(camera_id)
+                muxer = self.event_muxers.get(str(camera_id))
+                if muxer is not None and "motion" in self.triggers:
+                    muxer.trigger("motion", frame.timestamp)
+                return
 
-            recorder = VideoRecording.recorders[camera_id]
-            current_time = time.time()
+            if camera_id not in self.recorders:
+                self._initialize_writer(camera_id, camera_name)
 
-            if recorder["last_frame_time"] is None:
-                recorder["last_frame_time"] = current_time
-            else:
-                elapsed_time = current_time - recorder["last_frame_time"]
-                recorder["last_frame_time"] = current_time
-                num_repeats = max(1, int(30 * elapsed_time))
-                for _ in range(num_repeats):
-                    recorder["writer"].write(frame)
+            recorder = self.recorders[camera_id]
+            encoder, muxer = recorder["encoder"], recorder["muxer"]
+            if muxer.wants_keyframe:
+                # Сегмент набрал длину: ключевой кадр сразу, а не по интервалу кодировщика
+                encoder.request_keyframe()
+            height, width = frame.image.shape[:2]
+            for packet in encoder.encode(frame):
+                muxer.write(packet, width, height, frame.timestamp)
         except Exception as e:
-            VideoRecording.add_log(f"[{camera_id}] Ошибка при записи видео: {e}")  # Логирование ошибки
+            recorder = self.recorders.get(camera_id)
+            if recorder is not None:
+                recorder["encoder"].reset()
+            self.add_log(f"Ошибка при записи видео: {e}", level="error", camera=camera_name)
 
     def finalize(self):
         """Завершает запись для всех камер."""
-        for camera_id in list(VideoRecording.recorders.keys()):
-            VideoRecording._finalize_writer(camera_id)
+        ResultStore.remove_listener(self._on_result)
+        RetentionManager.stop()
+        self._watch_stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+        with self._packet_lock:
+            packet_recorders = list(self.packet_recorders.values())
+            self.packet_recorders.clear()
+        for recorder in packet_recorders:
+            recorder.close(wait=True)
+            self.add_log(
+                f"Запись завершена, сегментов: {recorder.muxer.segments_written}",
+                camera=recorder.muxer.camera_name
+            )
+        for camera_id in list(self.recorders.keys()):
+            self._finalize_writer(camera_id)
+        self.event_muxers.clear()
 
     def get_detailed_info(self):
         """Переопределение для предоставления детализированной информации о модуле записи видео."""
         files = []
-        for camera_id, recorder in VideoRecording.recorders.items():
-            files.append(recorder["video_path"])
+        muxers = [recorder["muxer"] for recorder in list(self.recorders.values())]
+        muxers += [recorder.muxer for recorder in list(self.packet_recorders.values())]
+        for muxer in muxers:
+            current = muxer.current
+            if current is not None:
+                files.append(f"{current['path']} (идёт запись)")
+        for segment in reversed(list(self.segments)):
+            files.append(f"{segment['path']} ({segment['duration']:.0f} с, {segment['size'] // 1024} КБ)")
 
         return {
             "recorded_files": files,
-            "logs": VideoRecording.logs
+            "logs": self.log.tail(self.REPORT_LOG_LINES)
         }
 
     def get_info(self):
@@ -1,9 +1,11 @@
-﻿import cv2
-import base64
+﻿import av
+import cv2
 import os
 import unittest
 import time
 
+from app.services.frame_service import CameraFrame
+from app.services.recording_service import read_segment_index
 from modules.VideoRecording.module import VideoRecording
 
 
@@ -17,7 +19,7 @@ class TestVideoRecording(unittest.TestCase):
             address="test_address",
             enabled=True,
             output_dir="test_videos",
-            fps=30,
+            segment_duration=10,
         )
         # Удаляем папку, если она существует, чтобы тест всегда был чистым
         if os.path.exists("test_videos"):
@@ -26,6 +28,7 @@ class TestVideoRecording(unittest.TestCase):
                     os.remove(os.path.join(root, file))
                 for dir in dirs:
                     os.rmdir(os.path.join(root, dir))
+        self.module.start()
 
     def test_video_recording(self):
         # Открываем камеру (по умолчанию будет использоваться первая камера)
@@ -44,44 +47,42 @@ class TestVideoRecording(unittest.TestCase):
             if not ret:
                 break
 
-            # Преобразуем кадр в base64 для передачи в метод proceed
-            _, frame_bytes = cv2.imencode(".jpg", frame)
-            frame64_bytes = base64.b64encode(frame_bytes).decode("utf-8")
-
-            # Отправляем кадр в обработку
-            data = {"frame_bytes": frame64_bytes, "camera_name": camera_id}
+            # Отправляем кадр в обработку так же, как это делает сервер
+            camera_frame = CameraFrame(frame_count + 1, frame, None, True, time.time())
+            data = {"frame": camera_frame, "camera_id": camera_id, "camera_name": camera_id}
             self.module.proceed(data)
 
             frame_count += 1
 
         # Закрываем камеру
         cap.release()
+        elapsed = time.time() - start_time
 
         # Проверяем, что видеофайл был создан
         video_dir = os.path.join("test_videos", camera_id)
         self.assertTrue(os.path.exists(video_dir), "Директория с видео не была создана")
 
-        # Получаем список файлов в директории
-        video_files = os.listdir(video_dir)
-        self.assertGreater(len(video_files), 0, "Видео файлы не были созданы")
-
-        # Ожидаем, что файл видео будет в формате .avi
-        video_file = video_files[0]
-        self.assertTrue(video_file.endswith(".avi"), f"Ожидался файл с расширением .avi, но получен {video_file}")
-
-        # Завершаем запись
+        # Завершаем запись: сегменты закрываются и попадают в индекс
         self.module.finalize()
 
-        # Проверяем, что файл был сохранен
-        video_path = os.path.join(video_dir, video_file)
-        self.assertTrue(os.path.exists(video_path), "Видео файл не был сохранен")
+        # Получаем список сегментов в директории
+        video_files = sorted(f for f in os.listdir(video_dir) if f.endswith(".mp4"))
+        self.assertGreater(len(video_files), 0, "Видео файлы не были созданы")
 
-        # Проверяем продолжительность видео
-        video_capture = cv2.VideoCapture(video_path)
-        fps = video_capture.get(cv2.CAP_PROP_FPS)
-        frame_count = int(video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
-        duration = frame_count / fps
-        self.assertAlmostEqual(duration, 30, delta=1, msg="Длительность видео не соответствует 30 секундами.")
+        # 30 секунд записи сегментами по 10 секунд (сегмент закрывается на ключевом кадре)
+        self.assertGreaterEqual(len(video_files), 2, "Запись не была разбита на сегменты")
+        segments = read_segment_index(video_dir)
+        self.assertEqual(len(segments), len(video_files), "Не все сегменты попали в индекс")
+
+        # Проверяем продолжительность видео по меткам времени кадров
+        duration = 0.0
+        for video_file in video_files:
+            with av.open(os.path.join(video_dir, video_file)) as container:
+                stream = container.streams.video[0]
+                pts = [frame.pts for frame in container.decode(stream)]
+                duration += float((max(pts) - min(pts)) * stream.time_base)
+        self.assertAlmostEqual(duration, elapsed, delta=1 + len(video_files) * 0.2,
+                               msg="Длительность записи не соответствует времени захвата.")
     #
     # def tearDown(self):
     #     # Удаляем все файлы и папки, чтобы тесты не влияли друг на друга